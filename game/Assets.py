@@ -0,0 +1,162 @@
+import pygame
+import threading
+
+# Process-wide image cache behind load_image.
+# Every image is decoded and converted once, then the same Surface is
+# shared by every sprite that asks for it (nothing draws onto these, and
+# transforms always make new surfaces). Levels can preload their images
+# as a named group, and evict the group once they are done with it.
+# prefetch() decodes images ahead of time on any thread, and
+# decodeInBackground() hands them to a pool of threads (decoding doesn't
+# hold the GIL). Either way they are only converted for the display, which
+# has to happen on the main thread, when they are first asked for or by
+# convertDecoded(). Prefetches name a group too, so a level that is never
+# played can evict the images fetched for it.
+
+class AssetManager(object):
+
+    def __init__(self):
+        self.images = {} # (path, colorkey, alpha) -> Surface
+        self.groups = {} # group name -> keys preloaded for it
+        self.loadCounts = {} # path -> times it was decoded
+        self.decoded = {} # path -> Surface prefetched but not converted yet
+        self.prefetched = {} # group name -> paths prefetched for it
+        self.prefetching = threading.Lock() # one prefetch at a time
+        self.decoding = {} # path -> pool result for it
+        self.waiting = [] # images decoding in the pool, not converted yet
+        self.pool = None
+        self.hits = self.evictions = 0
+
+    def getImage(self, path, colorkey = None, alpha = False):
+        key = self.makeKey(path, colorkey, alpha)
+        if key in self.images:
+            self.hits += 1
+        else:
+            self.images[key] = self.loadImage(path, colorkey, alpha)
+        return self.images[key]
+
+    def loadImage(self, path, colorkey = None, alpha = False):
+        image = self.decoded.pop(path, None)
+        if image is None and path in self.decoding:
+            image = self.decoding.pop(path).get() # waits if not done yet
+        if image is None:
+            image = self.decodeImage(path)
+        image = image.convert()
+        if colorkey is not None:
+            if colorkey is -1:
+                colorkey = image.get_at((0,0))
+            image.set_colorkey(colorkey)
+        if alpha:
+            image = image.convert_alpha()
+        return image
+
+    def decodeImage(self, path):
+        try:
+            image = pygame.image.load(path)
+        except pygame.error, message:
+            print 'Cannot load image:', path
+            raise SystemExit, message
+        self.loadCounts[path] = self.loadCounts.get(path, 0) + 1
+        return image
+
+    def prefetch(self, group, images):
+        # Same arguments as preload; safe to call from a background thread
+        with self.prefetching:
+            paths = self.prefetched.setdefault(group, set())
+            for image in images:
+                if not isinstance(image, tuple):
+                    image = (image,)
+                path = image[0]
+                key = self.makeKey(*image)
+                paths.add(path)
+                if (key in self.images or path in self.decoded or
+                    path in self.decoding):
+                    continue
+                self.decoded[path] = self.decodeImage(path)
+
+    def decodeInBackground(self, images, workers = 4):
+        # Same arguments as preload. Call convertDecoded() every frame or
+        # so to convert them as they arrive.
+        if self.pool == None:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(workers)
+        for image in images:
+            if not isinstance(image, tuple):
+                image = (image,)
+            path = image[0]
+            self.waiting += [image]
+            if (self.makeKey(*image) in self.images or
+                path in self.decoded or path in self.decoding):
+                continue
+            self.decoding[path] = self.pool.apply_async(self.tryDecode,
+                (path,))
+
+    def tryDecode(self, path):
+        # For the pool: a failed decode gets retried (and reported) on the
+        # main thread, instead of killing the worker
+        try:
+            return self.decodeImage(path)
+        except SystemExit:
+            return None
+
+    def convertDecoded(self):
+        # Converts the background decodes that have finished; returns how
+        # many images are still on their way
+        for image in self.waiting[:]:
+            result = self.decoding.get(image[0])
+            if result == None or result.ready():
+                self.getImage(*image)
+                self.waiting.remove(image)
+        return len(self.waiting)
+
+    # Lifetimes
+
+    def makeKey(self, path, colorkey = None, alpha = False):
+        return (path, colorkey, alpha)
+
+    def preload(self, group, images):
+        # Each image is a path, or a tuple of arguments for getImage
+        keys = self.groups.setdefault(group, set())
+        for image in images:
+            if not isinstance(image, tuple):
+                image = (image,)
+            self.getImage(*image)
+            keys.add(self.makeKey(*image))
+
+    def evict(self, group):
+        # Forgets a group's images, unless another group still wants them.
+        # Sprites still holding one keep it alive until they go away too.
+        keys = self.groups.pop(group, set())
+        for otherKeys in self.groups.values():
+            keys = keys - otherKeys
+        for key in keys:
+            if key in self.images:
+                del self.images[key]
+                self.evictions += 1
+        # and the images prefetched for it that nobody converted
+        with self.prefetching:
+            paths = self.prefetched.pop(group, set())
+            for otherPaths in self.prefetched.values():
+                paths = paths - otherPaths
+            for path in paths:
+                if self.decoded.pop(path, None) is not None:
+                    self.evictions += 1
+
+    def clear(self):
+        self.images.clear()
+        self.groups.clear()
+        self.decoded.clear()
+        self.prefetched.clear()
+        self.decoding.clear()
+        self.waiting = []
+
+    def stats(self):
+        size = 0
+        for image in self.images.values():
+            width, height = image.get_size()
+            size += width*height*image.get_bytesize()
+        return {'images': len(self.images), 'bytes': size,
+            'loads': sum(self.loadCounts.values()), 'hits': self.hits,
+            'evictions': self.evictions, 'groups': len(self.groups)}
+
+assets = AssetManager()
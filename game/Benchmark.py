@@ -0,0 +1,382 @@
+import sys
+import time
+import json
+import math
+import argparse
+import pygame
+from GlobalFunctions import *
+from Classes import *
+from World import *
+from Level import *
+from ComputerLevel import *
+
+# Headless benchmark suite.
+# Plays every shipped level for a number of frames (a world step and a
+# redraw each) with a fixed seed and scripted controls, timing the phases
+# of each frame, and times the hot primitives on their own. Every
+# benchmark is repeated, and the samples saved as JSON; --compare checks
+# them against a saved run, with Welch's t-test, and flags the benchmarks
+# that got significantly slower.
+#
+# --pixel-collisions plays the levels with pixel-accurate collisions (see
+# GameWorld.collide); comparing such a run against a plain one shows what
+# the mask narrow phase adds to each level's collisions. The spritesHit
+# and stormHit primitives time both kinds of test on their own.
+#
+#   python Benchmark.py [--frames N] [--repeats R] [--save results.json]
+#       [--compare baseline.json] [--only name] [--pixel-collisions]
+
+levelRuns = [('level1', GameLevel, 'Levels/level1'),
+    ('level2', GameLevel, 'Levels/level2'),
+    ('level3', GameLevel, 'Levels/level3'),
+    ('storm', GameLevel, 'Levels/storm'),
+    ('level2p1', TwoPlayerLevel, 'Levels/level2p1'),
+    ('boss', ComputerLevel, 'Levels/level2p1')]
+
+# Phases of a frame: world methods (or level methods) that get timed
+framePhases = [('ai', 'world', 'updateComputerPlayer'),
+    ('collisions', 'world', 'handleCollisions'),
+    ('update', 'world', 'update'),
+    ('draw', 'level', 'redrawAll')]
+
+class BenchmarkClock(object):
+    def tick(self, frameRate = 0):
+        return 0
+
+def scriptedInputs(frame, players):
+    # Walk one way for a while, then the other, jumping now and then
+    inputs = []
+    for player in players:
+        if frame % 7 == player:
+            inputs += [(player, 0)]
+        elif frame % 3 == 0:
+            inputs += [(player, [1, -1][(frame/40 + player) % 2])]
+    return inputs
+
+# Levels
+
+class PhaseTimer(object):
+
+    # Wraps methods of one object, adding up the time spent in each
+
+    def __init__(self):
+        self.times = {}
+        self.wrapped = []
+
+    def wrap(self, target, name, method):
+        original = getattr(target, method, None)
+        if original == None:
+            return
+        times = self.times
+        times.setdefault(name, 0.0)
+        def timed(*args):
+            start = time.time()
+            result = original(*args)
+            times[name] += time.time() - start
+            return result
+        setattr(target, method, timed)
+        self.wrapped += [(target, method)]
+
+    def detach(self):
+        # (Before a new timer wraps the same level, so they don't nest)
+        for target, method in self.wrapped:
+            if method in target.__dict__:
+                delattr(target, method)
+        self.wrapped = []
+
+def addTimes(total, times):
+    for name, value in times.items():
+        total[name] = total.get(name, 0.0) + value
+
+def startLevel(level, screen, seed):
+    level.seed = seed
+    level.start(screen.get_size(), screen, BenchmarkClock())
+    level.mode = None
+    level.BossInstructions = False
+    timer = PhaseTimer()
+    for name, owner, method in framePhases:
+        if owner == 'world':
+            timer.wrap(level.world, name, method)
+        else:
+            timer.wrap(level, name, method)
+    return timer
+
+def playLevel(levelType, file, frames, seed, screen):
+    level = levelType(file)
+    players = [1]
+    if isinstance(level, TwoPlayerLevel) and levelType != ComputerLevel:
+        players = [1, 2]
+    timer = startLevel(level, screen, seed)
+    phases = {}
+    stepTime = 1.0/level.stepRate
+    restarts = 0
+    start = time.time()
+    for frame in xrange(frames):
+        level.inputs += scriptedInputs(frame, players)
+        level.stepWorld(stepTime)
+        level.redrawAll(1)
+        if level.mode != None:
+            # Level over; play it again to make up the frames
+            addTimes(phases, timer.times)
+            timer.detach()
+            timer = startLevel(level, screen, seed + restarts + 1)
+            restarts += 1
+    total = time.time() - start
+    addTimes(phases, timer.times)
+    timer.detach()
+    level.close()
+    # Collisions happen inside update; the rest of update is sprite motion
+    phases['sprites'] = phases.pop('update') - phases['collisions']
+    result = {'frameTime': total/frames*1000, 'restarts': restarts}
+    for name in phases:
+        result[name] = phases[name]/frames*1000
+    return result
+
+# Primitives
+
+def benchmarkWorld(file = 'Levels/level1', worldType = GameWorld):
+    world = worldType(load_level(file), seed = 0)
+    if isinstance(world, TwoPlayerWorld):
+        world.placePlayers()
+    else:
+        world.placePlayer(300, 300)
+    return world
+
+def timePlatformRotate(count):
+    platform = Platform(300, 300)
+    angles = [math.sin(i/10.0)*2 for i in xrange(64)]
+    start = time.time()
+    for i in xrange(count):
+        platform.targetAngle = angles[i % 64]
+        platform.rotate(1)
+    return time.time() - start
+
+def timeGravityUpdate(count):
+    drop = Raindrop(300, 0)
+    start = time.time()
+    for i in xrange(count):
+        if i % 50 == 0:
+            drop.rect.topleft = (300, 0)
+            drop.vy = 0
+        drop.update(1)
+    return time.time() - start
+
+def timeOnPlatform(count):
+    world = benchmarkWorld()
+    platforms = list(world.platforms)
+    block = Raindrop(150, 280)
+    start = time.time()
+    for i in xrange(count):
+        platform = platforms[i % len(platforms)]
+        if world.isOnPlatform(block, platform):
+            world.getY(block, platform)
+    return time.time() - start
+
+def timeDropLocation(count):
+    world = benchmarkWorld('Levels/level2')
+    start = time.time()
+    for i in xrange(count):
+        world.getDropLocation()
+    return time.time() - start
+
+def timeSortPlatforms(count, extraPlatforms = 0):
+    world = benchmarkWorld('Levels/level2p1', ComputerWorld)
+    for i in xrange(extraPlatforms):
+        world.newPlatform(50 + i*500/max(1, extraPlatforms), 100 + i % 400)
+    world.currentBlock = Raindrop(200, 100)
+    world.currentBlock.vx = 3
+    start = time.time()
+    for i in xrange(count):
+        world.frame += 1 # scores are only worked out once per frame
+        world.sortPlatforms()
+        world.getTargetPlatform()
+    return time.time() - start
+
+def timeSortManyPlatforms(count):
+    return timeSortPlatforms(count, 200)
+
+def collisionScene():
+    # A fireball with drops at sixteen angles around it, each rect reaching
+    # 4 pixels into the fireball's: all sixteen rects hit, about half the
+    # drops' pixels do
+    world = benchmarkWorld()
+    fireball = world.enemies.sprites()[0]
+    cx, cy = fireball.rect.center
+    drops = pygame.sprite.OrderedUpdates()
+    for i in xrange(16):
+        drop = Raindrop(0, 0)
+        drop.angle = i*22.5
+        drop.image = rotateImage(drop.original, drop.angle)
+        drop.adjustRect()
+        dx = (fireball.rect.width + drop.rect.width)/2 - 4
+        dy = (fireball.rect.height + drop.rect.height)/2 - 4
+        cos, sin = math.cos(math.radians(drop.angle)), math.sin(
+            math.radians(drop.angle))
+        distance = 1/max(abs(cos)/dx, abs(sin)/dy)
+        drop.rect.center = (cx + int(cos*distance), cy + int(sin*distance))
+        drops.add(drop)
+    return world, fireball, drops
+
+def timeCollisions(count, pixelCollisions = False):
+    world, fireball, drops = collisionScene()
+    world.pixelCollisions = pixelCollisions
+    start = time.time()
+    for i in xrange(count):
+        world.spritesHit(fireball, drops)
+    return time.time() - start
+
+def timePixelCollisions(count):
+    return timeCollisions(count, True)
+
+def timeStormCollisions(count, pixelCollisions = False):
+    world = benchmarkWorld('Levels/level1')
+    world.startStorm()
+    world.maxBlocks = 1 << 30
+    for frame in xrange(60):
+        world.newBlocks()
+        world.storm.update(world.dt)
+    world.pixelCollisions = pixelCollisions
+    player = world.player
+    start = time.time()
+    for i in xrange(count):
+        player.rect.centerx = 150 + i % 300
+        world.stormHit(player)
+    return time.time() - start
+
+def timeStormPixelCollisions(count):
+    return timeStormCollisions(count, True)
+
+primitives = [('Platform.rotate', timePlatformRotate, 20000),
+    ('GravityObject.update', timeGravityUpdate, 20000),
+    ('isOnPlatform/getY', timeOnPlatform, 20000),
+    ('getDropLocation', timeDropLocation, 20000),
+    ('sortPlatforms', timeSortPlatforms, 5000),
+    ('sortPlatforms(200 more)', timeSortManyPlatforms, 1000),
+    ('spritesHit(rects)', timeCollisions, 20000),
+    ('spritesHit(pixels)', timePixelCollisions, 20000),
+    ('stormHit(rects)', timeStormCollisions, 5000),
+    ('stormHit(pixels)', timeStormPixelCollisions, 5000)]
+
+# Suite
+
+def runSuite(frames = 600, repeats = 5, seed = 0, only = None,
+    pixelCollisions = False):
+    screen = initHeadless()
+    GameLevel.pixelCollisions = pixelCollisions
+    assets.preload('sprites', spriteAssets)
+    samples = {}
+    def record(name, value):
+        samples.setdefault(name, []).append(value)
+    for repeat in xrange(repeats):
+        for name, levelType, file in levelRuns:
+            if only != None and only not in name:
+                continue
+            result = playLevel(levelType, file, frames, seed, screen)
+            for measure, value in result.items():
+                if measure != 'restarts':
+                    record('%s.%s' % (name, measure), value)
+        for name, function, count in primitives:
+            if only != None and only not in name:
+                continue
+            # microseconds per call
+            record(name, function(count)/count*1e6)
+    results = {}
+    for name, values in samples.items():
+        results[name] = {'samples': values, 'mean': mean(values),
+            'stdev': stdev(values)}
+    info = {'frames': frames, 'repeats': repeats, 'seed': seed,
+        'pixelCollisions': pixelCollisions,
+        'python': sys.version.split()[0], 'pygame': pygame.version.ver}
+    return {'info': info, 'results': results}
+
+# Statistics
+
+def mean(values):
+    return sum(values)/float(len(values))
+
+def stdev(values):
+    if len(values) < 2:
+        return 0.0
+    average = mean(values)
+    squares = sum([(value - average)**2 for value in values])
+    return math.sqrt(squares/(len(values) - 1))
+
+# Two-sided 95% critical values of Student's t, by degrees of freedom
+tTable = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36,
+    8: 2.31, 9: 2.26, 10: 2.23, 12: 2.18, 15: 2.13, 20: 2.09, 30: 2.04}
+
+def criticalT(df):
+    for limit in sorted(tTable):
+        if df <= limit:
+            return tTable[limit]
+    return 1.96
+
+def welch(before, after):
+    # t statistic and degrees of freedom for after being slower than before
+    varBefore = stdev(before)**2/len(before)
+    varAfter = stdev(after)**2/len(after)
+    variance = varBefore + varAfter
+    if variance == 0:
+        return 0.0, 1
+    t = (mean(after) - mean(before))/math.sqrt(variance)
+    df = variance**2/(varBefore**2/max(1, len(before) - 1) +
+        varAfter**2/max(1, len(after) - 1))
+    return t, max(1, int(df))
+
+def compare(baseline, current, threshold = 0.05):
+    # Slower by more than threshold, and significantly so
+    regressions = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['samples']
+        after = current['results'][name]['samples']
+        change = mean(after)/max(mean(before), 1e-9) - 1
+        t, df = welch(before, after)
+        flag = ''
+        if change > threshold and t > criticalT(df):
+            flag = 'REGRESSION'
+            regressions += [name]
+        elif change < -threshold and -t > criticalT(df):
+            flag = 'faster'
+        print '%-28s %10.3f %10.3f %+7.1f%%  %s' % (name, mean(before),
+            mean(after), change*100, flag)
+    return regressions
+
+def report(suite):
+    results = suite['results']
+    for name in sorted(results):
+        result = results[name]
+        line = '%-28s %10.3f +- %.3f' % (name, result['mean'],
+            result['stdev'])
+        if name.endswith('.frameTime'):
+            line += '  (%.0f frames/s)' % (1000/result['mean'])
+        print line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type = int, default = 600)
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--only', help = 'only benchmarks with this in '
+        'their name')
+    parser.add_argument('--save', help = 'write the results to this file')
+    parser.add_argument('--compare', help = 'baseline results to compare '
+        'against; exits with status 1 on a regression')
+    parser.add_argument('--pixel-collisions', action = 'store_true',
+        help = 'play the levels with pixel-accurate collisions')
+    args = parser.parse_args()
+    suite = runSuite(args.frames, args.repeats, args.seed, args.only,
+        args.pixel_collisions)
+    print 'Times in ms per frame (levels), us per call (primitives)'
+    report(suite)
+    if args.save:
+        resultsFile = open(args.save, 'w')
+        json.dump(suite, resultsFile, indent = 1, sort_keys = True)
+        resultsFile.close()
+    if args.compare:
+        baseline = json.load(open(args.compare))
+        print
+        print 'Compared with', args.compare
+        if compare(baseline, suite) != []:
+            sys.exit(1)
@@ -0,0 +1,256 @@
+import os
+import sys
+import time
+import argparse
+import pygame
+from GlobalFunctions import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Frame capture, for pixel based agents and visual regression checks.
+# A level with a FrameCapture (level.capture) draws each frame into an
+# offscreen Surface (capture.surface) instead of the display. The Surface
+# has the display's pixel format, so drawing into it costs what drawing to
+# the display does: every blit is a plain copy, with no channels to swap.
+#
+# Each captured frame is written into the next of a ring of arrays
+# made up front, shrunk by scale (an average over each scale x scale
+# block, or nearest pixel when smooth is False) and turned gray if asked:
+#
+#   capture.latest()   the array for the last frame
+#   capture.buffers    all of them; frame n goes in buffers[n % ringSize]
+#
+# so an array stays as it is until ringSize frames later. Nothing is
+# allocated per frame. Gray frames are (height, width) arrays, color ones
+# (height, width, 3) RGB views of arrays in the Surface's byte order.
+# capture.report() gives the time present() takes per frame, drawing
+# included, to set against the plain present path (the benchmark below
+# prints both). Works with SDL's dummy video driver, where nothing is
+# shown; otherwise frames are copied to the display too (show).
+#
+#   python Capture.py [--level level1] [--frames N] [--scale S] [--gray]
+#       [--nearest] [--ring R]
+
+grayWeights = (77, 150, 29) # R, G, B, out of 256
+
+def captureMasks(screen):
+    # The display's pixel format, if it is one toGray() can read: 32 bits,
+    # with green in the middle of red and blue. Otherwise (or with no
+    # display yet) BGRX, what SDL picks on most machines.
+    if screen != None and screen.get_bitsize() == 32:
+        red, green, blue, alpha = screen.get_masks()
+        if green == 0xff00 and sorted([red, blue]) == [0xff, 0xff0000]:
+            return (red, green, blue, 0)
+    return (0xff0000, 0xff00, 0xff, 0)
+
+def surfaceWords(surface):
+    # A 32 bit Surface's pixels as a (height, width) uint32 array. The
+    # Surface stays locked (nothing can blit to it) until the array goes.
+    width, height = surface.get_size()
+    return numpy.ndarray((height, width), numpy.uint32, surface.get_buffer(),
+        strides = (surface.get_pitch(), 4))
+
+class FrameCapture(object):
+
+    def __init__(self, size = (600, 600), scale = 1, gray = False,
+        smooth = True, ringSize = 4, show = None):
+        if numpy == None:
+            print 'Frame capture needs numpy'
+            raise SystemExit
+        width, height = size
+        if width % scale != 0 or height % scale != 0:
+            print 'Frame capture scale must divide the screen size'
+            raise SystemExit
+        self.size = size
+        self.scale = scale
+        self.gray = gray
+        self.smooth = smooth
+        self.ringSize = ringSize
+        if show == None:
+            show = os.environ.get('SDL_VIDEODRIVER') != 'dummy'
+        self.show = show
+        masks = captureMasks(pygame.display.get_surface())
+        self.surface = pygame.Surface(size, 0, 32, masks)
+        self.outputSize = outWidth, outHeight = width/scale, height/scale
+        if scale > 1:
+            self.scaledSurface = pygame.Surface(self.outputSize, 0, 32,
+                masks)
+        if gray:
+            self.ring = numpy.zeros((ringSize, outHeight, outWidth),
+                numpy.uint8)
+            self.buffers = list(self.ring)
+            self.setGrayWeights()
+        else:
+            self.ring = numpy.zeros((ringSize, outHeight, outWidth, 4),
+                numpy.uint8)
+            self.words = self.ring.view(numpy.uint32)[:, :, :, 0]
+            red, green, blue = self.channelBytes()
+            step = green - red
+            stop = blue + step
+            if stop < 0:
+                stop = None
+            self.buffers = [pixels[:, :, red:stop:step]
+                for pixels in self.ring]
+        self.frames = 0
+        self.seconds = self.slowest = 0.0
+
+    def channelBytes(self):
+        # Where red, green and blue are in each pixel's 4 bytes
+        shifts = self.surface.get_shifts()[:3]
+        if sys.byteorder == 'little':
+            return [shift/8 for shift in shifts]
+        return [3 - shift/8 for shift in shifts]
+
+    def setGrayWeights(self):
+        # For toGray(): a pixel's low and high bytes weighed by one
+        # multiply, and green on its own
+        weights = dict(zip(self.surface.get_shifts()[:3], grayWeights))
+        self.outerWeights = numpy.uint32(weights[0] << 16 | weights[16])
+        self.greenWeight = numpy.uint32(weights[8] << 8)
+        outHeight, outWidth = self.outputSize[1], self.outputSize[0]
+        self.outer = numpy.zeros((outHeight, outWidth), numpy.uint32)
+        self.green = numpy.zeros((outHeight, outWidth), numpy.uint32)
+
+    def present(self, background, blitList, screen):
+        # Draws a frame offscreen, captures it, and shows it if need be
+        start = time.time()
+        self.surface.blit(background, (0, 0))
+        blitImages(self.surface, blitList)
+        self.capture()
+        if self.show:
+            screen.blit(self.surface, (0, 0))
+            pygame.display.flip()
+        seconds = time.time() - start
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+
+    def capture(self):
+        source = self.surface
+        if self.scale > 1:
+            if self.smooth:
+                pygame.transform.smoothscale(self.surface, self.outputSize,
+                    self.scaledSurface)
+            else:
+                pygame.transform.scale(self.surface, self.outputSize,
+                    self.scaledSurface)
+            source = self.scaledSurface
+        index = self.frames % self.ringSize
+        words = surfaceWords(source) # (unlocked again on return)
+        if self.gray:
+            self.toGray(words, self.ring[index])
+        else:
+            numpy.copyto(self.words[index], words)
+        self.frames += 1
+
+    def toGray(self, words, out):
+        # The weighted sum of the channels, worked out on whole pixels:
+        # with the bytes either side of green 16 bits apart, one multiply
+        # puts both their weighted values in the top half of the word, and
+        # green's lands there too. The top byte is then the sum over 256,
+        # which goes straight into out.
+        outer, green = self.outer, self.green
+        numpy.bitwise_and(words, 0xff00ff, out = outer)
+        numpy.multiply(outer, self.outerWeights, out = outer)
+        numpy.bitwise_and(words, 0xff00, out = green)
+        numpy.multiply(green, self.greenWeight, out = green)
+        numpy.add(outer, green, out = outer)
+        numpy.right_shift(outer, 24, out = out, casting = 'unsafe')
+
+    def latest(self):
+        if self.frames == 0:
+            return None
+        return self.buffers[(self.frames - 1) % self.ringSize]
+
+    def stats(self):
+        frames = max(self.frames, 1)
+        return {'frames': self.frames, 'mean': self.seconds/frames*1000,
+            'slowest': self.slowest*1000}
+
+    def report(self):
+        stats = self.stats()
+        return ('present with capture: %d frames, %.3f ms/frame (slowest '
+            '%.3f ms)' % (stats['frames'], stats['mean'], stats['slowest']))
+
+# Benchmark: redrawAll() with and without capture
+
+def timeRedraws(levelType, file, frames, screen, capture = None):
+    # ms per redrawAll(), and per present() within it, over frames frames
+    # of scripted play
+    from Benchmark import BenchmarkClock, scriptedInputs
+    level = levelType(file)
+    level.capture = capture
+    level.seed = 0
+    presenting = [0.0]
+    present = level.present
+    def timedPresent():
+        start = time.time()
+        present()
+        presenting[0] += time.time() - start
+    level.present = timedPresent
+    level.start(screen.get_size(), screen, BenchmarkClock())
+    level.mode = None # (the boss level starts paused)
+    level.BossInstructions = False
+    stepTime = 1.0/level.stepRate
+    drawing = 0.0
+    for frame in xrange(frames):
+        level.inputs += scriptedInputs(frame, [1])
+        level.stepWorld(stepTime)
+        if level.mode != None:
+            level.start(screen.get_size(), screen, BenchmarkClock())
+            level.mode = None
+            level.BossInstructions = False
+        start = time.time()
+        level.redrawAll(1)
+        drawing += time.time() - start
+    level.close()
+    return drawing/frames*1000, presenting[0]/frames*1000
+
+def timeCopies(surface, frames):
+    # What capturing by copying would cost: ms for Surface.copy() and
+    # for tostring()
+    start = time.time()
+    for i in xrange(frames):
+        surface.copy()
+    copy = time.time() - start
+    start = time.time()
+    for i in xrange(frames):
+        pygame.image.tostring(surface, 'RGB')
+    return copy/frames*1000, (time.time() - start)/frames*1000
+
+if __name__ == '__main__':
+    from Level import GameLevel
+    from ComputerLevel import ComputerLevel
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--level', default = 'level1')
+    parser.add_argument('--frames', type = int, default = 600)
+    parser.add_argument('--scale', type = int, default = 1)
+    parser.add_argument('--gray', action = 'store_true')
+    parser.add_argument('--nearest', action = 'store_true',
+        help = 'downsample by picking pixels, not averaging them')
+    parser.add_argument('--ring', type = int, default = 4)
+    args = parser.parse_args()
+    screen = initHeadless()
+    levelType = GameLevel
+    if args.level == 'boss':
+        levelType, args.level = ComputerLevel, 'level2p1'
+    file = 'Levels/' + args.level
+    plain, plainPresent = timeRedraws(levelType, file, args.frames, screen)
+    capture = FrameCapture(screen.get_size(), args.scale, args.gray,
+        not args.nearest, args.ring)
+    captured, capturedPresent = timeRedraws(levelType, file, args.frames,
+        screen, capture)
+    copy, tostring = timeCopies(capture.surface, args.frames)
+    print 'redrawAll:              %.3f ms/frame' % plain
+    print 'redrawAll with capture: %.3f ms/frame (%+.3f ms, %+.1f%%)' % (
+        captured, captured - plain, (captured - plain)/plain*100)
+    print 'present():              %.3f ms/frame' % plainPresent
+    print 'present() with capture: %.3f ms/frame (%+.3f ms)' % (
+        capturedPresent, capturedPresent - plainPresent)
+    print capture.report()
+    print 'output: %s per frame, ring of %d' % (
+        'x'.join(map(str, capture.latest().shape)), args.ring)
+    print 'for comparison: Surface.copy() %.3f ms, tostring() %.3f ms' % (
+        copy, tostring)
@@ -2,6 +2,7 @@ import pygame
 import random
 from pygame.locals import *
 from GlobalFunctions import *
+from ImageCache import *
 import math
 
 class Button(pygame.sprite.Sprite):
@@ -17,6 +18,10 @@ class Button(pygame.sprite.Sprite):
 # Physics objects for game
 ############################
 
+# update() takes dt, the time since the last update in ticks of the
+# original 20 fps game loop. Speeds, gravity and timers are all per tick,
+# so the game plays the same at any world step rate.
+
 class GravityObject(pygame.sprite.Sprite):
 
     # Root class for raindrop, firedrop, and players.
@@ -35,11 +40,12 @@ class GravityObject(pygame.sprite.Sprite):
         self.terminalVelocity = 15
         self.weight = 0.5
         self.angle = self.targetAngle = 0
+        self.carryX = self.carryY = 0 # movement too small for the rect
 
-    def rotate(self):
+    def rotate(self, dt = 1):
         if self.targetAngle != 0:
-            self.angle += self.targetAngle
-            self.image = pygame.transform.rotate(self.original, self.angle)
+            self.angle += self.targetAngle*dt
+            self.image = rotateImage(self.original, self.angle)
 
     def adjustRect(self):
         # Because size/rotation changes should cause rects to change as well
@@ -48,44 +54,54 @@ class GravityObject(pygame.sprite.Sprite):
         self.rect.left = x
         self.rect.top = y
 
-    def update(self):
-        self.rotate()
+    def move(self, dx, dy, dt = 1):
+        # Rects only hold whole pixels, so what is left of a pixel is kept
+        # for the next move, at every step rate: small steps add up to the
+        # same distance as big ones.
+        self.carryX, dx = math.modf(self.carryX + dx)
+        self.carryY, dy = math.modf(self.carryY + dy)
+        self.rect.x += int(dx)
+        self.rect.y += int(dy)
+
+    def update(self, dt = 1):
+        self.rotate(dt)
         self.adjustRect()
-        self.rect.x += self.vx*self.speed
-        self.vx *= 0.95
-        self.rect.y += self.vy
+        self.move(self.vx*self.speed*dt, self.vy*dt, dt)
+        self.vx *= 0.95**dt
         if not self.onPlatform and self.vy < self.terminalVelocity:
-            self.vy += 1
+            self.vy += dt
 
 class Raindrop(GravityObject):
 
+    dropType = 1 # indicates a normal raindrop
+
     def __init__(self, x, y):
         super(Raindrop, self).__init__(x, y)
-        self.sideways = pygame.transform.rotate(self.original, 90)
-        self.dropType = 1 # indicates a normal raindrop
+        self.sideways = rotateImage(self.original, 90)
 
-    def rotate(self):
+    def rotate(self, dt = 1):
+        flip = False
         if self.onPlatform:
             image = self.sideways
-            if self.vx < 0:
-                image = pygame.transform.flip(image, True, False)
+            flip = self.vx < 0
         else: image = self.original
         if self.targetAngle != 0:
-            self.angle += self.targetAngle
-            self.image = pygame.transform.rotate(image, self.angle)
+            self.angle += self.targetAngle*dt
+            self.image = rotateImage(image, self.angle, flip)
 
 class Firedrop(Raindrop):
 
     # For use in boss level!
 
+    dropType = 2 # this drop will injure user-controlled players
+
     def __init__(self, x, y):
         super(Firedrop, self).__init__(x, y)
         self.image, self.rect = load_image('Sprites/firedrop.png', -1)
         self.original = self.image
-        self.sideways = pygame.transform.rotate(self.original, 90)
+        self.sideways = rotateImage(self.original, 90)
         self.rect.left = x
         self.rect.top = y
-        self.dropType = 2 # this drop will injure user-controlled players
 
 class Player(GravityObject):
 
@@ -107,14 +123,16 @@ class Player(GravityObject):
 
     def initImage(self, number):
         # permCopy = kept for fully resetting the image
+        # unflipped = the image as it is now (normal, hit or resized), facing
+        # right; turning flips this, not whatever was shown last, so turns
+        # reuse the rotation cache's two frames
         # original = same direction/size as sprite, but unrotated
         imageName = 'Sprites/player%d.png' % number
         hitImageName = 'Sprites/player%dhit.png' % number
         self.image, self.rect = load_image(imageName, -1)
-        # discard the hitrect and permrect
+        # discard the hitrect
         self.hitImage, hitrect = load_image(hitImageName, -1)
-        self.permCopy, permRect = load_image(imageName, -1)
-        self.original = self.image
+        self.permCopy = self.unflipped = self.original = self.image
 
     def changeWeight(self, weightChange):
         # Reacts to weight-change powerups
@@ -123,7 +141,8 @@ class Player(GravityObject):
         else:
             newSize = (10, 10)
         self.weight = int(self.weight*weightChange)
-        image = pygame.transform.scale(self.image, newSize)
+        self.unflipped = pygame.transform.scale(self.unflipped, newSize)
+        image = rotateImage(self.unflipped, 0, self.dx == -1)
         self.image = self.original = image
 
     def loseLife(self, respawn = False):
@@ -137,21 +156,20 @@ class Player(GravityObject):
                 self.rect.top = self.initY
                 self.fullReset()
             else: self.reset()
-            self.image = self.original = self.hitImage
+            self.image = self.original = self.unflipped = self.hitImage
 
-    def updateBlock(self):
+    def updateBlock(self, dt = 1):
         if self.block:
-            self.blockTimer += 1
-        if self.blockTimer == 20:
+            self.blockTimer += dt
+        if self.blockTimer >= 20:
             self.blockTimer = 0
             self.block = False
             self.reset() # to get rid of the hit image
 
     def reset(self):
         # Changes powerup properties back to normal
-        image = self.permCopy
-        if self.dx == -1:
-            image = pygame.transform.flip(image, True, False)
+        self.unflipped = self.permCopy
+        image = rotateImage(self.permCopy, 0, self.dx == -1)
         self.image = self.original = image
         self.speed = 1
         self.weight = 2
@@ -164,24 +182,24 @@ class Player(GravityObject):
         self.vx = 0
         self.vy = 0
 
-    def updatePowers(self):
+    def updatePowers(self, dt = 1):
         # Removes powerups after 200 frames
         if self.power != None:
-            self.powerTimer += 1
-        if self.powerTimer == 200:
+            self.powerTimer += dt
+        if self.powerTimer >= 200:
             self.reset()
 
-    def update(self):
-        super(Player, self).update()
-        self.updateBlock()
-        self.updatePowers()
+    def update(self, dt = 1):
+        super(Player, self).update(dt)
+        self.updateBlock(dt)
+        self.updatePowers(dt)
         if self.vy > self.jumpHeight:
             # jump has ended (actually need to calibrate this thing, but oh well)
             self.jumpStep = 0
 
     def walk(self, dx):
         if self.dx != dx:
-            self.image = pygame.transform.flip(self.original, True, False)
+            self.image = rotateImage(self.unflipped, 0, dx == -1)
             self.vx = 5*dx
             self.angle = 0
             self.original = self.image
@@ -236,15 +254,15 @@ class Platform(pygame.sprite.Sprite):
             # Rotate back to flat angle
             self.targetAngle = -(self.angle/7.0)
 
-    def rotate(self):
-        if abs(self.angle + self.targetAngle) < self.maxAngle:
-            self.angle += self.targetAngle
-            self.image = pygame.transform.rotate(self.original, self.angle)
+    def rotate(self, dt = 1):
+        if abs(self.angle + self.targetAngle*dt) < self.maxAngle:
+            self.angle += self.targetAngle*dt
+            self.image = rotateImage(self.original, self.angle)
             self.rect = self.image.get_rect()
             self.rect.center = (self.cx, self.cy)
 
-    def update(self):
-        self.rotate()
+    def update(self, dt = 1):
+        self.rotate(dt)
 
 class LockingPlatform(Platform):
 
@@ -258,9 +276,9 @@ class LockingPlatform(Platform):
         self.original = self.image
         (self.rect.x, self.rect.y) = (cx-self.width/2, cy-self.height/2)
 
-    def rotate(self):
+    def rotate(self, dt = 1):
         if self.canRotate():
-            super(LockingPlatform, self).rotate()
+            super(LockingPlatform, self).rotate(dt)
 
     def canRotate(self):
         # Locking platforms cannot rotate back toward an angle of 0
@@ -295,27 +313,27 @@ class PowerUp(pygame.sprite.Sprite):
     fast = 'Sprites/fastpower.png'
     powerUpImgs = [heavy, light, fast]
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, rand = random):
+        # rand: where the random choices come from (the world's generator)
         super(PowerUp, self).__init__()
-        choice = random.randint(0,2)
+        choice = rand.randint(0,2)
         self.power = PowerUp.powerUps[choice]
         image = PowerUp.powerUpImgs[choice]
-        self.image, self.rect = load_image(image)
-        self.image = self.image.convert_alpha()
+        self.image, self.rect = load_image(image, alpha = True)
         self.original = self.image
         self.rect.left = x
         self.rect.top = y
         self.time = 0
         self.maxTime = 150 # number of frames it lasts for
 
-    def update(self):
+    def update(self, dt = 1):
         if self.time >= self.maxTime:
             self.kill()
         else:
-            self.time += 1
+            self.time += dt
             rotate = 4*self.time
             oldCenter = self.rect.center
-            self.image = pygame.transform.rotate(self.original, rotate)
+            self.image = rotateImage(self.original, rotate)
             self.rect = self.image.get_rect()
             self.rect.center = oldCenter
 
@@ -350,11 +368,11 @@ class Fireball(pygame.sprite.Sprite):
                 self.rect.left = self.x
                 self.rect.top = self.y
 
-    def update(self):
+    def update(self, dt = 1):
         # block prevents fireball from losing multiple lives from one hit
         if self.block:
-            self.blockTimer += 1
-        if self.blockTimer == self.maxBlockTime:
+            self.blockTimer += dt
+        if self.blockTimer >= self.maxBlockTime:
             self.blockTimer = 0
             self.block = False
 
@@ -364,12 +382,28 @@ class MovingFireball(Fireball):
         super(MovingFireball, self).__init__(x, y, lives)
         self.maxDistance = 30
         self.vx = -4
+        self.offset = 0 # exact distance from starting position
 
-    def update(self):
-        super(MovingFireball, self).update()
+    def update(self, dt = 1):
+        super(MovingFireball, self).update(dt)
         if not self.block:
             # Moves within some distance of starting position
             distance = abs(self.x - self.rect.left)
             if distance > self.maxDistance:
                 self.vx *= -1
-            self.rect.left += self.vx
+            self.offset += self.vx*dt
+            self.rect.left = self.x + int(self.offset)
+
+    def loseLife(self):
+        # Losing a life can put the fireball back at its starting position
+        super(MovingFireball, self).loseLife()
+        self.offset = self.rect.left - self.x
+
+# Images the sprites above load during play, as load_image arguments
+spriteAssets = [('Sprites/raindrop.png', -1), ('Sprites/firedrop.png', -1),
+    ('Sprites/player1.png', -1), ('Sprites/player1hit.png', -1),
+    ('Sprites/player2.png', -1), ('Sprites/player2hit.png', -1),
+    ('Sprites/platform.png', -1), ('Sprites/lockplatform.png', -1),
+    ('Sprites/mainplatformimg.png', -1)]
+spriteAssets += [(image, -1) for image in Fireball.fireballImgs]
+spriteAssets += [(image, None, True) for image in PowerUp.powerUpImgs]
@@ -6,47 +6,61 @@ import shelve
 import os
 from Classes import *
 from Level import *
+from World import *
 from GlobalFunctions import *
 
-class ComputerLevel(TwoPlayerLevel):
+try:
+    import numpy
+except ImportError:
+    numpy = None # Platform scoring falls back to plain Python
+
+class ComputerWorld(TwoPlayerWorld):
 
-    # Although a subclass of TwoPlayerLevel, this is used for 1P boss battle
+    # Although a subclass of TwoPlayerWorld, this is used for 1P boss battle
 
     # Depending on current state, the computer player either moves towards
     # target coordinates, or executes moves from a queue.
 
-    def keyPressed(self, event):
-        if event.key == pygame.K_SPACE and self.BossInstructions:
-            self.BossInstructions = False
-            self.mode = None
-        if event.key == pygame.K_p and self.mode != 'Over':
-            if self.mode != "Pause":
-                self.mode = "Pause"
-            else: self.mode = None
-        elif event.key == pygame.K_t:
-            self.mode = 'Over'
-        if self.mode == None:
-            if event.key == pygame.K_RIGHT:
-                self.player1.walk(1)
-            elif event.key == pygame.K_LEFT:
-                self.player1.walk(-1)
-            elif event.key == pygame.K_UP or event.key == pygame.K_SPACE:
-                self.player1.jump()
-
-    def timerFired(self):
-        if self.mode == 'next':
-            return True
-        if self.mode == None:
-            if self.movesClock % 4 == 0:
-                # with 20 fps, this should update around 5 times per second
+    # In planning mode it looks ahead instead (see planMove): every few
+    # ticks it tries out each combination of planMoves moves on a snapshot
+    # of the world, planSteps steps ahead, and makes the first move of the
+    # combination that turned out best.
+    planning = False
+    planMoves = 2
+    planSteps = 24
+
+    # Constants of the rule-based AI, which Tuning.py searches over. Input
+    # logs save them, so a boss with tuned values replays the same.
+    marginX = 20 # how close approachTarget gets to the target
+    marginY = 15
+    upperMargin = 100 # how far above the drop a platform can be aimed
+    enemyMargin = 30 # extra tilt allowed when aiming a platform
+    evadeMargin = 100 # how close a drop gets before emergencyEvade
+    framesToProject = 5 # how far ahead drop and player motion is projected
+    balanceSpeed = 10 # platformBalance steps in past this speed...
+    balanceDistance = 30 # ...or this far from the platform's center
+    moveInterval = 4 # ticks between AI moves
+    aiParameters = ['marginX', 'marginY', 'upperMargin', 'enemyMargin',
+        'evadeMargin', 'framesToProject', 'balanceSpeed', 'balanceDistance',
+        'moveInterval']
+    recordedOptions = ['pixelCollisions', 'planning'] + aiParameters
+
+    def step(self, inputs = ()):
+        self.applyInputs(inputs)
+        if self.movesClock <= 0:
+            # every moveInterval ticks, so around 5 times per second
+            if self.planning:
+                self.planMove()
+            else:
                 self.updateComputerPlayer()
-            self.movesClock += 1
-        super(ComputerLevel, self).timerFired()
+            self.movesClock += self.moveInterval
+        self.movesClock -= self.dt
+        self.update()
 
     def handleCollisions(self):
         self.handlePlatformCollisions()
         self.enemyCollisions()
-        self.newBlock()
+        self.newBlocks()
         self.handlePowerUps()
         self.setPowerUps()
         self.adjustBlocks()
@@ -96,6 +110,61 @@ class ComputerLevel(TwoPlayerLevel):
         elif command == 1 or command == -1:
             self.player2.walk(command)
 
+    #############################
+    # Planning
+    #############################
+
+    def planMove(self):
+        # None = no move this AI tick
+        commands = [None, 0, 1, -1]
+        plans = [[]]
+        for i in range(self.planMoves):
+            plans = [plan + [command] for plan in plans
+                for command in commands]
+        start = self.snapshot()
+        lives = (self.player1.lives, self.player2.lives)
+        bestPlan = bestScore = None
+        for plan in plans:
+            score = self.rollout(plan, lives)
+            self.restore(start)
+            if bestScore == None or score > bestScore:
+                bestPlan, bestScore = plan, score
+        self.movesList = []
+        if bestPlan[0] != None:
+            self.movesList = [bestPlan[0]]
+            self.executeMove()
+
+    def rollout(self, plan, lives):
+        # Plays the plan out (one move per AI tick, the opponent doing
+        # nothing) and rates where the world ends up
+        clock = 0
+        plan = list(plan)
+        for i in range(self.planSteps):
+            if clock <= 0:
+                if plan != [] and plan[0] != None:
+                    self.movesList = [plan[0]]
+                    self.executeMove()
+                plan = plan[1:]
+                clock += self.moveInterval
+            clock -= self.dt
+            self.update()
+            if self.mode != None:
+                break
+        return self.rateOutcome(lives)
+
+    def rateOutcome(self, lives):
+        p1Lives, p2Lives = lives
+        score = 100*(p1Lives - self.player1.lives)
+        score -= 150*(p2Lives - self.player2.lives)
+        if self.mode == 'Lost': # the player lost
+            score += 1000
+        elif self.mode == 'Over':
+            score -= 1000
+        # Otherwise stay near the middle of the main platform
+        playerCx, playerCy = self.player2.rect.center
+        score -= abs(playerCx - self.mainPlatform.cx)/10.0
+        return score
+
 
     #############################
     # Targeting
@@ -105,17 +174,18 @@ class ComputerLevel(TwoPlayerLevel):
     # Go through sorted list until one of them has a "line" to the oponent
     # Set target to angle the platform towards the opponent
 
+    # Platforms are scored all at once (see scorePlatforms), at most once
+    # per AI tick, however many times the targeting code asks
+
     def approachTarget(self):
-        # Computer can make one move towards set target, 4 times a second
-        marginY = 15
-        marginX = 20
+        # Computer can make one move towards set target, each AI tick
         targetX, targetY = self.target
         playerCx, playerCy = self.player2.rect.center
         # Decide whether to jump or walk
-        if (playerCy - targetY > marginY) and self.player2.jumpStep < 2:
+        if (playerCy - targetY > self.marginY) and self.player2.jumpStep < 2:
             # Because of gravity, it's okay to be above the target
             self.player2.jump()
-        elif abs(playerCx - targetX) > marginX:
+        elif abs(playerCx - targetX) > self.marginX:
             dx = abs(targetX - playerCx)/(targetX - playerCx)
             self.player2.walk(dx)
         self.getTargetLocation()
@@ -127,69 +197,88 @@ class ComputerLevel(TwoPlayerLevel):
         else:
             # Target a point on left or right of platform,
             # depending on the angle wanted
-            moveRange = random.randint(20, 30)
+            moveRange = self.random.randint(20, 30)
             targetX = platform.cx + moveRange*direction
             self.target = (targetX, platform.cy)
 
     def getTargetPlatform(self):
         # Picks a platform as "close" to the raindrop as possible
         # where the platform can be angled towards an opponent
-        toCheck = self.sortPlatforms()
-        targetPlatform = None
-        direction = None
-        for platform in toCheck:
-            if self.lineToEnemy(platform) != None:
-                targetPlatform = platform
-                direction = self.lineToEnemy(platform)
-                break # Only want first platform for which this works
-        return targetPlatform, direction
-
-    def lineToEnemy(self, platform):
-        # Checks whether enemy is within reach of the platform
-        # Returns -1 if enemy is to the left, 1 if to the right
-        # None if the enemy cannot be reached
-        margin = 30
-        xmax, ymax = self.screenSize
-        opponentCx, opponentCy = self.player1.rect.center
-        # Calculate current angle of opponent
-        yLine = abs(opponentCy - platform.cy)
-        xLine = opponentCx - platform.cx
-        if xLine != 0:
-            tangent = float(yLine)/abs(xLine)
-            angle = math.atan(tangent)
-            angle = int(math.degrees(angle)) # in whole degrees
-            if angle < platform.maxAngle + margin:
-                return abs(xLine)/xLine
+        platforms, order, candidates, directions = self.scorePlatforms()
+        for i in order:
+            if candidates[i] and directions[i] != 0:
+                return platforms[i], directions[i]
+        return None, None
 
     def sortPlatforms(self):
-        blockRect = self.currentBlock.rect
-        candidates = []
-        for platform in self.platforms:
-            upperMargin = 100
-            if platform.cy + upperMargin >= blockRect.bottom:
-                # Excludes platforms above the falling block
-                candidates += [platform]
-        candidates = sorted(candidates, self.heuristicCmp)
-        return candidates
-
-    def heuristicCmp(self, platform1, platform2):
-        # Compares platforms by how likely the raindrop is to fall on each next
-        p1 = self.heuristicConstant(platform1)
-        p2 = self.heuristicConstant(platform2)
-        return cmp(p1, p2)
-
-    def heuristicConstant(self, platform):
-        # Manhattan distance from drop's projected center to platform center
-        result = 0
-        framesToProject = 5
+        # Platforms the drop might fall on next, most likely first
+        platforms, order, candidates, directions = self.scorePlatforms()
+        return [platforms[i] for i in order if candidates[i]]
+
+    def scorePlatforms(self):
+        # For every platform, in one pass:
+        #   heuristic: Manhattan distance from the drop's projected center
+        #       (order: platforms sorted by it, closest first)
+        #   candidate: not too far above the falling block
+        #   direction: whether the platform can be angled at the opponent;
+        #       -1 if the opponent is to the left, 1 to the right, 0 if it
+        #       can't be reached
+        if self.scores != None and self.scores[0] == self.frame:
+            return self.scores[1]
+        framesToProject = self.framesToProject
+        upperMargin = self.upperMargin
+        margin = self.enemyMargin
         blockCx, blockCy = self.currentBlock.rect.center
         blockCx += framesToProject*self.currentBlock.vx
         blockCy += framesToProject*self.currentBlock.vy
-        blockDistance = platform.cx - blockCx
-        verticalDistance = platform.cy - blockCy
-        dropPlatform = self.platformsHit(self.currentBlock)
-        result += (abs(blockDistance) + abs(verticalDistance))
-        return result
+        blockBottom = self.currentBlock.rect.bottom
+        opponentCx, opponentCy = self.player1.rect.center
+        platforms = list(self.platforms)
+        if numpy != None:
+            cx, cy, maxAngle = self.getPlatformArrays(platforms)
+            heuristic = numpy.abs(cx - blockCx) + numpy.abs(cy - blockCy)
+            order = numpy.argsort(heuristic, kind = 'mergesort').tolist()
+            candidates = (cy + upperMargin >= blockBottom).tolist()
+            xLine = opponentCx - cx
+            yLine = numpy.abs(opponentCy - cy)
+            with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+                angles = numpy.degrees(numpy.arctan(yLine/numpy.abs(xLine)))
+            # Straight above or below (0/0 is NaN): never reachable, as in
+            # the loop below
+            angles[xLine == 0] = 90
+            # whole degrees, like int(math.degrees(...))
+            reachable = ((xLine != 0) &
+                (angles.astype(int) < maxAngle + margin))
+            directions = (numpy.sign(xLine)*reachable).astype(int).tolist()
+        else:
+            heuristic = [abs(p.cx - blockCx) + abs(p.cy - blockCy)
+                for p in platforms]
+            order = sorted(range(len(platforms)), key = heuristic.__getitem__)
+            candidates = [p.cy + upperMargin >= blockBottom
+                for p in platforms]
+            directions = []
+            for platform in platforms:
+                xLine = opponentCx - platform.cx
+                yLine = abs(opponentCy - platform.cy)
+                direction = 0
+                if xLine != 0:
+                    angle = math.degrees(math.atan(float(yLine)/abs(xLine)))
+                    if int(angle) < platform.maxAngle + margin:
+                        direction = abs(xLine)/xLine
+                directions += [direction]
+        scores = (platforms, order, candidates, directions)
+        self.scores = (self.frame, scores)
+        return scores
+
+    def getPlatformArrays(self, platforms):
+        # Platforms don't move (they only rotate), so these are only
+        # rebuilt when the platforms change
+        if self.platformArrays == None or self.platformArrays[0] != platforms:
+            cx = numpy.array([p.cx for p in platforms], float)
+            cy = numpy.array([p.cy for p in platforms], float)
+            maxAngle = numpy.array([p.maxAngle for p in platforms])
+            self.platformArrays = (platforms, (cx, cy, maxAngle))
+        return self.platformArrays[1]
 
     def isInDirection(self, platform):
         # Returns whether the falling block is going towards the platform
@@ -216,8 +305,7 @@ class ComputerLevel(TwoPlayerLevel):
         playerCx, playerCy = self.player2.rect.center
         platformList = self.platformsHit(self.player2)
         mainRect = self.mainPlatform.rect
-        framesToProject = 5
-        projectedX = playerCx + framesToProject*self.player2.vx
+        projectedX = playerCx + self.framesToProject*self.player2.vx
         if not mainRect.collidepoint(projectedX, self.mainPlatform.cy):
             # Uses a point on the platform with the same x as the projection
             # Then player's projected position is not above the main platform
@@ -230,20 +318,20 @@ class ComputerLevel(TwoPlayerLevel):
         playerCx, playerCy = self.player2.rect.center
         platformList = self.platformsHit(self.player2)
         mainRect = self.mainPlatform.rect
-        framesToProject = 5
-        projectedX = playerCx + framesToProject*self.player2.vx
+        projectedX = playerCx + self.framesToProject*self.player2.vx
         if platformList != []:
             # Player is on a platform
             platform = platformList[0] # there should be exactly one
             distance = playerCx - platform.cx
-            if abs(self.player2.vx) >= 10 or abs(distance) > 30:
+            if (abs(self.player2.vx) >= self.balanceSpeed or
+                abs(distance) > self.balanceDistance):
                 self.movesList = self.platformBalanceMoves(platform)
 
     def emergencyEvade(self):
         # Creates a small precollision rect around the computer player's piece
         # This detects and avoid imminent collisions (short range)
         playerX, playerY = self.player2.rect.topleft
-        margin = 100
+        margin = self.evadeMargin
         collideRect = Rect(playerX-margin, playerY-margin, 2*margin, 2*margin)
         if pygame.Rect.colliderect(collideRect, self.currentBlock.rect):
             dx = playerX - self.currentBlock.rect.left
@@ -292,12 +380,8 @@ class ComputerLevel(TwoPlayerLevel):
     def avoidSortPlatforms(self):
         # Basically the opposite of the offensive sort
         # Doesn't exclude higher platforms
-        blockRect = self.currentBlock.rect
-        candidates = []
-        for platform in self.platforms:
-                candidates += [platform]
-        candidates = sorted(candidates, self.heuristicCmp)
-        return reverse(candidates)
+        platforms, order, candidates, directions = self.scorePlatforms()
+        return reverse([platforms[i] for i in order])
 
     def platformBalanceMoves(self, platform):
         playerCx, playerCy = self.player2.rect.center
@@ -330,81 +414,124 @@ class ComputerLevel(TwoPlayerLevel):
         if self.currentBlock != None:
         # Boss loses lives when hit by raindrop
         # You lose lives when hit by the firedrop
-            if pygame.sprite.collide_rect(self.player1, self.currentBlock):
+            if self.collide(self.player1, self.currentBlock):
                 if self.currentBlock.dropType == 2:
                     self.player1.loseLife()
-            if pygame.sprite.collide_rect(self.player2, self.currentBlock):
+            if self.collide(self.player2, self.currentBlock):
                 if self.currentBlock.dropType == 1:
                     self.player2.loseLife()
-
-    def redrawAll(self):
-        if self.BossInstructions:
-            self.screen.blit(self.bossScreen, self.bossSurfacePos)
-            pygame.display.flip()
-        else:
-            super(ComputerLevel, self).redrawAll()
-
-    def drawScore(self):
-        scoreColor = (46,139,87)
-        score = "Score: %d" % self.player1.score
-        lives = "Lives: %d" % self.player1.lives
-        blocks = self.maxBlocks - self.blockCounter
-        blockText = "Drops remaining: %d/%d" % (blocks, self.maxBlocks)
-        scoreDraw = self.consola_font.render(score, True, scoreColor)
-        livesDraw = self.consola_font.render(lives, True, scoreColor)
-        blocksDraw = self.consola_font.render(blockText, True, scoreColor)
-        self.screen.blit(scoreDraw, self.scorePos)
-        self.screen.blit(livesDraw, self.livesPos)
-        self.screen.blit(blocksDraw, self.blocksPos)
+        if self.storm != None:
+            if self.stormHit(self.player1, Firedrop.dropType):
+                self.player1.loseLife()
+            if self.stormHit(self.player2, Raindrop.dropType):
+                self.player2.loseLife()
 
     def newBlock(self):
         blocksDropped = self.maxBlocks - self.blockCounter
         width, height = self.screenSize
-        blockLimit = 3
-        if len(self.fallingBlocks) < blockLimit:
+        if self.blocksInPlay() < self.blockLimit:
             if self.blockCounter == self.maxBlocks:
                 self.mode = 'Over'
             else:
                 # blockType alternates between 1 and 2, on each drop
                 blockType = (blocksDropped % 2) + 1
-                x = self.getDropLocation()
                 if blockType == 1:
-                    block = Raindrop(x, 0)
+                    self.dropBlock(Raindrop)
                 else:
-                    block = Firedrop(x, 0)
-                self.allsprites.add(block)
-                self.fallingBlocks.add(block)
-                self.blockCounter += 1
-                self.currentBlock = block
+                    self.dropBlock(Firedrop)
+
+    def placePlayers(self):
+        # The computer always gets a fresh player 2
+        self.player2 = None
+        super(ComputerWorld, self).placePlayers()
+
+    def init(self):
+        super(ComputerWorld, self).init()
+        self.movesClock = 0
+        self.target = None
+        self.currentBlock = None
+        self.movesList = []
+        self.scores = None # (frame, scorePlatforms() for that frame)
+        self.platformArrays = None
+
+class ComputerLevel(TwoPlayerLevel):
+
+    # Front-end for the boss battle: the player controls player 1 only,
+    # and the boss instructions are shown before play starts
+
+    worldType = ComputerWorld
+    prefetchImages = ['Backgrounds/bosssurface.png']
+    planning = False # the boss looks ahead (see ComputerWorld.planMove)
+
+    def keyPressed(self, event):
+        if event.key == pygame.K_SPACE and self.BossInstructions:
+            self.BossInstructions = False
+            self.mode = None
+        if event.key == pygame.K_p and self.mode != 'Over':
+            if self.mode != "Pause":
+                self.mode = "Pause"
+            else: self.mode = None
+        elif event.key == pygame.K_t:
+            self.mode = 'Over'
+        self.timeControls(event)
+        if self.mode == None:
+            if event.key == pygame.K_RIGHT:
+                self.inputs += [(1, 1)]
+            elif event.key == pygame.K_LEFT:
+                self.inputs += [(1, -1)]
+            elif event.key == pygame.K_UP or event.key == pygame.K_SPACE:
+                self.inputs += [(1, 0)]
+
+    def redrawAll(self, alpha = 1):
+        if self.BossInstructions:
+            self.drawList = []
+            self.draw('boss', self.bossScreen, self.bossSurfacePos)
+            self.present()
+        else:
+            super(ComputerLevel, self).redrawAll(alpha)
+
+    def drawScore(self):
+        scoreColor = (46,139,87)
+        world = self.world
+        score = "Score: %d" % world.player1.score
+        lives = "Lives: %d" % world.player1.lives
+        blocks = world.maxBlocks - world.blockCounter
+        blockText = "Drops remaining: %d/%d" % (blocks, world.maxBlocks)
+        scoreDraw = renderText(score, scoreColor)
+        livesDraw = renderText(lives, scoreColor)
+        blocksDraw = renderText(blockText, scoreColor)
+        self.draw('score', scoreDraw, self.scorePos)
+        self.draw('lives', livesDraw, self.livesPos)
+        self.draw('blocks', blocksDraw, self.blocksPos)
 
     def initBossScreen(self):
         bossImage, bossRect = load_image('Backgrounds/bosssurface.png')
         self.bossScreen = bossImage
         self.bossSurfacePos = (0,0)
 
-    def run(self, size, screen, clock, p1 = None, p2 = None):
-        self.screenSize = width, height = size
+    def start(self, size, screen, clock, p1 = None, p2 = None):
+        self.screenSize = size
         self.screen = screen
         self.clock = clock
         self.init()
-        self.player1 = p1
-        self.player2 = None
-        self.placePlayers()
+        self.world.player1 = p1
+        self.world.placePlayers()
+
+    def run(self, size, screen, clock, p1 = None, p2 = None):
+        self.start(size, screen, clock, p1, p2)
         while self.mode != False:
-            if self.timerFired() == False:
+            result = self.timerFired()
+            if result == False:
                 return False
-            elif self.timerFired() == True:
-                return self.player1
+            elif result == True:
+                return self.world.player1
             elif self.mode == 'Quit':
                 return None
         return False
 
     def init(self):
         super(ComputerLevel, self).init()
-        self.movesClock = 0
-        self.target = None
-        self.currentBlock = None
+        self.world.planning = self.planning
         self.BossInstructions = True
         self.mode = 'Pause'
         self.initBossScreen()
-        self.movesList = []
@@ -0,0 +1,69 @@
+# Contact table: which platforms each block is on, and the height of each
+# platform's surface under the block. Worked out once per world step (for
+# every block/platform pair), then read by the collision code, adjustBlocks
+# and the boss AI, instead of each of them redoing the trig.
+
+class ContactTable(object):
+
+    def __init__(self, world):
+        self.world = world
+        self.clear()
+
+    def clear(self):
+        self.hits = {} # block -> [(platform, surface y), ...]
+        self.onPlatform = {} # platform -> blocks on it, in block order
+
+    def build(self, blocks, platforms):
+        self.clear()
+        platforms = list(platforms)
+        for platform in platforms:
+            self.onPlatform[platform] = []
+        for block in blocks:
+            self.add(block, platforms)
+
+    def add(self, block, platforms):
+        hits = []
+        for platform in platforms:
+            y = self.world.getY(block, platform)
+            if self.world.isOnPlatform(block, platform, y):
+                hits += [(platform, y)]
+                if platform in self.onPlatform:
+                    self.onPlatform[platform] += [block]
+        self.hits[block] = hits
+        return hits
+
+    def snapshot(self):
+        onPlatform = dict([(platform, list(blocks))
+            for platform, blocks in self.onPlatform.items()])
+        return (dict(self.hits), onPlatform)
+
+    def restore(self, snapshot):
+        hits, onPlatform = snapshot
+        self.hits = dict(hits)
+        self.onPlatform = dict([(platform, list(blocks))
+            for platform, blocks in onPlatform.items()])
+
+    def forget(self, block):
+        # For blocks moved since the table was built (e.g. respawned)
+        for platform, y in self.hits.pop(block, []):
+            self.onPlatform[platform].remove(block)
+
+    def getHits(self, block):
+        if block not in self.hits:
+            # New since the table was built
+            return self.add(block, self.world.platforms)
+        return self.hits[block]
+
+    # Queries
+
+    def platformsHit(self, block):
+        return [platform for platform, y in self.getHits(block)]
+
+    def blocksOn(self, platform):
+        return self.onPlatform.get(platform, [])
+
+    def surfaceY(self, block, platform):
+        for hitPlatform, y in self.getHits(block):
+            if hitPlatform == platform:
+                return y
+        return self.world.getY(block, platform)
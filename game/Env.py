@@ -0,0 +1,325 @@
+import sys
+import time
+import argparse
+from multiprocessing import Process, Pipe, cpu_count
+from multiprocessing.sharedctypes import RawArray
+from GlobalFunctions import *
+from World import *
+from Level import GameLevel
+from ComputerLevel import ComputerLevel, ComputerWorld
+import Observation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Environments for training agents, gym style.
+# An Env plays one level headless (the world only, no drawing or clock):
+#
+#   observation = env.reset(seed)
+#   observation, reward, done, info = env.step(action)
+#
+# Actions are 0 = nothing, 1 = jump, 2 = walk left, 3 = walk right, for
+# player 1, and each step() runs frameSkip world steps (by default one AI
+# tick, the same rate the boss gets to move at). Rewards: +1 for each life
+# taken off an enemy (a fireball, or the boss), -1 for each life lost, and
+# +10 or -10 when the level is won or lost.
+#
+# Env(observation = 'world') observes the whole world instead, laid out as
+# Observation.WorldEncoder describes. Either way an Env writes each
+# observation into the same array (observation), which bind() can point at
+# another buffer; the vectorized Envs bind each Env to its own row, so
+# nothing is copied.
+#
+# VectorEnv steps a number of Envs in lockstep in this process.
+# ProcessVectorEnv spreads them over worker processes, which write
+# observations, rewards and done flags straight into shared memory, so a
+# step only sends a few bytes down each pipe. Both take and return arrays
+# with one row per Env, and reset an Env by themselves when it finishes:
+# Env i of n plays seeds seed + i, seed + i + n, ... so both kinds play
+# exactly the same episodes.
+#
+#   python Env.py benchmark [--envs N] [--workers 1,2,4] [--steps S]
+#       [--observation vector|world]
+
+actionCommands = [None, 0, -1, 1]
+
+class Env(object):
+
+    frameSkip = 4
+    maxSteps = 3000 # world steps before an episode is cut short
+
+    def __init__(self, levelType = ComputerLevel, file = 'Levels/level2p1',
+        size = (600, 600), stepRate = 20, observation = 'vector'):
+        if numpy == None:
+            print 'Env needs numpy'
+            raise SystemExit
+        self.worldType = levelType.worldType
+        if self.worldType not in [GameWorld, ComputerWorld]:
+            print 'Env plays one player levels and the boss battle only'
+            raise SystemExit
+        self.levelData = load_level(file)
+        self.size = size
+        self.stepRate = stepRate
+        self.world = None
+        self.observationType = observation
+        self.observationSize = observationSizes[observation]
+        self.bind(numpy.zeros(self.observationSize, numpy.float32))
+
+    def bind(self, out):
+        # Observations get written into out from now on
+        self.observation = out
+        if self.observationType == 'world':
+            self.encoder = Observation.WorldEncoder(out = out)
+
+    def reset(self, seed = None):
+        world = self.world = self.worldType(self.levelData, self.size,
+            self.stepRate, seed)
+        self.seed = world.seed
+        if self.worldType == GameWorld:
+            width, height = self.size
+            world.placePlayer(width/2, height/2)
+            self.player = world.player
+        else:
+            world.placePlayers()
+            self.player = world.player1
+        self.lives = self.player.lives
+        self.enemyLives = self.getEnemyLives()
+        return self.observe()
+
+    def step(self, action):
+        world = self.world
+        command = actionCommands[action]
+        inputs = []
+        if command != None:
+            inputs = [(1, command)]
+        for i in xrange(self.frameSkip):
+            world.step(inputs)
+            inputs = []
+            if world.mode != None:
+                break
+        reward = self.getReward()
+        done = world.mode != None or world.frame >= self.maxSteps
+        return self.observe(), reward, done, {'mode': world.mode,
+            'frame': world.frame}
+
+    def getEnemyLives(self):
+        if self.worldType == ComputerWorld:
+            return self.world.player2.lives
+        return sum([enemy.lives for enemy in self.world.enemies])
+
+    def getReward(self):
+        lives, enemyLives = self.player.lives, self.getEnemyLives()
+        reward = (self.enemyLives - enemyLives) - (self.lives - lives)
+        self.lives, self.enemyLives = lives, enemyLives
+        mode = self.world.mode
+        if mode == 'Won' or (mode == 'Over' and
+            self.worldType == ComputerWorld):
+            reward += 10
+        elif mode != None:
+            reward -= 10
+        return reward
+
+    def observe(self):
+        if self.observationType == 'world':
+            self.encoder.encode(self.world)
+        else:
+            observe(self.world, self.player, self.observation)
+        return self.observation
+
+# Observations: one float32 vector
+#   0-5   player: center x, center y, vx, vy, lives, jumpStep
+#   6-11  opponent (the boss, or the nearest fireball): the same
+#   12-16 nearest drop: center x, center y, vx, vy, dropType (0 = none)
+#   17    frame/1000
+# Positions are divided by 600, the screen size.
+observationSize = 18
+observationSizes = {'vector': observationSize,
+    'world': Observation.observationSize}
+
+def observe(world, player, out):
+    out[:] = 0
+    writePlayer(out, 0, player)
+    if isinstance(world, ComputerWorld):
+        writePlayer(out, 6, world.player2)
+    elif len(world.enemies) > 0:
+        x, y = player.rect.center
+        enemy = min(world.enemies, key = lambda enemy:
+            abs(enemy.rect.centerx - x) + abs(enemy.rect.centery - y))
+        writePlayer(out, 6, enemy)
+    drops = [block for block in world.fallingBlocks
+        if hasattr(block, 'dropType')]
+    if drops != []:
+        x, y = player.rect.center
+        drop = min(drops, key = lambda drop:
+            abs(drop.rect.centerx - x) + abs(drop.rect.centery - y))
+        x, y = drop.rect.center
+        out[12:17] = (x/600.0, y/600.0, drop.vx, drop.vy, drop.dropType)
+    out[17] = world.frame/1000.0
+
+def writePlayer(out, start, sprite):
+    x, y = sprite.rect.center
+    out[start:start + 6] = (x/600.0, y/600.0, getattr(sprite, 'vx', 0),
+        getattr(sprite, 'vy', 0), sprite.lives, getattr(sprite, 'jumpStep', 0))
+
+# Vectorized
+
+class VectorEnv(object):
+
+    def __init__(self, count, levelType = ComputerLevel,
+        file = 'Levels/level2p1', observation = 'vector'):
+        initHeadless()
+        self.envs = [Env(levelType, file, observation = observation)
+            for i in xrange(count)]
+        self.count = count
+        self.observations = numpy.zeros((count,
+            observationSizes[observation]), numpy.float32)
+        bindEnvs(self.envs, self.observations)
+        self.rewards = numpy.zeros(count)
+        self.dones = numpy.zeros(count, bool)
+
+    def reset(self, seed = 0):
+        resetEnvs(self.envs, seed)
+        return self.observations
+
+    def step(self, actions):
+        stepEnvs(self.envs, actions, self.rewards, self.dones, self.count)
+        return self.observations, self.rewards, self.dones, {}
+
+    def close(self):
+        self.envs = []
+
+def bindEnvs(envs, observations):
+    for i, env in enumerate(envs):
+        env.bind(observations[i])
+
+def resetEnvs(envs, seed):
+    for i, env in enumerate(envs):
+        env.reset(seed + i)
+
+def stepEnvs(envs, actions, rewards, dones, count):
+    for i, env in enumerate(envs):
+        observation, rewards[i], dones[i], info = env.step(actions[i])
+        if dones[i]:
+            env.reset(env.seed + count)
+
+def runWorker(connection, first, count, buffers, levelType, file,
+    observation):
+    initHeadless()
+    observations, rewards, dones, actions = [numpy.frombuffer(buffer, kind)
+        for buffer, kind in zip(buffers,
+        [numpy.float32, numpy.float64, numpy.bool_, numpy.int32])]
+    observations = observations.reshape(-1, observationSizes[observation])
+    rows = slice(first, first + count)
+    envs = [Env(levelType, file, observation = observation)
+        for i in xrange(count)]
+    bindEnvs(envs, observations[rows])
+    while True:
+        message, argument = connection.recv()
+        if message == 'reset':
+            resetEnvs(envs, argument + first)
+        elif message == 'step':
+            stepEnvs(envs, actions[rows], rewards[rows], dones[rows],
+                len(dones))
+        elif message == 'close':
+            connection.close()
+            return
+        connection.send(True)
+
+class ProcessVectorEnv(object):
+
+    def __init__(self, count, workers = None, levelType = ComputerLevel,
+        file = 'Levels/level2p1', observation = 'vector'):
+        if numpy == None:
+            print 'ProcessVectorEnv needs numpy'
+            raise SystemExit
+        workers = min(count, workers or cpu_count())
+        self.count = count
+        size = observationSizes[observation]
+        buffers = [RawArray('f', count*size), RawArray('d', count),
+            RawArray('b', count), RawArray('i', count)]
+        self.observations = numpy.frombuffer(buffers[0],
+            numpy.float32).reshape(count, size)
+        self.rewards = numpy.frombuffer(buffers[1], numpy.float64)
+        self.dones = numpy.frombuffer(buffers[2], numpy.bool_)
+        self.actions = numpy.frombuffer(buffers[3], numpy.int32)
+        self.connections = []
+        self.processes = []
+        first = 0
+        for worker in xrange(workers):
+            share = count/workers + (worker < count % workers)
+            connection, workerEnd = Pipe()
+            process = Process(target = runWorker, args = (workerEnd, first,
+                share, buffers, levelType, file, observation))
+            process.daemon = True
+            process.start()
+            workerEnd.close() # so a worker dying shows up as EOFError here
+            self.connections += [connection]
+            self.processes += [process]
+            first += share
+
+    def call(self, message, argument = None):
+        for connection in self.connections:
+            connection.send((message, argument))
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self, seed = 0):
+        self.call('reset', seed)
+        return self.observations
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self.call('step')
+        return self.observations, self.rewards, self.dones, {}
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.connections = self.processes = []
+
+# Benchmark
+
+def timeSteps(env, steps, seed = 0):
+    # Environment steps per second, with random actions
+    rand = numpy.random.RandomState(seed)
+    env.reset(seed)
+    actions = rand.randint(0, len(actionCommands), (steps, env.count))
+    start = time.time()
+    for i in xrange(steps):
+        env.step(actions[i])
+    return steps*env.count/(time.time() - start)
+
+def benchmark(envs, workerCounts, steps, observation = 'vector'):
+    single = timeSteps(VectorEnv(envs, observation = observation), steps)
+    print '%-24s %9.0f steps/s' % ('in process', single)
+    for workers in workerCounts:
+        env = ProcessVectorEnv(envs, workers, observation = observation)
+        try:
+            rate = timeSteps(env, steps)
+        finally:
+            env.close()
+        print '%-24s %9.0f steps/s  (%.2fx in process, %d cores)' % (
+            'worker processes: %d' % workers, rate, rate/single, cpu_count())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices = ['benchmark'])
+    parser.add_argument('--envs', type = int, default = 8)
+    parser.add_argument('--workers', default = None,
+        help = 'comma separated worker counts (default: 1, 2, 4... up to '
+        'one per CPU)')
+    parser.add_argument('--steps', type = int, default = 500)
+    parser.add_argument('--observation', choices = sorted(observationSizes),
+        default = 'vector')
+    args = parser.parse_args()
+    if args.workers:
+        workerCounts = [int(count) for count in args.workers.split(',')]
+    else:
+        workerCounts = [1]
+        while workerCounts[-1]*2 <= cpu_count():
+            workerCounts += [workerCounts[-1]*2]
+    benchmark(args.envs, workerCounts, args.steps, args.observation)
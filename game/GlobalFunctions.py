@@ -1,5 +1,7 @@
 import pygame
 import os
+from Assets import assets
+from LevelFormat import compiledPath, loadCompiledLevel, loadShelvedLevel
 
 def reverse(l):
     # Readable function to reverse lists
@@ -8,17 +10,9 @@ def reverse(l):
 # From Pete Shinner's line-by-line Chimp tutorial
 # http://www.pygame.org/docs/tut/chimp/ChimpLineByLine.html
 
-def load_image(name, colorkey=None):
-    try:
-        image = pygame.image.load(name)
-    except pygame.error, message:
-        print 'Cannot load image:', name
-        raise SystemExit, message
-    image = image.convert()
-    if colorkey is not None:
-        if colorkey is -1:
-            colorkey = image.get_at((0,0))
-        image.set_colorkey(colorkey)
+def load_image(name, colorkey=None, alpha=False):
+    # Each image is only decoded once; see Assets.py
+    image = assets.getImage(name, colorkey, alpha)
     return image, image.get_rect()
 
 def load_sound(path):
@@ -32,3 +26,25 @@ def load_sound(path):
         print "Cannot load sound:", path
         raise SystemExit, message
     return sound
+
+def load_level(path):
+    # Uses the compiled level (path + '.json') when there is one, otherwise
+    # reads the shelve into a dict and closes it; see LevelFormat.py
+    if os.path.exists(compiledPath(path)):
+        return loadCompiledLevel(compiledPath(path))
+    return loadShelvedLevel(path)
+
+def initHeadless(size = (600, 600)):
+    # Sets up SDL's dummy video driver, so worlds can be simulated (and
+    # images converted) on machines without a window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    return pygame.display.set_mode(size)
+
+def blitImages(surface, blitList):
+    # Surface.blits does a whole list of blits in one call (pygame 1.9.4+)
+    if hasattr(surface, 'blits'):
+        surface.blits(blitList, False)
+    else:
+        for blit in blitList:
+            surface.blit(*blit)
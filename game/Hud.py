@@ -0,0 +1,42 @@
+import pygame
+
+# Scoreboard text.
+# The bundled font is loaded once per size, and rendered strings are cached
+# by text, color and size. Scores, lives and drops remaining only change a
+# few times per level, so most frames reuse the surfaces from the frame
+# before (which also lets the dirty renderer skip them).
+
+fontPath = 'consola.ttf'
+
+class TextCache(object):
+
+    def __init__(self, maxSize = 256):
+        self.fonts = {} # size -> Font
+        self.surfaces = {} # (text, color, size) -> rendered Surface
+        self.maxSize = maxSize
+        self.hits = self.renders = 0
+
+    def getFont(self, size):
+        if size not in self.fonts:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.fonts[size] = pygame.font.Font(fontPath, size)
+        return self.fonts[size]
+
+    def render(self, text, color, size = 20):
+        key = (text, color, size)
+        if key in self.surfaces:
+            self.hits += 1
+            return self.surfaces[key]
+        if len(self.surfaces) >= self.maxSize:
+            # Mostly old scores nobody will see again
+            self.surfaces.clear()
+        surface = self.getFont(size).render(text, True, color)
+        self.surfaces[key] = surface
+        self.renders += 1
+        return surface
+
+textCache = TextCache()
+
+def renderText(text, color, size = 20):
+    return textCache.render(text, color, size)
@@ -0,0 +1,129 @@
+import pygame
+
+# Shared cache of rotated (and flipped) sprite images.
+# Angles are rounded to buckets of `step` degrees, so sprites that keep
+# settling on similar angles reuse the same frames instead of resampling
+# with pygame.transform.rotate every frame. Least recently used frames are
+# dropped once the cache holds more than maxSize of them.
+#
+# Collision masks (pygame.mask) of those frames are cached the same way, for
+# pixel-accurate collisions (GameWorld.pixelCollisions): a frame is made
+# once per source image, angle bucket and flip, so its mask is too.
+
+class RotationCache(object):
+
+    def __init__(self, step = 1, maxSize = 2048):
+        self.step = step
+        self.maxSize = maxSize
+        self.frames = {} # (image, angle, flip) -> [frame, last use]
+        self.uses = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def configure(self, step = None, maxSize = None):
+        # Changing the step makes every stored frame the wrong angle
+        if step != None and step != self.step:
+            self.step = step
+            self.clear()
+        if maxSize != None:
+            self.maxSize = maxSize
+            self.evict()
+
+    def quantize(self, angle):
+        bucket = int(round(angle/float(self.step)))
+        return (bucket*self.step) % 360
+
+    def rotate(self, image, angle, flip = False):
+        # Image flipped horizontally (if asked), then rotated by angle
+        angle = self.quantize(angle)
+        if angle == 0 and not flip:
+            return image
+        self.uses += 1
+        key = (image, angle, flip)
+        entry = self.frames.get(key)
+        if entry != None:
+            self.hits += 1
+            entry[1] = self.uses
+            return entry[0]
+        self.misses += 1
+        frame = image
+        if flip:
+            frame = pygame.transform.flip(frame, True, False)
+        if angle != 0:
+            frame = pygame.transform.rotate(frame, angle)
+        self.frames[key] = [frame, self.uses]
+        if len(self.frames) > self.maxSize:
+            self.evict()
+        return frame
+
+    def evict(self):
+        # Drops least recently used frames, with some headroom so that a
+        # full cache doesn't have to evict on every miss
+        if len(self.frames) <= self.maxSize:
+            return
+        keep = self.maxSize*9/10
+        byAge = sorted(self.frames, key = lambda key: self.frames[key][1])
+        for key in byAge[:len(byAge) - keep]:
+            del self.frames[key]
+            self.evictions += 1
+
+    def clear(self):
+        self.frames.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hitRate = 0.0
+        if lookups > 0:
+            hitRate = float(self.hits)/lookups
+        return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'size': len(self.frames),
+            'hitRate': hitRate}
+
+rotationCache = RotationCache()
+
+def rotateImage(image, angle, flip = False):
+    return rotationCache.rotate(image, angle, flip)
+
+class MaskCache(object):
+
+    # Masks keyed by the image they were made from. Rotated frames come
+    # from the rotation cache above, which hands out the same frame for the
+    # same (image, angle bucket, flip), so one mask serves every sprite
+    # drawn with that frame. Lookups happen for every collision test, so
+    # there is no use tracking: a mask is quick to make again, and a full
+    # cache just starts over.
+
+    def __init__(self, maxSize = 2048):
+        self.maxSize = maxSize
+        self.masks = {} # image -> mask
+        self.misses = self.evictions = 0
+
+    def get(self, image):
+        mask = self.masks.get(image)
+        if mask == None:
+            mask = self.add(image)
+        return mask
+
+    def add(self, image):
+        self.misses += 1
+        if len(self.masks) >= self.maxSize:
+            self.evictions += len(self.masks)
+            self.masks.clear()
+        # Transparent or colorkey pixels are left out
+        mask = self.masks[image] = pygame.mask.from_surface(image)
+        return mask
+
+    def clear(self):
+        self.masks.clear()
+
+    def stats(self):
+        return {'misses': self.misses, 'evictions': self.evictions,
+            'size': len(self.masks)}
+
+maskCache = MaskCache()
+getMask = maskCache.get # (bound once; it is called for every test)
+
+def collideMasks(a, b):
+    # Whether two sprites' drawn pixels overlap, each image placed at its
+    # rect's top left; a narrow phase for sprites whose rects overlap
+    offset = (b.rect.x - a.rect.x, b.rect.y - a.rect.y)
+    return getMask(a.image).overlap(getMask(b.image), offset) != None
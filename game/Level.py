@@ -2,16 +2,69 @@ import pygame
 import random
 from pygame.locals import *
 import math
-import shelve
 import os
+import threading
+import time
 from Classes import *
 from GlobalFunctions import *
+from World import *
+from Renderer import *
+from Hud import *
+from Recording import InputRecorder
+from Timing import FrameTimers
+from Profiling import LevelProfiler
 
 # Basic 1P and 2P levels!
 # Boss level with AI is in ComputerLevel.py
+# Levels draw a world (see World.py) and feed it the players' controls
+
+def levelBackground(levelData):
+    if 'background' in levelData:
+        return levelData['background']
+    return 'Backgrounds/defaultbackground.png'
 
 class GameLevel(object):
 
+    worldType = GameWorld
+
+    # The world steps stepRate times per second of game time, while we draw
+    # up to frameRate times per second (0 = as often as possible).
+    # timeScale runs game time slower or faster than real time.
+    stepRate = 20
+    frameRate = 60
+    timeScale = 1.0
+    maxFrameTime = 0.25 # seconds; longer frames are not caught up on
+
+    # Only redraw the parts of the screen that changed (see Renderer.py)
+    dirtyRendering = False
+
+    # Pixel-accurate collisions in the world (see GameWorld.collide)
+    pixelCollisions = False
+
+    # A FrameCapture to draw frames into instead of the display (see
+    # Capture.py), and a FrameRecorder to hand every frame shown to (see
+    # Video.py)
+    capture = None
+    frameRecorder = None
+
+    # FrameTimers timing each phase of a frame (see Timing.py; F3 turns them
+    # on), and a folder to write each level's timings to
+    timers = None
+    timingFolder = None
+
+    # A LevelProfiler to profile levels with (see Profiling.py; F5 starts
+    # and stops one)
+    profiler = None
+
+    # Images only this kind of level uses, for LevelHandle.prefetch()
+    prefetchImages = []
+
+    # Seed for each new world (None = a different one every time), and a
+    # folder to log every run's inputs to (see Recording.py)
+    seed = None
+    recordFolder = None
+    recordings = 0 # logs started by this process
+
     # Player controls!
 
     def mousePressed(self, event):
@@ -40,23 +93,18 @@ class GameLevel(object):
         elif eventName == 'quit':
             self.mode = 'Quit'
         elif eventName == 'nextLevel':
-            self.resetPlayer()
+            self.world.resetPlayer()
             self.mode = 'next'
             # Temp mode that tells TimerFired to return the player
 
-    def resetPlayer(self):
-        # Because 2P mode has a different reset player
-        self.player.reset()
-
     def retryLevel(self):
         width, height = self.screenSize
         self.mode = None # Unpauses
-        score = self.player.score
-        self.player.kill()
-        self.player = None # Resets so that we can make a new "player"
-        self.init()
-        self.placePlayer(width/2, height/2)
-        self.player.score = score
+        score = self.world.player.score
+        self.world.player.kill()
+        self.init() # New world, so a new "player" is made too
+        self.world.placePlayer(width/2, height/2)
+        self.world.player.score = score
 
     def keyPressed(self, event):
         if event.key == pygame.K_p and self.mode != 'Over':
@@ -66,24 +114,45 @@ class GameLevel(object):
         elif event.key == pygame.K_t:
             self.mode = 'Won'
         elif event.key == pygame.K_g:
-            self.powerUpCounter = self.powerUpInt - 1
-        if self.mode == None and self.player != None:
+            self.inputs += [(0, self.world.powerUpCheat)]
+        self.timeControls(event)
+        if self.mode == None and self.world.player != None:
             if event.key == pygame.K_RIGHT:
-                self.player.walk(1)
+                self.inputs += [(1, 1)]
             elif event.key == pygame.K_LEFT:
-                self.player.walk(-1)
+                self.inputs += [(1, -1)]
             elif event.key == pygame.K_UP or event.key == pygame.K_SPACE:
-                self.player.jump()
+                self.inputs += [(1, 0)]
+
+    def timeControls(self, event):
+        # Slow motion and fast forward, for testing
+        if event.key == pygame.K_MINUS:
+            self.timeScale /= 2.0
+        elif event.key == pygame.K_EQUALS:
+            self.timeScale *= 2.0
+        elif event.key == pygame.K_0:
+            self.timeScale = 1.0
 
     def timerFired(self):
-        self.redrawAll()
-        self.clock.tick(20)
+        elapsed = self.clock.tick(self.frameRate)/1000.0
+        if self.timers != None:
+            self.timers.startFrame()
+        if self.profiler != None:
+            self.profiler.frame(self.world.frame)
+        if self.mode == 'Won' and self.nextLevel != None:
+            self.nextLevel.prefetch() # while the win screen is up
         if self.mode == 'next':
             return True
             self.mode = False
         elif self.mode == None: # In gameplay
-            self.allsprites.update()
-            self.handleCollisions()
+            self.stepWorld(min(elapsed, self.maxFrameTime)*self.timeScale)
+        self.redrawAll(self.accumulator*self.world.stepRate)
+        result = self.handleEvents()
+        if self.timers != None:
+            self.timers.endFrame()
+        return result
+
+    def handleEvents(self):
         self.mousePos = pygame.mouse.get_pos()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -92,275 +161,176 @@ class GameLevel(object):
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 self.mousePressed(event)
             elif event.type == pygame.KEYDOWN:
+                self.debugControls(event)
                 self.keyPressed(event)
 
-    # Update game elements at each frame:
-
-    def handleCollisions(self):
-        self.handlePlatformCollisions()
-        self.enemyCollisions()
-        self.newBlock()
-        if self.player != None:
-            self.handlePowerUps()
-            self.setPowerUps()
-        self.adjustBlocks()
-        self.clearOldSprites()
-        if self.player.lives == 0:
-            self.player.kill()
-            self.mode = "Over"
-        elif len(self.enemies) == 0:
-            blocksBonus = self.maxBlocks - self.blockCounter
-            self.player.score += blocksBonus
-            self.mode = 'Won'
-
-    def clearOldSprites(self):
-        # Manages any sprites that go off-screen
-        width, height = self.screenSize
-        for sprite in self.allsprites:
-            if (sprite.rect.top > height):
-                if sprite == self.player:
-                    self.player.loseLife(True)
-                else:
-                    sprite.kill()
-            elif (sprite.rect.left < 0 or sprite.rect.right > width):
-                if sprite == self.player:
-                    sprite.rect.left = sprite.rect.left % width
-                else:
-                    sprite.kill()
-
-    def setPowerUps(self):
-        self.powerUpCounter += 1
-        # Get rectangular limits of where powerups can be placed
-        (x1, x2) = self.levelData['powerupsX']
-        (y1, y2) = self.levelData['powerupsY']
-        if len(self.powerUps) == 0 and self.powerUpCounter == self.powerUpInt:
-            x = random.randint(x1, x2)
-            y = random.randint(y1, y2)
-            self.newPowerUp(x, y)
-            self.powerUpCounter = 0
-            # Decide how long to wait before next powerup spawns:
-            wait = random.randint(self.powerTimeMin, self.powerTimeMax)
-            self.powerUpInt = wait
-
-    # Collisions and more physics
-
-    def handlePowerUps(self):
-        power = None
-        for powerup in self.powerUps:
-            if pygame.sprite.collide_rect(powerup, self.player):
-                self.player.reset()
-                self.player.power = power = powerup.power
-                powerup.kill()
-        if power == 'Heavy':
-            self.player.changeWeight(2) # doubles player weight
-        elif power == "Light":
-            self.player.changeWeight(0.5) # halves player weight
-        elif power == "Fast":
-            self.player.speed *= 2
-            # This has no effect yet
-        elif power == "Slow":
-            self.player.speed /= 2
-            # ALso no effect
-
-    def handlePlatformCollisions(self):
-        for platform in self.platforms:
-            totalweight = 0
-            for block in self.fallingBlocks:
-                if self.isOnPlatform(block, platform):
-                    totalweight += self.getBlockWeight(block, platform)
-                    if block.onPlatform == False: # just landed
-                        block.vy = 0
-                        block.jumpStep = 0
-                    block.onPlatform = True
-            platform.adjustPlatformAngle(totalweight)
-        for block in self.fallingBlocks:
-            if self.platformsHit(block) == []:
-                block.onPlatform = False
-
-    def enemyCollisions(self):
-        for enemy in self.enemies:
-            if not enemy.block:
-                hitList = pygame.sprite.spritecollide(enemy,
-                    self.fallingBlocks, False)
-                for block in hitList:
-                    if block == self.player and not self.player.block:
-                        self.player.loseLife()
-                        enemy.loseLife()
-                    elif block != self.player:
-                        enemy.loseLife()
-                if enemy.lives == 0:
-                    enemy.kill()
-                    self.player.score += 1
-
-    def platformsHit(self, block):
-        hitList = []
-        for platform in self.platforms:
-            if self.isOnPlatform(block, platform):
-                hitList += [platform]
-        return hitList
-
-    def isOnPlatform(self, block, platform):
-        # Compares y-location to calculated point on platform
-        # and checks whether the block will hit the platform at the next frame
-        y = self.getY(block, platform)
-        blockCx, blockCy = block.rect.center
-        if blockCx < platform.rect.left or blockCx > platform.rect.right:
-            return False
-        return ((block.rect.bottom - y) < block.terminalVelocity and
-            abs(y - block.rect.bottom) < platform.height)
-
-    def getY(self, block, platform):
-        # Returns what the y-value of the block would be (within some error)
-        # if it were on the platform.
-        blockCx, blockCy = block.rect.center
-        dx = blockCx - platform.cx
-        y = platform.cy - (dx*math.tan(platform.angle*math.pi/180))
-        return y - platform.height/2
-
-    def adjustBlocks(self):
-        for block in self.fallingBlocks:
-            platformsHit = self.platformsHit(block)
-            if platformsHit == []:
-                # return to normal!
-                block.targetAngle = -block.angle/14.0
-            else:
-                for platform in platformsHit:
-                    # should only have one
-                    block.targetAngle = platform.angle - block.angle
-                    block.vx -= platform.angle/30.0
-                    if block.vy >= 0:
-                        block.rect.bottom = self.getY(block, platform)
-
-    def getBlockWeight(self, block, platform):
-        # Calculates how much a block weighs down a platform
-        blockCx, blockCy = block.rect.center
-        distance = platform.cx - blockCx
-        return block.weight * distance
-
-    # Functions that make new game objects and add them to appropriate lists
-
-    def newFireball(self, x, y, enemy = Fireball, lives = 3):
-        fireball = enemy(x, y, lives)
-        self.allsprites.add(fireball)
-        self.enemies.add(fireball)
-
-    def newPlatform(self, x, y, platform = Platform):
-        newPlatform = platform(x, y)
-        self.allsprites.add(newPlatform)
-        self.platforms.add(newPlatform)
-
-    def placePlayer(self, x, y):
-        if self.player == None:
-            # Create new player
-            self.player = Player(x, y)
-        else:
-            self.player.rect.left = x
-            self.player.rect.top = y
-            self.player.fullReset()
-        self.allsprites.add(self.player)
-        self.fallingBlocks.add(self.player)
-
-    def newBlock(self):
-        # Creates new block from random drop location
-        width, height = self.screenSize
-        if len(self.fallingBlocks) < 2 and self.player != None:
-            if self.blockCounter == self.maxBlocks:
-                self.mode = 'Over'
-            else:
-                x = self.getDropLocation()
-                block = Raindrop(x,0)
-                self.allsprites.add(block)
-                self.fallingBlocks.add(block)
-                self.blockCounter += 1
-                self.currentBlock = block
-
-    def getDropLocation(self):
-        # Requires that level data has a dropSpace key
-        # Each entry in dropSpace is a range of legal drop positions
-        xList = []
-        for (x1, x2) in self.levelData['dropSpace']:
-            sizeConstant = (abs(x1 - x2)/20)
-            # Prevents small ranges from being overrepresented in random choice
-            if sizeConstant < 1:
-                sizeConstant = 1
-            xList += [random.randint(x1, x2)]*sizeConstant
-        return random.choice(xList)
-
-    def newPowerUp(self, x, y):
-        powerUp = PowerUp(x,y)
-        self.allsprites.add(powerUp)
-        self.powerUps.add(powerUp)
+    def debugControls(self, event):
+        # F3: timing overlay, F4: write the timings out, F5: profile
+        if event.key == pygame.K_F3:
+            if self.timers == None:
+                self.timers = FrameTimers()
+                self.timers.attach(self)
+            self.timers.toggleOverlay()
+        elif event.key == pygame.K_F4 and self.timers != None:
+            for path in self.timers.export(self.timingFolder or '.',
+                os.path.basename(self.file)):
+                print 'Wrote', path
+        elif event.key == pygame.K_F5:
+            if self.profiler == None:
+                self.profiler = LevelProfiler(levels = [])
+                self.profiler.startLevel(os.path.basename(self.file))
+            self.profiler.toggle()
+            for path in self.profiler.written:
+                print 'Wrote', path
+            self.profiler.written = []
+
+    def stepWorld(self, time):
+        # Fixed timestep: game time builds up, and is used up in steps of
+        # exactly 1/stepRate seconds. What's left over is drawn by
+        # interpolating between the last two steps.
+        self.accumulator += time
+        stepTime = 1.0/self.world.stepRate
+        if self.recordFolder != None and self.recorder == None:
+            self.startRecording()
+        while self.accumulator >= stepTime and self.mode == None:
+            if self.recorder != None:
+                self.recorder.record(self.world.frame, self.inputs)
+            self.world.step(self.inputs)
+            self.inputs = []
+            self.accumulator -= stepTime
+            if self.world.mode != None:
+                self.mode = self.world.mode
+                self.stopRecording()
+
+    def startRecording(self):
+        # Starts at the first step, once the players are in place. The 2P
+        # and boss levels share a level file, and a retry can start within
+        # the same second, so names have the world type and a count too.
+        GameLevel.recordings += 1
+        name = '%s-%s-%s-%d-%d.ffi' % (os.path.basename(self.file),
+            type(self.world).__name__, time.strftime('%Y%m%d-%H%M%S'),
+            self.world.seed, GameLevel.recordings)
+        path = os.path.join(self.recordFolder, name)
+        self.recorder = InputRecorder(path, self.world, self.file)
+
+    def stopRecording(self):
+        if self.recorder != None:
+            self.recorder.close(self.world.frame)
+            self.recorder = None
 
     # Drawing
 
-    def redrawAll(self):
-        self.screen.blit(self.background, (0,0))
+    def redrawAll(self, alpha = 1):
+        # alpha: how far between the last two world steps to draw sprites
+        # Everything goes on the draw list over the background, and then
+        # gets drawn in one go
+        self.drawList = []
         self.drawScore()
-        for sprite in self.allsprites:
-            self.screen.blit(sprite.image, (sprite.rect.x, sprite.rect.y))
+        self.drawSprites(alpha)
+        self.drawMenus()
+        self.present()
+
+    def draw(self, key, image, position):
+        # key identifies the same item from frame to frame
+        self.drawList += [(key, image, position)]
+
+    def present(self):
+        if self.timers != None and self.timers.overlay:
+            self.draw('timing', self.timers.getOverlay(1.0/self.frameRate),
+                (self.screenSize[0] - 310, 80))
+        if self.capture != None:
+            blitList = [(image, position)
+                for key, image, position in self.drawList]
+            self.capture.present(self.background, blitList, self.screen)
+        elif self.renderer != None:
+            self.renderer.draw(self.drawList)
+        else:
+            self.screen.blit(self.background, (0,0))
+            blitList = [(image, position)
+                for key, image, position in self.drawList]
+            blitImages(self.screen, blitList)
+            pygame.display.flip()
+        if self.frameRecorder != None:
+            if self.capture != None:
+                self.frameRecorder.add(self.capture.surface)
+            else:
+                self.frameRecorder.add(self.screen)
+
+    def drawMenus(self):
         if self.mode == 'Pause':
-            self.screen.blit(self.pauseSurface, self.pauseSurfacePos)
-            self.pauseMenuSprites.draw(self.screen)
+            self.draw('menu', self.pauseSurface, self.pauseSurfacePos)
+            self.drawButtons(self.pauseMenuSprites)
         elif self.mode == 'Over' or self.mode == 'Lost':
-            self.screen.blit(self.lossSurface, self.lossSurfacePos)
-            self.lossMenuSprites.draw(self.screen)
+            self.draw('menu', self.lossSurface, self.lossSurfacePos)
+            self.drawButtons(self.lossMenuSprites)
         elif self.mode == 'Won':
-            self.screen.blit(self.winSurface, self.winSurfacePos)
-            self.winMenuSprites.draw(self.screen)
-        pygame.display.flip()
+            self.draw('menu', self.winSurface, self.winSurfacePos)
+            self.drawButtons(self.winMenuSprites)
+
+    def drawButtons(self, buttons):
+        for button in buttons:
+            self.draw(button, button.image, button.rect.topleft)
+
+    def drawSprites(self, alpha):
+        for sprite in self.world.allsprites:
+            position = self.world.interpolate(sprite, alpha)
+            self.draw(sprite, sprite.image, position)
+        if self.world.storm != None:
+            blitList = self.world.storm.getBlits(alpha)
+            for i in range(len(blitList)):
+                image, position = blitList[i]
+                self.draw(('drop', i), image, position)
 
     def drawScore(self):
         scoreColor = (46,139,87)
-        score = "Score: %d" % self.player.score
-        lives = "Lives: %d" % self.player.lives
-        blocks = self.maxBlocks - self.blockCounter
-        blockText = "Drops remaining: %d/%d" % (blocks, self.maxBlocks)
-        scoreDraw = self.consola_font.render(score, True, scoreColor)
-        livesDraw = self.consola_font.render(lives, True, scoreColor)
-        blocksDraw = self.consola_font.render(blockText, True, scoreColor)
-        self.screen.blit(scoreDraw, self.scorePos)
-        self.screen.blit(livesDraw, self.livesPos)
-        self.screen.blit(blocksDraw, self.blocksPos)
+        world = self.world
+        score = "Score: %d" % world.player.score
+        lives = "Lives: %d" % world.player.lives
+        blocks = world.maxBlocks - world.blockCounter
+        blockText = "Drops remaining: %d/%d" % (blocks, world.maxBlocks)
+        scoreDraw = renderText(score, scoreColor)
+        livesDraw = renderText(lives, scoreColor)
+        blocksDraw = renderText(blockText, scoreColor)
+        self.draw('score', scoreDraw, self.scorePos)
+        self.draw('lives', livesDraw, self.livesPos)
+        self.draw('blocks', blocksDraw, self.blocksPos)
 
     # Set up stuff
 
     def init(self):
-        width, height = self.screenSize
+        self.stopRecording() # the last world's, when retrying
         self.mode = None
-        self.blockCounter = 0
-        self.allsprites = pygame.sprite.Group()
-        self.platforms = pygame.sprite.Group()
-        self.fallingBlocks = pygame.sprite.Group()
-        self.powerUps = pygame.sprite.Group()
-        self.powerTimeMin, self.powerTimeMax = 200, 400
-        self.powerUpInt = random.randint(self.powerTimeMin, self.powerTimeMax)
-        self.enemies = pygame.sprite.Group()
+        self.inputs = [] # (player, command) pairs for the next world step
+        self.accumulator = 0 # game time not yet stepped through
+        assets.preload('sprites', spriteAssets) # shared by every level
+        self.world = self.worldType(self.levelData, self.screenSize,
+            self.stepRate, self.seed)
+        self.world.pixelCollisions = self.pixelCollisions
         self.initGraphics()
-        self.powerUpCounter = 0
-        self.setPlatforms()
-        self.setEnemies()
-        self.setOptions()
-
-    def setPlatforms(self):
-        width, height = self.screenSize
-        cx, cy = width/2, (height) - 100
-        self.mainPlatform = mainPlatform = MainPlatform(cx, cy)
-        self.platforms.add(mainPlatform)
-        self.allsprites.add(mainPlatform)
-        for pCx, pCy in self.platformsList:
-            self.newPlatform(pCx, pCy)
-
-    def setEnemies(self):
-        for x, y in self.enemiesList:
-            self.newFireball(x, y)
-
-    def setOptions(self):
-        if 'lockingPlatforms' in self.levelData:
-            for pCx, pCy in self.levelData['lockingPlatforms']:
-                self.newPlatform(pCx, pCy, LockingPlatform)
-        if 'movingEnemies' in self.levelData:
-            for x, y in self.levelData['movingEnemies']:
-                self.newFireball(x, y, MovingFireball)
+        self.renderer = None
+        if self.dirtyRendering:
+            self.renderer = DirtyRenderer(self.screen, self.background)
+        if self.timingFolder != None and self.timers == None:
+            self.timers = FrameTimers()
+        if self.timers != None:
+            self.timers.attach(self) # the new world's methods
+        if self.profiler != None:
+            self.profiler.startLevel(os.path.basename(self.file))
+
+    def close(self):
+        # Lets go of the world, and of images only this level uses
+        self.stopRecording()
+        if self.profiler != None:
+            self.profiler.endLevel()
+        if self.timers != None:
+            self.timers.detach()
+            if self.timingFolder != None:
+                self.timers.export(self.timingFolder,
+                    os.path.basename(self.file))
+            self.timers = None
+        assets.evict(self.file)
+        self.world = self.renderer = self.background = None
+        self.drawList = []
 
     def initGraphics(self):
         self.initPauseMenu()
@@ -368,12 +338,10 @@ class GameLevel(object):
         self.initWinMenu()
         self.initScoreboard()
         self.loadBackground()
-        self.consola_font = pygame.font.SysFont('consola.ttf', 20)
 
     def loadBackground(self):
-        if 'background' in self.levelData:
-            background = self.levelData['background']
-        else: background = 'Backgrounds/defaultbackground.png'
+        background = levelBackground(self.levelData)
+        assets.preload(self.file, [background])
         self.background, backgroundRect = load_image(background)
 
     # Set up menus for paused, failed level, and win modes:
@@ -415,37 +383,41 @@ class GameLevel(object):
         self.livesPos = (300, 50)
         self.blocksPos = (400, 50)
 
-    def run(self, size, screen, clock, player = None):
+    def start(self, size, screen, clock, player = None):
+        # Everything run() does before its loop
         self.screenSize = width, height = size
         self.screen = screen
         self.clock = clock
         self.init()
-        self.player = player
-        self.placePlayer(width/2, height/2)
+        self.world.player = player
+        self.world.placePlayer(width/2, height/2)
+
+    def run(self, size, screen, clock, player = None):
+        self.start(size, screen, clock, player)
         while self.mode != False:
-            if self.timerFired() == False:
+            result = self.timerFired()
+            if result == False:
                 return False
-            elif self.timerFired() == True:
-                return self.player
+            elif result == True:
+                return self.world.player
             elif self.mode == 'Quit':
                 return None
         return False
 
-    def __init__(self, file = 'Levels/level'):
-        self.levelData = data = shelve.open(file)
-        requiredData = ['maxBlocks', 'platforms', 'dropSpace', 'enemies']
-        for item in requiredData:
-            if item not in self.levelData:
-                print "Cannot load level:", file
-                raise SystemExit
-        self.maxBlocks = data['maxBlocks']
-        self.platformsList = data['platforms']
-        self.enemiesList = data['enemies']
+    def __init__(self, file = 'Levels/level', levelData = None):
+        self.file = file
+        if levelData == None:
+            levelData = load_level(file)
+        self.levelData = levelData
+        self.nextLevel = None # LevelHandle to prefetch once this is won
+        self.recorder = None
 
 class TwoPlayerLevel(GameLevel):
 
     # Edited some functions to accomodate a list of players
 
+    worldType = TwoPlayerWorld
+
     # Controls
 
     def mousePressed(self, event):
@@ -471,237 +443,154 @@ class TwoPlayerLevel(GameLevel):
     def retryLevel(self):
         width, height = self.screenSize
         self.mode = None # Unpauses
-        self.player1 = None # Resets so that we can make a new player
-        self.player2 = None
-        self.init()
-        self.placePlayers()
+        self.init() # New world, so new players are made too
+        self.world.placePlayers()
 
     def keyPressed(self, event):
         if event.key == pygame.K_p and self.mode == None:
             if self.mode != "Pause":
                 self.mode = "Pause"
             else: self.mode = None
-        if self.mode == None and self.player1 != None:
+        self.timeControls(event)
+        if self.mode == None and self.world.player1 != None:
             self.playerOneControls(event)
-        if self.mode == None and self.player2 != None:
+        if self.mode == None and self.world.player2 != None:
             self.playerTwoControls(event)
 
     def playerOneControls(self, event):
         if event.key == pygame.K_RIGHT:
-            self.player1.walk(1)
+            self.inputs += [(1, 1)]
         elif event.key == pygame.K_LEFT:
-            self.player1.walk(-1)
+            self.inputs += [(1, -1)]
         elif event.key == pygame.K_UP:
-            self.player1.jump()
+            self.inputs += [(1, 0)]
 
     def playerTwoControls(self, event):
         if event.key == pygame.K_d:
-            self.player2.walk(1)
+            self.inputs += [(2, 1)]
         elif event.key == pygame.K_a:
-            self.player2.walk(-1)
+            self.inputs += [(2, -1)]
         elif event.key == pygame.K_w:
-            self.player2.jump()
-
-    # Game mechanics
-
-    def handleCollisions(self):
-        self.handlePlatformCollisions()
-        self.enemyCollisions()
-        self.newBlock()
-        self.handlePowerUps()
-        self.setPowerUps()
-        self.adjustBlocks()
-        self.clearOldSprites()
-        for player in self.playersList:
-            if player.lives == 0:
-                if player == self.player1:
-                    self.player2.score += 1
-                else: self.player1.score += 1
-                self.resetPlayer()
-                self.mode = "Over"
-
-    def resetPlayer(self):
-        # Simle rest on both players
-        self.player1.reset()
-        self.player2.reset()
-
-    def clearOldSprites(self):
-        # Manages any sprites that go off-screen
-        width, height = self.screenSize
-        for sprite in self.allsprites:
-            if (sprite.rect.top > height):
-                if isinstance(sprite, Player):
-                    sprite.loseLife(True)
-                else:
-                    sprite.kill()
-            elif (sprite.rect.left < 0 or sprite.rect.right > width):
-                if isinstance(sprite, Player):
-                    sprite.rect.left = sprite.rect.left % width
-                else:
-                    sprite.kill()
-
-    def setPowerUps(self):
-        self.powerUpCounter += 1
-        # Get rectangular limits of where powerups can be placed
-        (x1, x2) = self.levelData['powerupsX']
-        (y1, y2) = self.levelData['powerupsY']
-        if len(self.powerUps) == 0 and self.powerUpCounter == self.powerUpInt:
-            x = random.randint(x1, x2)
-            y = random.randint(y1, y2)
-            self.newPowerUp(x, y)
-            self.powerUpCounter = 0
-            # Decide how long to wait before next powerup spawns:
-            wait = random.randint(self.powerTimeMin, self.powerTimeMax)
-            self.powerUpInt = wait
-
-    # Collisions and physics
-
-    def handlePowerUps(self):
-        power = None
-        for powerup in self.powerUps:
-            for player in self.playersList:
-                if pygame.sprite.collide_rect(powerup, player):
-                    player.reset()
-                    player.power = power = powerup.power
-                    updatePlayer = player
-                powerup.kill()
-        if power != None:
-            self.applyPowerUp(updatePlayer, power)
-
-    def applyPowerUp(self, player, power):
-        if power == 'Heavy':
-            player.changeWeight(2) # doubles player weight
-        elif power == "Light":
-            player.changeWeight(0.5) # halves player weight
-        elif power == "Fast":
-            player.speed *= 2
-        elif power == "Slow":
-            player.speed /= 2.0
-
-    def handlePlatformCollisions(self):
-        for platform in self.platforms:
-            totalweight = 0
-            for block in self.fallingBlocks:
-                if self.isOnPlatform(block, platform):
-                    totalweight += self.getBlockWeight(block, platform)
-                    if block.onPlatform == False: # just landed
-                        block.vy = 0
-                        block.jumpStep = 0
-                    block.onPlatform = True
-            platform.adjustPlatformAngle(totalweight)
-        for block in self.fallingBlocks:
-            if self.platformsHit(block) == []:
-                block.onPlatform = False
-
-    def enemyCollisions(self):
-        # Lose lives when hit by raindrops or by each other
-        for player in self.playersList:
-            hitList = pygame.sprite.spritecollide(player,
-                self.fallingBlocks, False)
-            for block in hitList:
-                if not player.block and not isinstance(block, Player):
-                    player.loseLife()
-
-    def newBlock(self):
-        width, height = self.screenSize
-        blockLimit = 3
-        if len(self.fallingBlocks) < blockLimit:
-            if self.blockCounter == self.maxBlocks:
-                self.mode = 'Over'
-            else:
-                x = self.getDropLocation()
-                block = Raindrop(x,0)
-                self.allsprites.add(block)
-                self.fallingBlocks.add(block)
-                self.blockCounter += 1
-                self.currentBlock = block
-
-    def placePlayers(self):
-        (x1, y1) = self.levelData['Player1Pos']
-        (x2, y2) = self.levelData['Player2Pos']
-        self.player1 = self.placePlayer(x1, y1, 1, self.player1)
-        self.player2 = self.placePlayer(x2, y2, 2, self.player2)
-
-    def placePlayer(self, x, y, number, player):
-        if player == None:
-            player = Player(x, y, number)
-        else:
-            player.rect.left = x
-            player.rect.top = y
-            player.fullReset()
-        self.allsprites.add(player)
-        self.fallingBlocks.add(player)
-        self.playersList.add(player)
-        return player
+            self.inputs += [(2, 0)]
 
     # Drawing
 
-    def redrawAll(self):
-        self.screen.blit(self.background, (0,0))
+    def redrawAll(self, alpha = 1):
+        self.drawList = []
         self.drawScore()
-        self.drawHealthBars()
-        for sprite in self.allsprites:
-            self.screen.blit(sprite.image, (sprite.rect.x, sprite.rect.y))
+        self.drawHealthBars(alpha)
+        self.drawSprites(alpha)
+        self.drawMenus()
+        self.present()
+
+    def drawMenus(self):
         if self.mode == 'Pause':
-            self.screen.blit(self.pauseSurface, self.pauseSurfacePos)
-            self.pauseMenuSprites.draw(self.screen)
+            self.draw('menu', self.pauseSurface, self.pauseSurfacePos)
+            self.drawButtons(self.pauseMenuSprites)
         elif self.mode == 'Over':
-            if self.player2.lives == 0:
-                self.screen.blit(self.win1Image, self.winSurfacePos)
-            elif self.player1.lives == 0:
-                self.screen.blit(self.win2Image, self.winSurfacePos)
-            else: self.screen.blit(self.drawImage, self.winSurfacePos)
-            self.winMenuSprites.draw(self.screen)
+            if self.world.player2.lives == 0:
+                self.draw('menu', self.win1Image, self.winSurfacePos)
+            elif self.world.player1.lives == 0:
+                self.draw('menu', self.win2Image, self.winSurfacePos)
+            else: self.draw('menu', self.drawImage, self.winSurfacePos)
+            self.drawButtons(self.winMenuSprites)
         elif self.mode == 'Lost':
-            self.screen.blit(self.lossSurface, self.lossSurfacePos)
-            self.lossMenuSprites.draw(self.screen)
-        pygame.display.flip()
+            self.draw('menu', self.lossSurface, self.lossSurfacePos)
+            self.drawButtons(self.lossMenuSprites)
 
-    def drawHealthBars(self):
-        for player in self.playersList:
+    def drawHealthBars(self, alpha = 1):
+        for player in self.world.playersList:
             # Get position to blit health bar
             margin = 3
-            (x, y) = player.rect.topleft
+            (x, y) = self.world.interpolate(player, alpha)
             (x, y) = (x - margin, y - margin)
-            self.screen.blit(player.healthBar, (x, y))
+            self.draw(('health', player), player.healthBar, (x, y))
 
     def drawScore(self):
         scoreColor = (46,139,87)
-        score = "Score: %d - %d" % (self.player2.score, self.player1.score)
-        lives = "Lives: %d - %d" % (self.player2.lives, self.player1.lives)
-        blocks = self.maxBlocks - self.blockCounter
-        blockText = "Drops remaining: %d/%d" % (blocks, self.maxBlocks)
-        scoreDraw = self.consola_font.render(score, True, scoreColor)
-        livesDraw = self.consola_font.render(lives, True, scoreColor)
-        blocksDraw = self.consola_font.render(blockText, True, scoreColor)
-        self.screen.blit(scoreDraw, self.scorePos)
-        self.screen.blit(livesDraw, self.livesPos)
-        self.screen.blit(blocksDraw, self.blocksPos)
+        world = self.world
+        p1, p2 = world.player1, world.player2
+        score = "Score: %d - %d" % (p2.score, p1.score)
+        lives = "Lives: %d - %d" % (p2.lives, p1.lives)
+        blocks = world.maxBlocks - world.blockCounter
+        blockText = "Drops remaining: %d/%d" % (blocks, world.maxBlocks)
+        scoreDraw = renderText(score, scoreColor)
+        livesDraw = renderText(lives, scoreColor)
+        blocksDraw = renderText(blockText, scoreColor)
+        self.draw('score', scoreDraw, self.scorePos)
+        self.draw('lives', livesDraw, self.livesPos)
+        self.draw('blocks', blocksDraw, self.blocksPos)
 
     # Set up stuff
 
-    def init(self):
-        self.playersList = pygame.sprite.Group()
-        super(TwoPlayerLevel, self).init()
-
     def initScoreboard(self):
         self.scorePos = (50, 50)
         self.livesPos = (300, 50)
         self.blocksPos = (400, 50)
 
-    def run(self, size, screen, clock, p1 = None, p2 = None):
-        self.screenSize = width, height = size
+    def start(self, size, screen, clock, p1 = None, p2 = None):
+        self.screenSize = size
         self.screen = screen
         self.clock = clock
         self.init()
-        self.player1 = p1
-        self.player2 = p2
-        self.placePlayers()
+        self.world.player1 = p1
+        self.world.player2 = p2
+        self.world.placePlayers()
+
+    def run(self, size, screen, clock, p1 = None, p2 = None):
+        self.start(size, screen, clock, p1, p2)
         while self.mode != False:
-            if self.timerFired() == False:
+            result = self.timerFired()
+            if result == False:
                 return False
-            elif self.timerFired() == True:
-                return self.player1, self.player2
+            elif result == True:
+                return self.world.player1, self.world.player2
             elif self.mode == 'Quit':
                 return None
-        return False
\ No newline at end of file
+        return False
+
+class LevelHandle(object):
+
+    # Stands in for a level until it is played. Nothing is loaded until
+    # open(); prefetch() loads the level file and decodes the level's images
+    # on a background thread beforehand, so open() doesn't have to wait.
+    # close() lets go of all of it, whether or not the level was played.
+
+    def __init__(self, levelType, file):
+        self.levelType = levelType
+        self.file = file
+        self.level = None
+        self.levelData = None # loaded by prefetch(), for open()
+        self.loader = None
+
+    def prefetch(self):
+        if self.loader == None and self.level == None:
+            self.loader = threading.Thread(target = self.load)
+            self.loader.daemon = True
+            self.loader.start()
+
+    def load(self):
+        levelData = load_level(self.file)
+        images = [levelBackground(levelData)] + self.levelType.prefetchImages
+        assets.prefetch(self.file, spriteAssets + images)
+        self.levelData = levelData
+
+    def wait(self):
+        if self.loader != None:
+            self.loader.join()
+            self.loader = None
+
+    def open(self):
+        self.wait()
+        if self.level == None:
+            self.level = self.levelType(self.file, self.levelData)
+            self.levelData = None
+        return self.level
+
+    def close(self):
+        self.wait()
+        if self.level != None:
+            self.level.close()
+            self.level = None
+        self.levelData = None
+        assets.evict(self.file)
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+
+# Compiled level files.
+# The level shelves in Levels/ are compiled to plain JSON files next to
+# them (Levels/level1 -> Levels/level1.json). A compiled level is checked
+# against levelSchema, read in one go and never written to, so any number
+# of processes can load the same level at once, with no dbm backend or
+# pickles involved. Every list in a loaded level is a tuple, so one parsed
+# copy is shared by every level made from the same file.
+#
+#   python LevelFormat.py compile [shelve files]   (default: all of Levels/)
+#   python LevelFormat.py benchmark [level files] [repeats]
+
+formatVersion = 1
+compiledExtension = '.json'
+
+# Kinds of value:
+#   count  - a whole number >= 0
+#   point  - (x, y)
+#   points - list of (x, y)
+#   range  - (low, high)
+#   ranges - list of (low, high)
+#   path   - an image file, relative to the game directory
+#   args   - list of whole numbers
+levelSchema = {
+    'maxBlocks': 'count',
+    'platforms': 'points',
+    'dropSpace': 'ranges',
+    'enemies': 'points',
+    'lockingPlatforms': 'points',
+    'movingEnemies': 'points',
+    'powerupsX': 'range',
+    'powerupsY': 'range',
+    'Player1Pos': 'point',
+    'Player2Pos': 'point',
+    'background': 'path',
+    'storm': 'args',
+}
+requiredKeys = ['maxBlocks', 'platforms', 'dropSpace', 'enemies']
+
+compiledLevels = {} # path -> (modified time, level)
+
+def compiledPath(path):
+    return path + compiledExtension
+
+# Validation
+
+def isNumber(value):
+    return (isinstance(value, (int, long, float)) and
+        not isinstance(value, bool))
+
+def isPair(value):
+    return (isinstance(value, (list, tuple)) and len(value) == 2 and
+        isNumber(value[0]) and isNumber(value[1]))
+
+def isRange(value):
+    return isPair(value) and value[0] <= value[1]
+
+def checkValue(kind, value):
+    if kind == 'count':
+        return isinstance(value, (int, long)) and value >= 0
+    elif kind == 'point':
+        return isPair(value)
+    elif kind == 'points':
+        return (isinstance(value, (list, tuple)) and
+            len(filter(isPair, value)) == len(value))
+    elif kind == 'range':
+        return isRange(value)
+    elif kind == 'ranges':
+        return (isinstance(value, (list, tuple)) and len(value) > 0 and
+            len(filter(isRange, value)) == len(value))
+    elif kind == 'path':
+        return isinstance(value, basestring) and value != ''
+    elif kind == 'args':
+        return (isinstance(value, (list, tuple)) and
+            len([v for v in value if isinstance(v, (int, long))]) ==
+            len(value))
+    return False
+
+def validateLevel(level):
+    # Returns a list of everything wrong with a level (empty if nothing)
+    problems = []
+    for key in requiredKeys:
+        if key not in level:
+            problems += ['missing %s' % key]
+    for key, value in level.items():
+        if key not in levelSchema:
+            problems += ['unknown key %s' % key]
+        elif not checkValue(levelSchema[key], value):
+            problems += ['bad %s: %r' % (key, value)]
+    if 'Player1Pos' in level and 'Player2Pos' not in level:
+        problems += ['missing Player2Pos']
+    if 'Player2Pos' in level and 'Player1Pos' not in level:
+        problems += ['missing Player1Pos']
+    return problems
+
+def freeze(value):
+    # Lists become tuples, all the way down, so a level can't be changed
+    if isinstance(value, (list, tuple)):
+        return tuple([freeze(item) for item in value])
+    elif isinstance(value, unicode):
+        return str(value)
+    return value
+
+def checkLevel(level, path):
+    problems = validateLevel(level)
+    if problems != []:
+        print "Cannot load level:", path
+        for problem in problems:
+            print "   ", problem
+        raise SystemExit
+    frozen = {}
+    for key, value in level.items():
+        frozen[str(key)] = freeze(value)
+    return frozen
+
+# Loading
+
+def loadCompiledLevel(path):
+    # Parsed once per file (until the file changes), then shared
+    modified = os.path.getmtime(path)
+    if path in compiledLevels and compiledLevels[path][0] == modified:
+        return dict(compiledLevels[path][1])
+    try:
+        levelFile = open(path, 'rb')
+        try:
+            text = levelFile.read()
+        finally:
+            levelFile.close()
+        compiled = json.loads(text)
+    except (IOError, ValueError), message:
+        print "Cannot load level:", path
+        raise SystemExit, message
+    if (not isinstance(compiled, dict) or
+        compiled.get('format') != formatVersion or
+        not isinstance(compiled.get('level'), dict)):
+        print "Cannot load level:", path, "(not a compiled level)"
+        raise SystemExit
+    level = checkLevel(compiled['level'], path)
+    compiledLevels[path] = (modified, level)
+    return dict(level)
+
+def loadShelvedLevel(path):
+    import shelve
+    shelf = shelve.open(path, 'r')
+    try:
+        level = dict(shelf)
+    finally:
+        shelf.close()
+    return checkLevel(level, path)
+
+# Compiling
+
+def writeLevel(level, path):
+    level = checkLevel(level, path)
+    # One key per line, so compiled levels diff nicely
+    lines = ['    %s: %s' % (json.dumps(key), json.dumps(level[key]))
+        for key in sorted(level)]
+    text = '{"format": %d, "level": {\n%s\n}}\n' % (formatVersion,
+        ',\n'.join(lines))
+    levelFile = open(path, 'wb')
+    try:
+        levelFile.write(text)
+    finally:
+        levelFile.close()
+
+def compileLevel(path):
+    writeLevel(loadShelvedLevel(path), compiledPath(path))
+    return compiledPath(path)
+
+def shelvedLevels(folder = 'Levels'):
+    paths = []
+    for name in sorted(os.listdir(folder)):
+        if '.' not in name:
+            paths += [os.path.join(folder, name)]
+    return paths
+
+# Benchmark
+
+def timeLoads(load, path, repeats):
+    start = time.time()
+    for i in xrange(repeats):
+        load(path)
+    return (time.time() - start)/repeats*1000
+
+def benchmark(paths, repeats = 1000):
+    for path in paths:
+        if path.endswith(compiledExtension):
+            path = path[:-len(compiledExtension)]
+        compiledLevels.clear()
+        line = '%-20s' % path
+        def parse(path):
+            compiledLevels.clear()
+            return loadCompiledLevel(path)
+        line += '  parse %.3f ms' % timeLoads(parse, compiledPath(path),
+            repeats)
+        line += '  cached %.4f ms' % timeLoads(loadCompiledLevel,
+            compiledPath(path), repeats)
+        try:
+            shelveTime = timeLoads(loadShelvedLevel, path, repeats)
+            line += '  shelve %.3f ms' % shelveTime
+        except Exception, message:
+            line += '  shelve unavailable (%s)' % message
+        print line
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        for path in sys.argv[2:] or shelvedLevels():
+            print 'Compiled', compileLevel(path)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        paths = [arg for arg in sys.argv[2:] if not arg.isdigit()]
+        repeats = [int(arg) for arg in sys.argv[2:] if arg.isdigit()]
+        benchmark(paths or shelvedLevels(), (repeats or [1000])[0])
+    else:
+        print 'usage: python LevelFormat.py compile|benchmark [levels]'
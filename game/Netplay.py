@@ -0,0 +1,483 @@
+import os
+import sys
+import time
+import json
+import heapq
+import errno
+import random
+import socket
+import struct
+import argparse
+import subprocess
+import pygame
+from GlobalFunctions import *
+from World import *
+from Level import *
+from Snapshot import SnapshotCodec
+from Recording import worldDigest
+
+# Two player games over the network, with rollback.
+# Each machine runs the whole world, steps it every frame with its own
+# player's inputs and a guess at the other player's, and sends its inputs
+# to the other machine over UDP. When the other player's real inputs for a
+# frame turn up and differ from the guess, the world is put back to how it
+# was before that frame (from a SnapshotCodec snapshot, saved every step)
+# and stepped forward again with the right inputs.
+#
+# Commands are one-off impulses (a jump, a step to one side), so the guess
+# for a frame is always "no input": most frames have none. Local inputs
+# are also played inputDelay frames late, so they usually reach the other
+# machine before it gets to that frame. A machine never gets more than
+# maxRollback frames ahead of the last frame it has the other player's
+# inputs for; past that it waits.
+#
+#   python Netplay.py play --player 1 --port 5001 --peer otherhost:5002
+#   python Netplay.py test [--frames N] [--latency ms] [--jitter ms]
+#       [--loss fraction]
+#
+# test runs two headless peers on loopback with scripted inputs and checks
+# that both end up with the same world as a plain local run.
+
+magic = 'FFNP'
+HELLO, INPUTS = 0, 1
+packetHeader = struct.Struct('<4sBII') # magic, kind, ack, first frame
+
+class LossyLink(object):
+
+    # A UDP socket to one peer. Outgoing packets can be held back by a
+    # made-up latency (plus or minus jitter), or dropped, to try rollback
+    # out on loopback.
+
+    def __init__(self, port, peer, latency = 0, jitter = 0, loss = 0,
+        seed = None):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', port))
+        self.socket.setblocking(False)
+        self.peer = peer
+        self.latency = latency/1000.0
+        self.jitter = jitter/1000.0
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.queue = [] # (send time, order, packet)
+        self.sent = self.dropped = self.received = 0
+
+    def send(self, packet):
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        heapq.heappush(self.queue, (time.time() + max(0, delay), self.sent,
+            packet))
+        self.sent += 1
+        self.flush()
+
+    def flush(self):
+        now = time.time()
+        while self.queue != [] and self.queue[0][0] <= now:
+            packet = heapq.heappop(self.queue)[2]
+            try:
+                self.socket.sendto(packet, self.peer)
+            except socket.error:
+                pass # nobody listening yet; the packet counts as lost
+
+    def receive(self):
+        self.flush()
+        packets = []
+        while True:
+            try:
+                packet, address = self.socket.recvfrom(4096)
+            except socket.error, error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return packets
+                continue # e.g. ICMP port unreachable, on some systems
+            if packet[:len(magic)] == magic:
+                packets += [packet]
+                self.received += 1
+
+    def close(self):
+        self.socket.close()
+
+def handshake(link, player, seed, levelFile, timeout = 30):
+    # Hellos go back and forth until each side knows the other is there.
+    # Player 1's seed is the one both worlds use.
+    hello = None
+    started = False # the peer has heard us, and is already sending inputs
+    deadline = time.time() + timeout
+    while hello == None or not (hello['heard'] or started):
+        if time.time() > deadline:
+            print 'No answer from', '%s:%d' % link.peer
+            raise SystemExit
+        for packet in link.receive():
+            kind = packetHeader.unpack_from(packet)[1]
+            if kind == HELLO:
+                hello = json.loads(packet[packetHeader.size:])
+            elif kind == INPUTS:
+                started = True
+        message = json.dumps({'player': player, 'seed': seed,
+            'level': levelFile, 'heard': hello != None})
+        link.send(packetHeader.pack(magic, HELLO, 0, 0) + message)
+        time.sleep(0.02)
+    if hello['player'] == player or hello['level'] != levelFile:
+        print 'Cannot play: the other side is player %d on %s' % (
+            hello['player'], hello['level'])
+        raise SystemExit
+    if player == 1:
+        return seed
+    return hello['seed']
+
+class RollbackSession(object):
+
+    inputDelay = 2
+    maxRollback = 8
+    sendWindow = 32 # most frames of inputs in one packet
+
+    def __init__(self, world, player, link):
+        self.world = world
+        self.player = player
+        self.otherPlayer = 3 - player
+        self.link = link
+        self.codec = SnapshotCodec(world)
+        self.snapshots = {} # frame -> snapshot from just before it
+        self.local = {} # frame -> our commands
+        self.remote = {} # frame -> their commands
+        self.predicted = {} # frame -> what we guessed they did
+        self.pending = [] # our commands for the next new frame
+        self.lastLocal = self.inputDelay - 1 # last frame we have commands for
+        for frame in xrange(self.inputDelay):
+            self.local[frame] = ()
+        self.confirmed = 0 # every remote command before this frame is known
+        self.peerAck = 0 # the peer has every local command before this frame
+        self.rollbackFrom = None
+        self.rollbacks = self.resimulated = self.deepest = self.stalls = 0
+        self.saveTime = self.restoreTime = 0.0
+        self.saves = self.restores = self.snapshotBytes = 0
+
+    # Stepping
+
+    def advance(self, commands = ()):
+        # Steps the world one frame, unless we are too far ahead of the
+        # peer (or the game is over); commands are our player's for now
+        self.pending += commands
+        self.update()
+        frame = self.world.frame
+        if self.world.mode != None or frame - self.confirmed >= \
+            self.maxRollback:
+            if self.world.mode == None:
+                self.stalls += 1
+            self.send()
+            return False
+        self.lastLocal = frame + self.inputDelay
+        self.local[self.lastLocal] = tuple(self.pending)
+        self.pending = []
+        self.simulate(frame)
+        self.send()
+        return True
+
+    def idle(self):
+        # Keeps inputs and acks going without stepping
+        self.update()
+        self.send()
+
+    def update(self):
+        # Reads the network, and rolls back if we guessed wrong
+        self.receive()
+        if self.rollbackFrom != None:
+            self.rollback(self.rollbackFrom)
+            self.rollbackFrom = None
+        self.forget()
+
+    def settled(self):
+        # Whether the world as it is now can't change any more
+        return self.confirmed >= self.world.frame
+
+    def inputsFor(self, frame):
+        if frame in self.remote:
+            remote = self.remote[frame]
+        else:
+            remote = self.predicted[frame] = ()
+        inputs = {self.player: self.local.get(frame, ()),
+            self.otherPlayer: remote}
+        return [(player, command) for player in [1, 2]
+            for command in inputs[player]]
+
+    def simulate(self, frame):
+        start = time.time()
+        snapshot = self.snapshots[frame] = self.codec.save()
+        self.saveTime += time.time() - start
+        self.saves += 1
+        self.snapshotBytes += len(snapshot)
+        self.world.step(self.inputsFor(frame))
+
+    def rollback(self, frame):
+        end = self.world.frame
+        start = time.time()
+        self.codec.restore(self.snapshots[frame])
+        self.restoreTime += time.time() - start
+        self.restores += 1
+        self.rollbacks += 1
+        self.deepest = max(self.deepest, end - frame)
+        while self.world.frame < end and self.world.mode == None:
+            self.simulate(self.world.frame)
+            self.resimulated += 1
+
+    def forget(self):
+        # Frames played with confirmed inputs can't be rolled back to again
+        done = min(self.confirmed, self.world.frame)
+        for table in [self.snapshots, self.predicted, self.remote]:
+            for frame in [frame for frame in table if frame < done]:
+                del table[frame]
+        for frame in [frame for frame in self.local
+            if frame < min(done, self.peerAck)]:
+            del self.local[frame]
+        self.codec.prune(self.snapshots.values())
+
+    # Network
+
+    def send(self):
+        first = self.peerAck
+        last = min(self.lastLocal, first + self.sendWindow - 1)
+        body = []
+        for frame in xrange(first, last + 1):
+            commands = self.local[frame]
+            body += [struct.pack('<B%db' % len(commands), len(commands),
+                *commands)]
+        header = packetHeader.pack(magic, INPUTS, self.confirmed, first)
+        self.link.send(header + ''.join(body))
+
+    def receive(self):
+        for packet in self.link.receive():
+            kind, ack, frame = packetHeader.unpack_from(packet)[1:]
+            if kind != INPUTS:
+                continue
+            self.peerAck = max(self.peerAck, ack)
+            at = packetHeader.size
+            while at < len(packet):
+                count = ord(packet[at])
+                commands = struct.unpack_from('<%db' % count, packet, at + 1)
+                at += 1 + count
+                self.addRemote(frame, commands)
+                frame += 1
+        while self.confirmed in self.remote:
+            self.confirmed += 1
+
+    def addRemote(self, frame, commands):
+        if frame < self.confirmed or frame in self.remote:
+            return
+        self.remote[frame] = commands
+        if frame in self.predicted and self.predicted[frame] != commands:
+            if self.rollbackFrom == None or frame < self.rollbackFrom:
+                self.rollbackFrom = frame
+
+    def stats(self):
+        return {'frame': self.world.frame, 'mode': self.world.mode,
+            'rollbacks': self.rollbacks, 'resimulated': self.resimulated,
+            'deepestRollback': self.deepest, 'stalls': self.stalls,
+            'snapshotBytes': self.snapshotBytes/max(1, self.saves),
+            'saveMicroseconds': self.saveTime/max(1, self.saves)*1e6,
+            'restoreMicroseconds': self.restoreTime/max(1, self.restores)*1e6,
+            'sent': self.link.sent, 'dropped': self.link.dropped,
+            'received': self.link.received}
+
+class NetworkLevel(TwoPlayerLevel):
+
+    # A two player level against someone on another machine. Either set
+    # of controls moves this machine's player.
+
+    stepRate = 20
+
+    def __init__(self, file, link, player):
+        super(NetworkLevel, self).__init__(file)
+        self.link = link
+        self.player = player
+        self.session = None
+
+    def start(self, size, screen, clock, p1 = None, p2 = None):
+        super(NetworkLevel, self).start(size, screen, clock, p1, p2)
+        self.session = RollbackSession(self.world, self.player, self.link)
+
+    def keyPressed(self, event):
+        # No pausing: the other side's game would stall
+        self.timeControls(event)
+        commands = {pygame.K_RIGHT: 1, pygame.K_LEFT: -1, pygame.K_UP: 0,
+            pygame.K_d: 1, pygame.K_a: -1, pygame.K_w: 0}
+        if self.mode == None and event.key in commands:
+            self.inputs += [(self.player, commands[event.key])]
+
+    def retryLevel(self):
+        # A rematch needs both sides to start a new world together
+        self.mode = 'Quit'
+
+    def stepWorld(self, time):
+        self.accumulator += time
+        stepTime = 1.0/self.world.stepRate
+        if self.accumulator < stepTime:
+            self.session.idle()
+        while self.accumulator >= stepTime and self.mode == None:
+            self.session.advance([command
+                for player, command in self.inputs])
+            self.inputs = []
+            self.accumulator -= stepTime
+        if self.world.mode != None and self.session.settled():
+            self.mode = self.world.mode
+
+# Testing
+
+def scriptedCommands(player, frames, seed):
+    # A command on about one frame in eight
+    generator = random.Random(seed*10 + player)
+    commands = []
+    for frame in xrange(frames):
+        if generator.random() < 0.125:
+            commands += [(generator.choice([0, 1, -1]),)]
+        else:
+            commands += [()]
+    return commands
+
+def makeWorld(levelFile, seed):
+    world = TwoPlayerWorld(load_level(levelFile), (600, 600),
+        NetworkLevel.stepRate, seed)
+    world.placePlayers()
+    return world
+
+def runPeer(args):
+    # One headless side of a test game, stepped rate times a second
+    initHeadless()
+    link = LossyLink(args.port, ('127.0.0.1', args.peerPort), args.latency,
+        args.jitter, args.loss, args.seed*10 + args.player)
+    seed = handshake(link, args.player, args.seed, args.level)
+    world = makeWorld(args.level, seed)
+    session = RollbackSession(world, args.player, link)
+    script = scriptedCommands(args.player, args.frames, args.seed)
+    stepTime = 1.0/args.rate
+    nextStep = time.time()
+    deadline = time.time() + args.frames*stepTime*4 + 30
+    # Play all the frames, then keep going until both sides have
+    # everything
+    given = -1 # last frame we gave the session our commands for
+    while not (world.frame >= args.frames or world.mode != None) or \
+        not session.settled() or session.peerAck < world.frame:
+        if time.time() > deadline:
+            print 'Timed out at frame', world.frame
+            raise SystemExit
+        if world.frame < args.frames:
+            commands = ()
+            if world.frame > given:
+                commands, given = script[world.frame], world.frame
+            session.advance(commands)
+        else:
+            session.idle()
+        nextStep += stepTime
+        time.sleep(max(0, nextStep - time.time()))
+    stats = session.stats()
+    stats['digest'] = worldDigest(world)
+    # Let the last packets out before the socket goes
+    end = time.time() + args.latency/1000.0 + args.jitter/1000.0 + 0.5
+    while time.time() < end:
+        session.idle()
+        time.sleep(stepTime)
+    link.close()
+    print json.dumps(stats)
+
+def localRun(levelFile, frames, seed):
+    # The same game as a test, with no network: what both peers should get
+    initHeadless()
+    world = makeWorld(levelFile, seed)
+    delay = RollbackSession.inputDelay
+    scripts = dict([(player, scriptedCommands(player, frames, seed))
+        for player in [1, 2]])
+    while world.frame < frames and world.mode == None:
+        inputs = []
+        if world.frame >= delay:
+            for player in [1, 2]:
+                for command in scripts[player][world.frame - delay]:
+                    inputs += [(player, command)]
+        world.step(inputs)
+    return worldDigest(world), world.frame
+
+def freePort():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+def runTest(args):
+    ports = [freePort(), freePort()]
+    processes = []
+    for player in [1, 2]:
+        command = [sys.executable, os.path.abspath(__file__), 'peer',
+            '--player', str(player), '--port', str(ports[player - 1]),
+            '--peer-port', str(ports[2 - player]), '--level', args.level,
+            '--frames', str(args.frames), '--seed', str(args.seed),
+            '--rate', str(args.rate), '--latency', str(args.latency),
+            '--jitter', str(args.jitter), '--loss', str(args.loss)]
+        processes += [subprocess.Popen(command, stdout = subprocess.PIPE)]
+    results = []
+    for process in processes:
+        output = process.communicate()[0].strip().splitlines()
+        if process.returncode != 0 or output == []:
+            print 'Peer failed:', '\n'.join(output)
+            raise SystemExit(1)
+        results += [json.loads(output[-1])]
+    digest, frames = localRun(args.level, args.frames, args.seed)
+    for player, result in zip([1, 2], results):
+        print ('player %d: frame %d, %d rollbacks (%d frames resimulated, '
+            'deepest %d), %d stalls, %d of %d packets dropped' % (player,
+            result['frame'], result['rollbacks'], result['resimulated'],
+            result['deepestRollback'], result['stalls'], result['dropped'],
+            result['sent'] + result['dropped']))
+        print ('          snapshots %d bytes, save %.0f us, restore %.0f us'
+            % (result['snapshotBytes'], result['saveMicroseconds'],
+            result['restoreMicroseconds']))
+    same = [result['digest'] for result in results] == [digest, digest]
+    print 'local run: frame %d;' % frames,
+    print same and 'both peers match it' or 'MISMATCH'
+    if not same:
+        raise SystemExit(1)
+
+def playOnline(args):
+    host, port = args.peer.rsplit(':', 1)
+    link = LossyLink(args.port, (socket.gethostbyname(host), int(port)),
+        args.latency, args.jitter, args.loss)
+    print 'Waiting for the other player...'
+    seed = handshake(link, args.player, args.seed, args.level, 300)
+    pygame.init()
+    size = (600, 600)
+    screen = pygame.display.set_mode(size)
+    pygame.display.set_caption("Fire Flyer (player %d)" % args.player)
+    level = NetworkLevel(args.level, link, args.player)
+    level.seed = seed
+    level.start(size, screen, pygame.time.Clock())
+    while level.mode not in [False, 'Quit']:
+        if level.timerFired() == False:
+            break
+    link.close()
+    pygame.quit()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices = ['play', 'peer', 'test'])
+    parser.add_argument('--player', type = int, default = 1,
+        choices = [1, 2])
+    parser.add_argument('--port', type = int, default = 5001)
+    parser.add_argument('--peer', default = '127.0.0.1:5002',
+        help = 'host:port of the other player')
+    parser.add_argument('--peer-port', dest = 'peerPort', type = int)
+    parser.add_argument('--level', default = 'Levels/level2p1')
+    parser.add_argument('--seed', type = int,
+        default = random.randrange(1 << 32))
+    parser.add_argument('--frames', type = int, default = 600)
+    parser.add_argument('--rate', type = float, default = 60,
+        help = 'test steps per second')
+    parser.add_argument('--latency', type = float, default = 0,
+        help = 'extra one way latency to add, in ms')
+    parser.add_argument('--jitter', type = float, default = 0, help = 'ms')
+    parser.add_argument('--loss', type = float, default = 0,
+        help = 'fraction of packets to drop')
+    args = parser.parse_args()
+    if args.mode == 'peer':
+        runPeer(args)
+    elif args.mode == 'test':
+        runTest(args)
+    else:
+        playOnline(args)
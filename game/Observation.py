@@ -0,0 +1,240 @@
+import ctypes
+from Classes import PowerUp, LockingPlatform, MainPlatform, MovingFireball
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Whole-world observations, for agents that want more than Env's 18 numbers.
+# A WorldEncoder writes a world's state into one preallocated float32 buffer
+# with a fixed layout, once per step, without allocating any arrays: the
+# buffer is made (or handed in) once, and each step overwrites it in place.
+# The layout is a list of sections, each a fixed number of rows of fields:
+#
+#   world      1 row   frame, mode, blockCounter, maxBlocks, powerUpCounter,
+#                      powerUpInt, overflow
+#   players    2 rows  present, x, y, w, h, vx, vy, angle, lives, block,
+#                      jumpStep, power, powerTimer, score, weight
+#   drops     32 rows  present, x, y, vx, vy, angle, dropType, onPlatform
+#   platforms 16 rows  present, cx, cy, angle, targetAngle, maxAngle,
+#                      locking, main
+#   fireballs 16 rows  present, x, y, lives, moving
+#   powerUps   4 rows  present, x, y, power, time, maxTime
+#
+# Sections follow each other in that order, rows one after another, so
+# section s starts at layout[s][0] and row r, field f of it is at
+#   start + r*len(fields) + fields.index(f)
+# Positions are rect centers (x, y), in pixels. Rows past the last object
+# are all zeros, so 'present' tells used rows from empty ones. Players are
+# player 1 then player 2 (a row of zeros in one player levels); drops are
+# falling raindrops and firedrops in the order they were dropped, then storm
+# drops. overflow counts objects that did not fit in their section.
+#
+# Codes: mode 0 = playing, 1 = Over, 2 = Won, 3 = Lost; power 0 = none,
+# then 1 + PowerUp.powerUps.index(power) (Heavy, Light, Fast); dropType
+# 1 = raindrop, 2 = firedrop; flags are 0 or 1.
+#
+#   encoder = WorldEncoder()            # or WorldEncoder(out = row)
+#   encoder.encode(world)               # -> encoder.buffer
+#   encoder.views['drops']              # (32, 8) view of the drop rows
+#   encoder.column('drops', 'x')        # (32,) view of one field
+#
+# Views and columns are numpy views of the buffer, not copies, so they are
+# made once and always show the latest encode(). out can be any writable
+# float32 buffer the right size - a row of a shared array, say, so the
+# encoder writes straight into memory another process reads.
+
+sections = [
+    ('world', 1, ['frame', 'mode', 'blockCounter', 'maxBlocks',
+        'powerUpCounter', 'powerUpInt', 'overflow']),
+    ('players', 2, ['present', 'x', 'y', 'w', 'h', 'vx', 'vy', 'angle',
+        'lives', 'block', 'jumpStep', 'power', 'powerTimer', 'score',
+        'weight']),
+    ('drops', 32, ['present', 'x', 'y', 'vx', 'vy', 'angle', 'dropType',
+        'onPlatform']),
+    ('platforms', 16, ['present', 'cx', 'cy', 'angle', 'targetAngle',
+        'maxAngle', 'locking', 'main']),
+    ('fireballs', 16, ['present', 'x', 'y', 'lives', 'moving']),
+    ('powerUps', 4, ['present', 'x', 'y', 'power', 'time', 'maxTime'])]
+
+modeCodes = {None: 0, 'Over': 1, 'Won': 2, 'Lost': 3}
+powerCodes = dict([(None, 0)] + [(power, i + 1)
+    for i, power in enumerate(PowerUp.powerUps)])
+
+def getLayout(rows = None):
+    # -> ({section: (start, rows, fields)}, total size), with the default
+    # row counts unless rows gives others
+    rows = rows or {}
+    layout = {}
+    start = 0
+    for name, count, fields in sections:
+        count = rows.get(name, count)
+        layout[name] = (start, count, fields)
+        start += count*len(fields)
+    return layout, start
+
+observationSize = getLayout()[1]
+
+class WorldEncoder(object):
+
+    def __init__(self, rows = None, out = None):
+        if numpy == None:
+            print 'WorldEncoder needs numpy'
+            raise SystemExit
+        self.layout, self.size = getLayout(rows)
+        if out is None: # (an array; == would compare elementwise)
+            out = numpy.zeros(self.size, numpy.float32)
+        if out.dtype != numpy.float32 or out.size != self.size:
+            print 'WorldEncoder needs a float32 buffer of %d values' % \
+                self.size
+            raise SystemExit
+        out[:] = 0
+        self.buffer = out
+        # Single values go in through ctypes, which is several times
+        # quicker than numpy item assignment
+        self.raw = (ctypes.c_float*self.size).from_buffer(out)
+        self.views = {}
+        for name, (start, count, fields) in self.layout.items():
+            self.views[name] = out[start:start + count*len(fields)].reshape(
+                count, len(fields))
+        self.used = dict([(name, 0) for name in self.layout])
+
+    def column(self, section, field):
+        start, count, fields = self.layout[section]
+        return self.views[section][:, fields.index(field)]
+
+    def clear(self, section, used):
+        # Zeros the rows used last time but not this time
+        start, count, fields = self.layout[section]
+        width = len(fields)
+        if used < self.used[section]:
+            ctypes.memset(ctypes.addressof(self.raw) + 4*(start +
+                used*width), 0, 4*width*(self.used[section] - used))
+        self.used[section] = used
+
+    def encode(self, world):
+        self.overflow = 0
+        self.encodePlayers(world)
+        self.encodeDrops(world)
+        self.encodePlatforms(world)
+        self.encodeFireballs(world)
+        self.encodePowerUps(world)
+        start = self.layout['world'][0]
+        self.raw[start:start + 7] = (world.frame, modeCodes[world.mode],
+            world.blockCounter, world.maxBlocks, world.powerUpCounter,
+            world.powerUpInt, self.overflow)
+        return self.buffer
+
+    def fit(self, section, count):
+        # How many of count objects fit in a section
+        rows = self.layout[section][1]
+        if count > rows:
+            self.overflow += count - rows
+            return rows
+        return count
+
+    def encodePlayers(self, world):
+        raw = self.raw
+        start, rows, fields = self.layout['players']
+        at = start
+        for number in xrange(1, rows + 1):
+            player = world.getPlayer(number)
+            if player == None:
+                raw[at:at + 15] = (0,)*15
+            else:
+                rect = player.rect
+                raw[at:at + 15] = (1, rect.centerx, rect.centery, rect.width,
+                    rect.height, player.vx, player.vy, player.angle,
+                    player.lives, player.block, player.jumpStep,
+                    powerCodes[player.power], player.powerTimer,
+                    player.score, player.weight)
+            at += 15
+
+    def encodeDrops(self, world):
+        raw = self.raw
+        start, rows, fields = self.layout['drops']
+        used = 0
+        at = start
+        for block in world.fallingBlocks:
+            dropType = getattr(block, 'dropType', 0)
+            if dropType == 0: # players fall too
+                continue
+            if used == rows:
+                self.overflow += 1
+                continue
+            rect = block.rect
+            raw[at:at + 8] = (1, rect.centerx, rect.centery, block.vx,
+                block.vy, block.angle, dropType, block.onPlatform)
+            used += 1
+            at += 8
+        storm = world.storm
+        if storm != None and storm.count > 0:
+            count = self.fit('drops', used + storm.count) - used
+            if count > 0:
+                self.encodeStorm(storm, used, count)
+                used += count
+        self.clear('drops', used)
+
+    def encodeStorm(self, storm, first, count):
+        # Whole columns at a time, straight from the drop system's arrays
+        view = self.views['drops'][first:first + count]
+        view[:, 0] = 1
+        for column, name in [(3, 'vx'), (4, 'vy'), (5, 'angle'),
+            (6, 'dropType'), (7, 'onPlatform')]:
+            view[:, column] = storm.fields[name][:count]
+        # Storm drops are anchored at the top left, so x + w/2, y + h/2
+        for column, corner, size in [(1, storm.x, storm.w),
+            (2, storm.y, storm.h)]:
+            numpy.multiply(size[:count], 0.5, out = view[:, column])
+            numpy.add(view[:, column], corner[:count], out = view[:, column])
+
+    def encodePlatforms(self, world):
+        raw = self.raw
+        start, rows, fields = self.layout['platforms']
+        count = self.fit('platforms', len(world.platforms))
+        at = start
+        for platform in world.platforms.sprites()[:count]:
+            raw[at:at + 8] = (1, platform.cx, platform.cy, platform.angle,
+                platform.targetAngle, platform.maxAngle,
+                isinstance(platform, LockingPlatform),
+                isinstance(platform, MainPlatform))
+            at += 8
+        self.clear('platforms', count)
+
+    def encodeFireballs(self, world):
+        raw = self.raw
+        start, rows, fields = self.layout['fireballs']
+        count = self.fit('fireballs', len(world.enemies))
+        at = start
+        for fireball in world.enemies.sprites()[:count]:
+            rect = fireball.rect
+            raw[at:at + 5] = (1, rect.centerx, rect.centery, fireball.lives,
+                isinstance(fireball, MovingFireball))
+            at += 5
+        self.clear('fireballs', count)
+
+    def encodePowerUps(self, world):
+        raw = self.raw
+        start, rows, fields = self.layout['powerUps']
+        count = self.fit('powerUps', len(world.powerUps))
+        at = start
+        for powerUp in world.powerUps.sprites()[:count]:
+            rect = powerUp.rect
+            raw[at:at + 6] = (1, rect.centerx, rect.centery,
+                powerCodes[powerUp.power], powerUp.time, powerUp.maxTime)
+            at += 6
+        self.clear('powerUps', count)
+
+def describe(rows = None):
+    # The layout as text, one line per section
+    layout, size = getLayout(rows)
+    lines = []
+    for name, count, fields in sections:
+        start, count, fields = layout[name]
+        lines += ['%-10s %4d-%-4d %2d x %s' % (name, start,
+            start + count*len(fields) - 1, count, ', '.join(fields))]
+    return '\n'.join(lines + ['%d values' % size])
+
+if __name__ == '__main__':
+    print describe()
@@ -0,0 +1,225 @@
+import pygame
+from pygame.locals import *
+from GlobalFunctions import *
+from ImageCache import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # Only storm mode needs numpy
+
+############################
+# Drop system for storm mode
+############################
+
+# Same physics as Raindrop/Firedrop sprites, but every drop's state is kept
+# in numpy arrays (one array per attribute), so a frame is a few array
+# operations over all drops at once instead of one sprite update per drop.
+# Drops are boxes the size of their rotated image, anchored at the top left
+# like sprite rects after adjustRect().
+
+class DropSystem(object):
+
+    weight = 0.5
+    terminalVelocity = 15
+    dropImages = {1: 'Sprites/raindrop.png', 2: 'Sprites/firedrop.png'}
+
+    def __init__(self, screenSize, capacity = 256):
+        if numpy == None:
+            print 'Storm mode needs numpy'
+            raise SystemExit
+        self.screenSize = screenSize
+        self.count = 0
+        self.capacity = 0
+        self.fields = {}
+        self.allocate(capacity)
+        self.contacts = None
+        self.initImages()
+
+    def initImages(self):
+        self.images = {}
+        for dropType, path in DropSystem.dropImages.items():
+            image, rect = load_image(path, -1)
+            sideways = rotateImage(image, 90)
+            self.images[dropType] = (image, sideways)
+        self.baseWidth, self.baseHeight = rect.size
+
+    def allocate(self, capacity):
+        # (Re)allocates every array, keeping the drops we already have
+        types = {'onPlatform': bool, 'dropType': numpy.int8}
+        names = ['x', 'y', 'vx', 'vy', 'angle', 'targetAngle', 'w', 'h',
+            'onPlatform', 'dropType', 'oldX', 'oldY']
+        for name in names:
+            array = numpy.zeros(capacity, types.get(name, float))
+            if name in self.fields:
+                array[:self.count] = self.fields[name][:self.count]
+            self.fields[name] = array
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def add(self, x, y, dropType = 1):
+        if self.count == self.capacity:
+            self.allocate(2*self.capacity)
+        i = self.count
+        self.x[i], self.y[i] = x, y
+        self.oldX[i], self.oldY[i] = x, y
+        self.vx[i] = self.vy[i] = 0
+        self.angle[i] = self.targetAngle[i] = 0
+        self.w[i], self.h[i] = self.baseWidth, self.baseHeight
+        self.onPlatform[i] = False
+        self.dropType[i] = dropType
+        self.count += 1
+
+    def snapshot(self):
+        n = self.count
+        fields = dict([(name, array[:n].copy())
+            for name, array in self.fields.items()])
+        return (n, fields, self.contacts)
+
+    def restore(self, snapshot):
+        n, fields, self.contacts = snapshot
+        if n > self.capacity:
+            self.allocate(n)
+        for name, array in fields.items():
+            self.fields[name][:n] = array
+        self.count = n
+
+    # Physics
+
+    def update(self, dt = 1):
+        # GravityObject.update() for every drop
+        n = self.count
+        self.oldX[:n], self.oldY[:n] = self.x[:n], self.y[:n]
+        self.angle[:n] += self.targetAngle[:n]*dt
+        self.adjustSizes()
+        self.x[:n] += self.vx[:n]*dt
+        self.vx[:n] *= 0.95**dt
+        self.y[:n] += self.vy[:n]*dt
+        falling = self.vy[:n] < self.terminalVelocity
+        self.vy[:n] += (falling & ~self.onPlatform[:n])*dt
+
+    def adjustSizes(self):
+        # Bounding box of the rotated image (sideways when on a platform)
+        n = self.count
+        onPlatform = self.onPlatform[:n]
+        w = numpy.where(onPlatform, self.baseHeight, self.baseWidth)
+        h = numpy.where(onPlatform, self.baseWidth, self.baseHeight)
+        radians = numpy.radians(self.angle[:n])
+        cos = numpy.abs(numpy.cos(radians))
+        sin = numpy.abs(numpy.sin(radians))
+        self.w[:n] = w*cos + h*sin
+        self.h[:n] = w*sin + h*cos
+
+    def collidePlatforms(self, platforms):
+        # Batched isOnPlatform()/getY() for every (drop, platform) pair.
+        # Returns the weight the drops put on each platform, and keeps the
+        # contacts for settle() later in the frame.
+        n = self.count
+        platforms = list(platforms)
+        cx = (self.x[:n] + self.w[:n]/2)[:, None]
+        bottom = (self.y[:n] + self.h[:n])[:, None]
+        pcx = numpy.array([p.cx for p in platforms], float)
+        pcy = numpy.array([p.cy for p in platforms], float)
+        angles = numpy.array([p.angle for p in platforms], float)
+        left = numpy.array([p.rect.left for p in platforms], float)
+        right = numpy.array([p.rect.right for p in platforms], float)
+        height = numpy.array([p.height for p in platforms], float)
+        surfaceY = pcy - (cx - pcx)*numpy.tan(numpy.radians(angles))
+        surfaceY -= height//2
+        contacts = ((cx >= left) & (cx <= right) &
+            (bottom - surfaceY < self.terminalVelocity) &
+            (numpy.abs(surfaceY - bottom) < height))
+        weights = (self.weight*(pcx - cx)*contacts).sum(axis = 0)
+        hit = contacts.any(axis = 1)
+        landed = hit & ~self.onPlatform[:n]
+        self.vy[:n][landed] = 0
+        self.onPlatform[:n] = hit
+        self.contacts = (n, contacts, surfaceY, angles)
+        return dict(zip(platforms, weights))
+
+    def settle(self, dt = 1):
+        # adjustBlocks() for every drop, using the contacts from this frame
+        if self.contacts == None:
+            return
+        n, contacts, surfaceY, angles = self.contacts
+        self.contacts = None
+        angle = self.angle[:n]
+        hit = contacts.any(axis = 1)
+        first = contacts.argmax(axis = 1) # should only have one
+        platformAngle = angles[first]
+        self.targetAngle[:n] = numpy.where(hit, platformAngle - angle,
+            -angle/14.0)
+        self.vx[:n] -= contacts.dot(angles)/30.0*dt
+        landing = hit & (self.vy[:n] >= 0)
+        rows = numpy.arange(n)[landing]
+        self.y[:n][landing] = (surfaceY[rows, first[landing]] -
+            self.h[:n][landing])
+        # Drops added since collidePlatforms() fall straight
+        self.targetAngle[n:self.count] = -self.angle[n:self.count]/14.0
+
+    def rectHits(self, rect, dropType = None):
+        # Which drops (of the given type) overlap a rect
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        hits = ((x < rect.right) & (x + self.w[:n] > rect.left) &
+            (y < rect.bottom) & (y + self.h[:n] > rect.top))
+        if dropType != None:
+            hits &= (self.dropType[:n] == dropType)
+        return hits
+
+    def collideRect(self, rect, dropType = None):
+        # Whether any drop (of the given type) overlaps a rect
+        return bool(self.rectHits(rect, dropType).any())
+
+    def collideSprite(self, sprite, dropType = None):
+        # Whether any drop (of the given type) overlaps a sprite's drawn
+        # pixels: the rect test, then masks for just the drops it found
+        hits = self.rectHits(sprite.rect, dropType)
+        if not hits.any():
+            return False
+        mask = getMask(sprite.image)
+        left, top = sprite.rect.topleft
+        for i in numpy.flatnonzero(hits):
+            offset = (int(self.x[i]) - left, int(self.y[i]) - top)
+            if mask.overlap(getMask(self.getImage(i)), offset) != None:
+                return True
+        return False
+
+    def clearOldDrops(self):
+        # Same rules as clearOldSprites: gone once off the screen
+        width, height = self.screenSize
+        n = self.count
+        keep = ((self.y[:n] <= height) & (self.x[:n] >= 0) &
+            (self.x[:n] + self.w[:n] <= width))
+        kept = int(keep.sum())
+        if kept < n:
+            for name, array in self.fields.items():
+                array[:kept] = array[:n][keep]
+            self.count = kept
+
+    # Drawing
+
+    def getImage(self, i):
+        # The image drop i is drawn with (see getBlits)
+        onPlatform = bool(self.onPlatform[i])
+        image = self.images[int(self.dropType[i])][int(onPlatform)]
+        return rotateImage(image, self.angle[i],
+            onPlatform and self.vx[i] < 0)
+
+    def draw(self, surface, alpha = 1):
+        blitImages(surface, self.getBlits(alpha))
+
+    def getBlits(self, alpha = 1):
+        # (image, position) for every drop, alpha of the way between the
+        # last two updates
+        n = self.count
+        flips = self.onPlatform[:n] & (self.vx[:n] < 0)
+        xs = self.oldX[:n] + (self.x[:n] - self.oldX[:n])*alpha
+        ys = self.oldY[:n] + (self.y[:n] - self.oldY[:n])*alpha
+        blitList = []
+        for i in xrange(n):
+            sideways = int(self.onPlatform[i])
+            image = self.images[int(self.dropType[i])][sideways]
+            image = rotateImage(image, self.angle[i], bool(flips[i]))
+            blitList += [(image, (int(xs[i]), int(ys[i])))]
+        return blitList
@@ -0,0 +1,158 @@
+import os
+import time
+import pstats
+import cProfile
+
+# Profiling levels on demand.
+# A LevelProfiler runs cProfile over the levels it is asked to (by level
+# file name, e.g. level3), and only over the world steps in a frame range if
+# it is given one, or whenever F5 is pressed during play (press again to
+# stop). Each profile is written to its folder when the level ends, or when
+# F5 stops it, as:
+#
+#   <level>-<time>-<n>.pstats     for pstats, snakeviz, gprof2dot...
+#   <level>-<time>-<n>.collapsed  "caller;callee;... microseconds" lines,
+#                                 for flamegraph.pl or speedscope
+#
+# cProfile only keeps caller -> callee totals, not whole stacks, so the
+# collapsed stacks are worked out from those: each function's time is split
+# between the stacks it was called from in proportion to the time each
+# caller spent calling it. That is exact for functions with one caller.
+#
+#   python fireflyer.py --profile <folder> [--profile-levels level1,level3]
+#       [--profile-frames 100-400]
+#   python Replay.py <logs> --profile <folder> [--profile-frames 100-400]
+
+def parseFrames(text):
+    # '100-400' -> (100, 400); world steps 100 to 399
+    first, last = text.split('-')
+    return int(first), int(last)
+
+class LevelProfiler(object):
+
+    def __init__(self, folder = 'profiles', levels = None, frames = None):
+        self.folder = folder
+        self.levels = levels # level names to profile, None for all
+        self.frames = frames # (first, last) world steps, None for all
+        self.name = None
+        self.profile = None
+        self.wanted = self.running = self.manual = False
+        self.written = []
+        self.count = 0 # profiles written
+
+    def startLevel(self, name):
+        self.endLevel()
+        self.name = name
+        self.wanted = self.levels == None or name in self.levels
+        if self.wanted and self.frames == None:
+            self.enable()
+
+    def frame(self, frame):
+        # Called before each frame (world step, headless) is run
+        if not self.wanted or self.frames == None or self.manual:
+            return
+        first, last = self.frames
+        if first <= frame < last:
+            if not self.running:
+                self.enable()
+        elif self.running:
+            self.disable()
+
+    def toggle(self):
+        # The debug key: starts profiling, or stops and writes it out
+        if self.running:
+            self.manual = False
+            self.disable()
+            self.write()
+        else:
+            self.manual = True
+            self.enable()
+
+    def endLevel(self):
+        if self.running:
+            self.disable()
+        self.write()
+        self.name = None
+        self.wanted = self.manual = False
+
+    def enable(self):
+        if self.profile == None:
+            self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.running = True
+
+    def disable(self):
+        self.profile.disable()
+        self.running = False
+
+    def write(self):
+        # -> the paths written, if anything was profiled
+        if self.profile == None:
+            return []
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.count += 1
+        base = os.path.join(self.folder, '%s-%s-%d' % (self.name or
+            'profile', time.strftime('%Y%m%d-%H%M%S'), self.count))
+        self.profile.create_stats()
+        stats = pstats.Stats(self.profile)
+        stats.dump_stats(base + '.pstats')
+        writeCollapsed(stats, base + '.collapsed')
+        self.profile = None
+        paths = [base + '.pstats', base + '.collapsed']
+        self.written += paths
+        return paths
+
+# Collapsed stacks
+
+def functionLabel(function):
+    fileName, line, name = function
+    if fileName == '~': # built in
+        return name
+    return '%s:%d(%s)' % (os.path.basename(fileName), line, name)
+
+def collapseStats(stats, maxDepth = 48, minTime = 1e-6):
+    # -> {stack tuple: seconds of own time}
+    callees = {}
+    totals = {}
+    for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+        totals[function] = (tt, ct)
+        for caller, edge in callers.items():
+            # edge is (cc, nc, tt, ct) from cProfile, or a call count
+            if isinstance(edge, tuple):
+                edgeTime = edge[3]
+            else:
+                edgeTime = ct*edge/max(nc, 1)
+            callees.setdefault(caller, []).append((function, edgeTime))
+    roots = [function for function, (cc, nc, tt, ct, callers)
+        in stats.stats.items() if callers == {}]
+    stacks = {}
+    def visit(function, stack, share):
+        tt, ct = totals[function]
+        stack = stack + (function,)
+        if tt*share >= minTime:
+            stacks[stack] = stacks.get(stack, 0.0) + tt*share
+        if len(stack) >= maxDepth:
+            return
+        for callee, edgeTime in callees.get(function, []):
+            calleeTotal = totals[callee][1]
+            if callee in stack or calleeTotal <= 0:
+                continue
+            calleeShare = share*min(1.0, edgeTime/calleeTotal)
+            if calleeShare*calleeTotal >= minTime:
+                visit(callee, stack, calleeShare)
+    for root in roots:
+        visit(root, (), 1.0)
+    return stacks
+
+def writeCollapsed(stats, path):
+    stacks = collapseStats(stats)
+    lines = []
+    for stack, seconds in stacks.items():
+        microseconds = int(round(seconds*1e6))
+        if microseconds > 0:
+            lines += ['%s %d' % (';'.join(map(functionLabel, stack)),
+                microseconds)]
+    collapsedFile = open(path, 'w')
+    collapsedFile.write('\n'.join(sorted(lines)) + '\n')
+    collapsedFile.close()
@@ -0,0 +1,212 @@
+import os
+import errno
+import json
+import struct
+import hashlib
+
+# Input logs.
+# Everything random in a world comes from its own seeded generator, so a
+# level run is fully decided by the world's seed, the players it started
+# with and the inputs fed to each step. An input log records just that:
+#
+#   'FFIN', version (uint8), header length (uint32), JSON header
+#   then one 6 byte record per input: step number (uint32),
+#   player (uint8), command (int8)
+#   then an end record (player 255) with the step the run ended on
+#
+# Records are packed into a buffer and written out a few thousand bytes at
+# a time, so recording costs next to nothing per step. replayLog() steps a
+# new world through a log, headless, and worldDigest() gives a hash of a
+# world's state to check that a replay matches the original run.
+# Version 4 logs keep sub-pixel movement at every step rate (see
+# GravityObject.move); version 3 logs dropped it at the original tick rate,
+# and earlier ones came from the Mersenne Twister or had no power-up cheat
+# input, so none of them replays the same.
+
+magic = 'FFIN'
+version = 4
+recordFormat = struct.Struct('<IBb')
+endPlayer = 255
+
+def playerState(player):
+    # The plain number attributes of a player carried in from an earlier
+    # level (lives, score, where it respawns...)
+    state = {}
+    for name, value in player.__dict__.items():
+        if isinstance(value, (bool, int, long, float)):
+            state[name] = value
+    return state
+
+class InputRecorder(object):
+
+    bufferSize = 4096
+
+    def __init__(self, path, world, levelFile):
+        self.path = path
+        self.logFile = self.create(path)
+        self.buffer = []
+        self.size = 0
+        options = dict([(name, getattr(world, name))
+            for name in world.recordedOptions])
+        players = {}
+        for number in [1, 2]:
+            player = world.getPlayer(number)
+            if player != None:
+                players[number] = playerState(player)
+        header = json.dumps({'world': type(world).__name__,
+            'level': levelFile, 'seed': world.seed,
+            'stepRate': world.stepRate, 'size': world.screenSize,
+            'players': players, 'options': options})
+        self.logFile.write(magic + struct.pack('<BI', version, len(header)))
+        self.logFile.write(header)
+
+    def create(self, path):
+        # Never overwrites a log: if the name is taken (by another game
+        # writing to the same folder, say), adds -2, -3... until it isn't
+        base, extension = os.path.splitext(path)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os,
+            'O_BINARY', 0)
+        count = 1
+        while True:
+            try:
+                descriptor = os.open(path, flags, 0666)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                count += 1
+                path = '%s-%d%s' % (base, count, extension)
+            else:
+                self.path = path
+                return os.fdopen(descriptor, 'wb')
+
+    def record(self, frame, inputs):
+        for player, command in inputs:
+            self.buffer += [recordFormat.pack(frame, player, command)]
+        self.size += len(inputs)*recordFormat.size
+        if self.size >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        self.logFile.write(''.join(self.buffer))
+        self.buffer = []
+        self.size = 0
+
+    def close(self, frame):
+        if self.logFile == None:
+            return
+        self.buffer += [recordFormat.pack(frame, endPlayer, 0)]
+        self.flush()
+        self.logFile.close()
+        self.logFile = None
+
+class InputLog(object):
+
+    def __init__(self, path):
+        self.path = path
+        logFile = open(path, 'rb')
+        try:
+            data = logFile.read()
+        finally:
+            logFile.close()
+        headerStart = len(magic) + struct.calcsize('<BI')
+        if data[:len(magic)] != magic:
+            print 'Not an input log:', path
+            raise SystemExit
+        logVersion, length = struct.unpack('<BI',
+            data[len(magic):headerStart])
+        if logVersion != version:
+            print 'Unknown input log version:', path
+            raise SystemExit
+        header = json.loads(data[headerStart:headerStart + length])
+        self.worldType = str(header['world'])
+        self.levelFile = str(header['level'])
+        self.seed = header['seed']
+        self.stepRate = header['stepRate']
+        self.size = tuple(header['size'])
+        self.options = header.get('options', {})
+        self.players = dict([(int(number), state)
+            for number, state in header['players'].items()])
+        self.readRecords(data[headerStart + length:])
+
+    def readRecords(self, data):
+        # inputs: step number -> [(player, command), ...]
+        self.inputs = {}
+        self.endFrame = None # None if the run never ended cleanly
+        size = recordFormat.size
+        for start in xrange(0, len(data) - size + 1, size):
+            frame, player, command = recordFormat.unpack_from(data, start)
+            if player == endPlayer:
+                self.endFrame = frame
+            else:
+                self.inputs.setdefault(frame, []).append((player, command))
+        if self.endFrame == None and self.inputs != {}:
+            self.endFrame = max(self.inputs) + 1
+
+# Replaying
+
+def getWorldTypes():
+    # Imported here, since ComputerLevel pulls in the level front-ends
+    from World import GameWorld, TwoPlayerWorld
+    from ComputerLevel import ComputerWorld
+    return {'GameWorld': GameWorld, 'TwoPlayerWorld': TwoPlayerWorld,
+        'ComputerWorld': ComputerWorld}
+
+def restorePlayer(state, number):
+    from Classes import Player
+    player = Player(state['initX'], state['initY'], number)
+    player.__dict__.update(state)
+    player.updateHealthBar()
+    return player
+
+def makeWorld(log):
+    from GlobalFunctions import load_level
+    worldType = getWorldTypes()[log.worldType]
+    world = worldType(load_level(log.levelFile), log.size, log.stepRate,
+        log.seed)
+    for name, value in log.options.items():
+        setattr(world, str(name), value)
+    players = {}
+    for number, state in log.players.items():
+        players[number] = restorePlayer(state, number)
+    width, height = log.size
+    # Same as the start() of the matching level
+    if log.worldType == 'GameWorld':
+        world.player = players.get(1)
+        world.placePlayer(width/2, height/2)
+    else:
+        world.player1 = players.get(1)
+        world.player2 = players.get(2)
+        world.placePlayers()
+    return world
+
+def replayLog(log, frames = None, profiler = None):
+    # Steps a new world through a log (until it ends, or for at most
+    # frames steps) and returns it. A LevelProfiler (see Profiling.py)
+    # profiles the run, or the steps in its frame range.
+    if not isinstance(log, InputLog):
+        log = InputLog(log)
+    world = makeWorld(log)
+    end = log.endFrame or 0
+    if frames != None:
+        end = min(end, frames)
+    if profiler != None:
+        profiler.startLevel(os.path.splitext(os.path.basename(log.path))[0])
+    while world.frame < end and world.mode == None:
+        if profiler != None:
+            profiler.frame(world.frame)
+        world.step(log.inputs.get(world.frame, ()))
+    if profiler != None:
+        profiler.endLevel()
+    return world
+
+def worldDigest(world):
+    # Hash of everything that changes as a world runs
+    state = [world.frame, world.mode, world.blockCounter]
+    for sprite in world.allsprites:
+        spriteState = [type(sprite).__name__, tuple(sprite.rect)]
+        for name in ['vx', 'vy', 'angle', 'targetAngle', 'lives', 'score',
+            'carryX', 'carryY', 'weight', 'time']:
+            if hasattr(sprite, name):
+                spriteState += [getattr(sprite, name)]
+        state += [spriteState]
+    return hashlib.md5(repr(state)).hexdigest()
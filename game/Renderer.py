@@ -0,0 +1,104 @@
+import pygame
+from pygame.locals import *
+from GlobalFunctions import *
+
+# Dirty rectangle renderer.
+# Each frame gets a draw list of (key, image, position) items, in drawing
+# order, over a fixed background. Items are matched to the last frame by
+# key; only the areas where an item appeared, moved, changed image or went
+# away get the background restored and redrawn, and only those areas are
+# pushed to the display. A frame where nothing changed costs nothing.
+
+class DirtyRenderer(object):
+
+    maxDirtyRects = 200 # past this many, just redraw the whole screen
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.screenRect = screen.get_rect()
+        self.background = background
+        self.drawn = {} # key -> (image, rect) from the last frame
+        self.fullRedraw = True
+        self.frames = 0
+        self.lastFraction = self.totalFraction = 0.0
+
+    def setBackground(self, background):
+        self.background = background
+        self.fullRedraw = True
+
+    def draw(self, drawList):
+        items = []
+        current = {}
+        for key, image, position in drawList:
+            rect = image.get_rect(topleft = position)
+            items += [(image, rect)]
+            current[key] = (image, rect)
+        dirty = self.getDirtyRects(current)
+        self.drawn = current
+        for rect in dirty:
+            self.screen.blit(self.background, rect, rect)
+        blitImages(self.screen, self.clipToDirty(items, dirty))
+        if dirty != []:
+            pygame.display.update(dirty)
+        self.recordFraction(dirty)
+        return dirty
+
+    def getDirtyRects(self, current):
+        if self.fullRedraw:
+            self.fullRedraw = False
+            return [self.screenRect]
+        dirty = []
+        for key, (image, rect) in current.iteritems():
+            if key not in self.drawn:
+                dirty += [rect]
+            else:
+                oldImage, oldRect = self.drawn[key]
+                if oldImage is not image or oldRect != rect:
+                    dirty += [oldRect, rect]
+        for key, (image, rect) in self.drawn.iteritems():
+            if key not in current:
+                dirty += [rect]
+        if len(dirty) > self.maxDirtyRects:
+            return [self.screenRect]
+        return self.mergeRects(dirty)
+
+    def mergeRects(self, rects):
+        # Overlapping rects are merged, so nothing gets drawn twice
+        merged = []
+        for rect in rects:
+            rect = rect.clip(self.screenRect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged += [rect]
+        return merged
+
+    def clipToDirty(self, items, dirty):
+        # Blits for just the parts of items inside dirty areas - the rest
+        # of the screen is already right, and may have items drawn over it
+        blitList = []
+        for image, rect in items:
+            for area in dirty:
+                clipped = rect.clip(area)
+                if clipped.width > 0 and clipped.height > 0:
+                    source = clipped.move(-rect.left, -rect.top)
+                    blitList += [(image, clipped.topleft, source)]
+        return blitList
+
+    # Stats
+
+    def recordFraction(self, dirty):
+        screenArea = self.screenRect.width*self.screenRect.height
+        area = sum([rect.width*rect.height for rect in dirty])
+        self.lastFraction = min(1.0, float(area)/screenArea)
+        self.totalFraction += self.lastFraction
+        self.frames += 1
+
+    def averageFraction(self):
+        # Average fraction of the screen redrawn per frame
+        if self.frames == 0:
+            return 0.0
+        return self.totalFraction/self.frames
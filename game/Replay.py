@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import json
+import argparse
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from GlobalFunctions import *
+from Recording import *
+
+# Replay runner.
+# Re-plays recorded input logs (see Recording.py) as fast as the CPU
+# allows: worlds are stepped headless, with no drawing, clock or event
+# pump, and the logs are shared out over a pool of processes. Prints how
+# each run ended, and the total throughput.
+#
+#   python Replay.py <log files or folders> [--workers N] [--json file]
+#       [--profile folder] [--profile-frames 100-400]
+#
+# With --profile, each replay is profiled (or just the steps in the frame
+# range), and written to the folder as in Profiling.py.
+
+logExtension = '.ffi'
+
+def findLogs(paths):
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(logExtension):
+                    logs += [os.path.join(path, name)]
+        else:
+            logs += [path]
+    return logs
+
+def startWorker():
+    # Images still get loaded (sprites need their rects), so every worker
+    # needs a display to convert them for
+    initHeadless()
+
+def replayResult(path, profiler = None):
+    start = time.time()
+    log = InputLog(path)
+    profiles = []
+    if profiler != None:
+        profiles = profiler.written = []
+    world = replayLog(log, profiler = profiler)
+    players = []
+    for number in [1, 2]:
+        player = world.getPlayer(number)
+        if player != None:
+            players += [(player.score, player.lives)]
+    return {'path': path, 'world': log.worldType, 'level': log.levelFile,
+        'frames': world.frame, 'mode': world.mode,
+        'scores': [score for score, lives in players],
+        'lives': [lives for score, lives in players],
+        'blockCounter': world.blockCounter, 'digest': worldDigest(world),
+        'seconds': time.time() - start,
+        'profiles': profiles}
+
+def runReplays(paths, workers = None, profiler = None):
+    if workers == None:
+        workers = cpu_count()
+    replay = partial(replayResult, profiler = profiler)
+    if workers <= 1:
+        startWorker()
+        return map(replay, paths)
+    pool = Pool(workers, startWorker)
+    try:
+        return pool.map(replay, paths, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def report(results, seconds):
+    for result in results:
+        print '%-44s %-14s %6d frames  %-5s score %-7s lives %-5s ' \
+            'blocks %d' % (os.path.basename(result['path']),
+            result['world'], result['frames'], result['mode'],
+            '/'.join(map(str, result['scores'])),
+            '/'.join(map(str, result['lives'])), result['blockCounter'])
+    frames = sum([result['frames'] for result in results])
+    print '%d replays, %d frames in %.2f s (%.0f frames/s)' % (
+        len(results), frames, seconds, frames/max(seconds, 1e-9))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs = '+')
+    parser.add_argument('--workers', type = int,
+        help = 'processes to use (default: one per CPU)')
+    parser.add_argument('--json', help = 'also write the results here')
+    parser.add_argument('--profile', help = 'write profiles to this folder')
+    parser.add_argument('--profile-frames', help = 'only profile these '
+        'steps, e.g. 100-400')
+    args = parser.parse_args()
+    logs = findLogs(args.paths)
+    profiler = None
+    if args.profile:
+        from Profiling import LevelProfiler, parseFrames
+        frames = None
+        if args.profile_frames:
+            frames = parseFrames(args.profile_frames)
+        profiler = LevelProfiler(args.profile, frames = frames)
+    start = time.time()
+    results = runReplays(logs, args.workers, profiler)
+    seconds = time.time() - start
+    report(results, seconds)
+    for result in results:
+        for path in result['profiles']:
+            print 'Wrote', path
+    if args.json:
+        resultsFile = open(args.json, 'w')
+        json.dump({'results': results, 'seconds': seconds}, resultsFile,
+            indent = 1, sort_keys = True)
+        resultsFile.close()
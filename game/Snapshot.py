@@ -0,0 +1,398 @@
+import struct
+import pygame
+from array import array
+
+# Compact world snapshots, for rollback (see Netplay.py).
+# GameWorld.snapshot() keeps copies of every sprite's attribute dict, which
+# is fine for the boss planner but too big to keep one per step. A
+# SnapshotCodec packs a world's changing state into one string instead:
+#
+#   header: RNG state, save number, frame, and the length of each section
+#   codes:  one character per value, saying what kind of value it was
+#   ints:   array('i') of whole numbers (and rect coordinates)
+#   floats: array('d') of everything else numeric
+#   storm:  the storm drop arrays, as raw bytes
+#
+# Nothing in a snapshot refers to a Surface or a sprite directly. Sprites
+# are numbered in the order the codec first sees them (its roster), and
+# images and strings by index into the codec's own tables, which only hold
+# references to objects that already exist. prune() lets go of the sprites
+# and images no snapshot still kept refers to (dead sprites, rotated frames
+# the rotation cache has dropped), and their slots are used again. A
+# snapshot can only be restored by the codec (and the world) that saved it.
+
+headerFormat = struct.Struct('<QIIIIII')
+
+# Value codes
+INT, FLOAT, TRUE, FALSE, NONE = 'i', 'f', 'T', 'F', 'n'
+STRING, IMAGE, SPRITE, RECT, TUPLE, LIST = 's', 'S', 'o', 'r', 't', 'l'
+
+# Sprite attributes that never change once a sprite is made
+staticFields = set(['_Sprite__g', 'cx', 'cy', 'width', 'height',
+    'resistance', 'jumpHeight', 'terminalVelocity', 'maxlives',
+    'maxBlockTime', 'maxDistance', 'initX', 'initY', 'permCopy',
+    'hitImage', 'sideways'])
+
+# World attributes that never change, or are saved some other way, or are
+# caches worked out again when needed (methods wrapped per world, as the
+# benchmarks do, are skipped too)
+worldFields = set(['levelData', 'screenSize', 'stepRate', 'dt', 'seed',
+    'maxBlocks', 'platformsList', 'enemiesList', 'powerTimeMin',
+    'powerTimeMax', 'random', 'contacts', 'storm', 'previous', 'scores',
+    'platformArrays'])
+
+class SnapshotCodec(object):
+
+    pruneInterval = 60 # saves between prunes
+
+    def __init__(self, world):
+        self.world = world
+        self.roster = [] # sprites, in the order first seen
+        self.spriteIndex = {}
+        self.images = []
+        self.imageIndex = {}
+        # The save that last referred to each roster and image slot, and
+        # slots free to use again (see prune)
+        self.spriteSeen = []
+        self.imageSeen = []
+        self.freeSprites = []
+        self.freeImages = []
+        self.saveCount = 0
+        self.prunedAt = 0
+        self.strings = []
+        self.stringIndex = {}
+        self.fields = {} # class -> names of the attributes we save
+        self.fieldCounts = {} # class -> number of attributes when listed
+        self.groupNames = sorted([name
+            for name, value in world.__dict__.items()
+            if isinstance(value, pygame.sprite.AbstractGroup)])
+        self.worldNames = []
+        self.worldCount = 0
+        self.encoders = {int: self.encodeInt, long: self.encodeInt,
+            float: self.encodeFloat, bool: self.encodeBool,
+            type(None): self.encodeNone, str: self.encodeString,
+            pygame.Surface: self.encodeImage, pygame.Rect: self.encodeRect,
+            tuple: self.encodeSequence, list: self.encodeSequence}
+
+    # Tables
+
+    def getSpriteIndex(self, sprite):
+        index = self.spriteIndex.get(sprite)
+        if index == None:
+            index = self.addEntry(sprite, self.roster, self.spriteIndex,
+                self.spriteSeen, self.freeSprites)
+        self.spriteSeen[index] = self.saveCount
+        return index
+
+    def getImageIndex(self, image):
+        index = self.imageIndex.get(image)
+        if index == None:
+            index = self.addEntry(image, self.images, self.imageIndex,
+                self.imageSeen, self.freeImages)
+        self.imageSeen[index] = self.saveCount
+        return index
+
+    def addEntry(self, value, table, indices, seen, free):
+        if free != []:
+            index = free.pop()
+            table[index] = value
+        else:
+            index = len(table)
+            table += [value]
+            seen += [0]
+        indices[value] = index
+        return index
+
+    def prune(self, snapshots):
+        # Everything a snapshot refers to was seen by the save that made
+        # it, so sprites and images last seen before the oldest of the
+        # snapshots still kept are not in any of them. Only every
+        # pruneInterval saves, since it looks at every slot.
+        if self.saveCount - self.prunedAt < self.pruneInterval:
+            return
+        self.prunedAt = self.saveCount
+        oldest = min([headerFormat.unpack_from(snapshot)[1]
+            for snapshot in snapshots] or [self.saveCount + 1])
+        self.release(self.roster, self.spriteIndex, self.spriteSeen,
+            self.freeSprites, oldest)
+        self.release(self.images, self.imageIndex, self.imageSeen,
+            self.freeImages, oldest)
+
+    def release(self, table, indices, seen, free, oldest):
+        for index, value in enumerate(table):
+            if value != None and seen[index] < oldest:
+                del indices[value]
+                table[index] = None
+                free += [index]
+
+    def getStringIndex(self, string):
+        if string not in self.stringIndex:
+            self.stringIndex[string] = len(self.strings)
+            self.strings += [string]
+        return self.stringIndex[string]
+
+    def getFields(self, sprite):
+        # New attributes go on the end, so older snapshots still line up
+        kind = type(sprite)
+        state = sprite.__dict__
+        if self.fieldCounts.get(kind) != len(state):
+            fields = self.fields.setdefault(kind, [])
+            for name in sorted(state):
+                if name not in staticFields and name not in fields:
+                    fields += [name]
+            self.fieldCounts[kind] = len(state)
+        return self.fields[kind]
+
+    def getWorldFields(self):
+        state = self.world.__dict__
+        if self.worldCount != len(state):
+            for name in sorted(state):
+                if (name not in worldFields and name not in self.groupNames
+                    and name not in self.worldNames and
+                    not callable(state[name])):
+                    self.worldNames += [name]
+            self.worldCount = len(state)
+        return self.worldNames
+
+    # Encoding
+
+    def encode(self, value):
+        encoder = self.encoders.get(type(value))
+        if encoder != None:
+            encoder(value)
+        elif isinstance(value, pygame.sprite.Sprite):
+            self.codes.append(SPRITE)
+            self.ints.append(self.getSpriteIndex(value))
+        elif isinstance(value, (int, long)): # e.g. numpy integers
+            self.encodeInt(int(value))
+        elif isinstance(value, float):
+            self.encodeFloat(float(value))
+        else:
+            print 'Cannot snapshot a', type(value).__name__
+            raise SystemExit
+
+    def encodeInt(self, value):
+        self.codes.append(INT)
+        self.ints.append(value)
+
+    def encodeFloat(self, value):
+        self.codes.append(FLOAT)
+        self.floats.append(value)
+
+    def encodeBool(self, value):
+        self.codes.append(value and TRUE or FALSE)
+
+    def encodeNone(self, value):
+        self.codes.append(NONE)
+
+    def encodeString(self, value):
+        self.codes.append(STRING)
+        self.ints.append(self.getStringIndex(value))
+
+    def encodeImage(self, value):
+        self.codes.append(IMAGE)
+        self.ints.append(self.getImageIndex(value))
+
+    def encodeRect(self, value):
+        self.codes.append(RECT)
+        self.ints.extend(value)
+
+    def encodeSequence(self, value):
+        self.codes.append(type(value) == tuple and TUPLE or LIST)
+        self.ints.append(len(value))
+        for item in value:
+            self.encode(item)
+
+    def save(self):
+        world = self.world
+        self.saveCount += 1
+        saveCount = self.saveCount
+        self.codes = codes = []
+        self.ints = ints = []
+        self.floats = floats = []
+        getSpriteIndex = self.getSpriteIndex
+        sprites = []
+        for name in self.groupNames:
+            members = world.__dict__[name].sprites()
+            ints.append(len(members))
+            ints.extend([getSpriteIndex(sprite) for sprite in members])
+            sprites += members
+        state = world.__dict__
+        names = self.getWorldFields()
+        ints.append(len(names))
+        for name in names:
+            value = state.get(name)
+            if isinstance(value, pygame.sprite.Sprite):
+                sprites.append(value)
+            self.encode(value)
+        saved = set()
+        encode = self.encode
+        images = self.imageIndex
+        imageSeen = self.imageSeen
+        getImageIndex = self.getImageIndex
+        Surface = pygame.Surface
+        for sprite in sprites:
+            if sprite in saved:
+                continue
+            saved.add(sprite)
+            fields = self.getFields(sprite)
+            spriteState = sprite.__dict__
+            ints.append(getSpriteIndex(sprite))
+            ints.append(len(fields))
+            # Inlined for the common kinds of value; this loop is most of
+            # the time a save takes
+            for name in fields:
+                value = spriteState.get(name)
+                kind = type(value)
+                if kind == int:
+                    codes.append(INT)
+                    ints.append(value)
+                elif kind == float:
+                    codes.append(FLOAT)
+                    floats.append(value)
+                elif kind == bool:
+                    codes.append(value and TRUE or FALSE)
+                elif value is None:
+                    codes.append(NONE)
+                elif kind == Surface:
+                    codes.append(IMAGE)
+                    index = images.get(value)
+                    if index == None:
+                        index = getImageIndex(value)
+                    imageSeen[index] = saveCount
+                    ints.append(index)
+                else:
+                    encode(value)
+        ints.append(-1)
+        self.saveContacts(world.contacts)
+        codes = ''.join(codes)
+        ints = array('i', ints).tostring()
+        floats = array('d', floats).tostring()
+        storm = self.saveStorm(world.storm)
+        header = headerFormat.pack(world.random.getstate(), saveCount,
+            world.frame, len(codes), len(ints), len(floats), len(storm))
+        self.codes = self.ints = self.floats = None
+        return ''.join([header, codes, ints, floats, storm])
+
+    def saveContacts(self, contacts):
+        self.ints += [len(contacts.hits)]
+        for block, hits in contacts.hits.items():
+            self.ints += [self.getSpriteIndex(block), len(hits)]
+            for platform, y in hits:
+                self.ints.append(self.getSpriteIndex(platform))
+                self.encode(y)
+        self.ints += [len(contacts.onPlatform)]
+        for platform, blocks in contacts.onPlatform.items():
+            self.ints += [self.getSpriteIndex(platform), len(blocks)]
+            for block in blocks:
+                self.ints += [self.getSpriteIndex(block)]
+
+    def saveStorm(self, storm):
+        if storm == None:
+            return ''
+        n = storm.count
+        arrays = [storm.fields[name][:n].tostring()
+            for name in sorted(storm.fields)]
+        return struct.pack('<I', n) + ''.join(arrays)
+
+    # Decoding
+
+    def decode(self, code):
+        if code == INT:
+            return self.nextInt()
+        elif code == FLOAT:
+            return self.nextFloat()
+        elif code == TRUE or code == FALSE:
+            return code == TRUE
+        elif code == NONE:
+            return None
+        index = self.nextInt()
+        if code == STRING:
+            return self.strings[index]
+        elif code == IMAGE:
+            return self.images[index]
+        elif code == SPRITE:
+            return self.roster[index]
+        elif code == RECT:
+            nextInt = self.nextInt
+            return pygame.Rect(index, nextInt(), nextInt(), nextInt())
+        items = [self.decode(self.nextCode()) for i in xrange(index)]
+        if code == TUPLE:
+            return tuple(items)
+        return items
+
+    def restore(self, snapshot):
+        world = self.world
+        (randomState, saveCount, frame, codeLength, intLength, floatLength,
+            stormLength) = headerFormat.unpack_from(snapshot)
+        start = headerFormat.size
+        codes = snapshot[start:start + codeLength]
+        self.nextCode = nextCode = iter(codes).next
+        start += codeLength
+        self.nextInt = nextInt = iter(array('i',
+            snapshot[start:start + intLength])).next
+        start += intLength
+        self.nextFloat = nextFloat = iter(array('d',
+            snapshot[start:start + floatLength])).next
+        start += floatLength
+        storm = snapshot[start:start + stormLength]
+        roster = self.roster
+        decode = self.decode
+        for name in self.groupNames:
+            group = world.__dict__[name]
+            members = [roster[nextInt()] for i in xrange(nextInt())]
+            if members != group.sprites():
+                group.empty()
+                group.add(*members)
+        state = world.__dict__
+        for name in self.worldNames[:nextInt()]:
+            state[name] = decode(nextCode())
+        index = nextInt()
+        while index != -1:
+            sprite = roster[index]
+            spriteState = sprite.__dict__
+            for name in self.fields[type(sprite)][:nextInt()]:
+                code = nextCode()
+                if code == INT:
+                    spriteState[name] = nextInt()
+                elif code == FLOAT:
+                    spriteState[name] = nextFloat()
+                else:
+                    spriteState[name] = decode(code)
+            index = nextInt()
+        self.restoreContacts(world.contacts)
+        world.random.setstate(randomState)
+        self.restoreStorm(world.storm, storm)
+        world.previous = {}
+        if 'scores' in state:
+            world.scores = world.platformArrays = None
+        self.nextCode = self.nextInt = self.nextFloat = None
+
+    def restoreContacts(self, contacts):
+        roster = self.roster
+        contacts.clear()
+        for i in xrange(self.nextInt()):
+            block = roster[self.nextInt()]
+            contacts.hits[block] = [(roster[self.nextInt()],
+                self.decode(self.nextCode())) for j in xrange(self.nextInt())]
+        for i in xrange(self.nextInt()):
+            platform = roster[self.nextInt()]
+            contacts.onPlatform[platform] = [roster[self.nextInt()]
+                for j in xrange(self.nextInt())]
+
+    def restoreStorm(self, storm, data):
+        if storm == None:
+            return
+        import numpy
+        n = struct.unpack_from('<I', data)[0]
+        if n > storm.capacity:
+            storm.allocate(n)
+        start = 4
+        for name in sorted(storm.fields):
+            array = storm.fields[name]
+            size = n*array.itemsize
+            array[:n] = numpy.frombuffer(data[start:start + size],
+                array.dtype)
+            start += size
+        storm.count = n
+        storm.contacts = None
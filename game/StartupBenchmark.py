@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import json
+import subprocess
+
+# Cold start benchmark: starts the game in a fresh python process (with
+# SDL's dummy video driver) and reports how long it took, from launching
+# the process, to draw the first frame of the start screen, and until
+# every startup image had been decoded and converted.
+#
+#   python StartupBenchmark.py [runs]
+
+child = '''
+import time, json
+import fireflyer
+
+class TimedGame(fireflyer.Game):
+    def redrawAll(self):
+        super(TimedGame, self).redrawAll()
+        if self.times == {}:
+            self.times['firstFrame'] = time.time()
+    def finishLoading(self):
+        super(TimedGame, self).finishLoading()
+        if self.levels != None and not self.loading:
+            self.times['loaded'] = time.time()
+            self.mode = False
+    def init(self):
+        self.times = {}
+        super(TimedGame, self).init()
+
+game = TimedGame()
+game.run()
+print json.dumps(game.times)
+'''
+
+def timeStartup():
+    environment = dict(os.environ, SDL_VIDEODRIVER = 'dummy',
+        SDL_AUDIODRIVER = 'dummy')
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c', child],
+        stdout = subprocess.PIPE, env = environment)
+    output = process.communicate()[0]
+    times = json.loads(output.strip().splitlines()[-1])
+    result = {}
+    for name, when in times.items():
+        result[name] = (when - start)*1000
+    return result
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)/2]
+
+def benchmark(runs = 5):
+    timeStartup() # warms the disk cache and writes the .pyc files
+    results = [timeStartup() for i in xrange(runs)]
+    for name in ['firstFrame', 'loaded']:
+        values = [result[name] for result in results]
+        print '%-10s  median %6.1f ms  min %6.1f ms  max %6.1f ms' % (
+            name, median(values), min(values), max(values))
+    return results
+
+if __name__ == '__main__':
+    runs = 5
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    benchmark(runs)
@@ -0,0 +1,280 @@
+import os
+import time
+import json
+import argparse
+import pygame
+
+# Per-phase frame timing, for finding out what made a frame slow.
+# A level with FrameTimers (level.timers) has the methods below wrapped on
+# its world and on itself, so every call adds its time to its phase for the
+# frame, and is kept as a trace event. Nothing is wrapped while timing is
+# off, so then it costs a couple of attribute checks per frame.
+#
+# Phases nest the way the calls do: collisions is part of update, and
+# platformCollisions and the rest are parts of collisions. A frame is the
+# time from the clock tick to the end of the event pump (so not the time
+# spent waiting for the next frame).
+#
+# F3 shows an overlay with the 50th, 95th and 99th percentile of each phase
+# over the last second or so, and a graph of recent frame times against the
+# frame budget. F4 writes what has been timed so far, as CSV (one row per
+# frame, ms per phase) and as a Chrome trace (load it in chrome://tracing
+# or ui.perfetto.dev), to GameLevel.timingFolder, or the current folder.
+# Levels with a timingFolder time every frame, and write it all out when
+# they close.
+#
+#   python Timing.py [--level level1] [--frames N] [--folder F]
+
+# (phase, what it is a method of, method)
+phases = [('ai', 'world', 'updateComputerPlayer'),
+    ('plan', 'world', 'planMove'),
+    ('update', 'world', 'update'),
+    ('sprites', 'allsprites', 'update'),
+    ('collisions', 'world', 'handleCollisions'),
+    ('platformCollisions', 'world', 'handlePlatformCollisions'),
+    ('enemyCollisions', 'world', 'enemyCollisions'),
+    ('adjustBlocks', 'world', 'adjustBlocks'),
+    ('clearOldSprites', 'world', 'clearOldSprites'),
+    ('draw', 'level', 'redrawAll'),
+    ('events', 'level', 'handleEvents')]
+phaseNames = [name for name, owner, method in phases]
+
+class FrameTimers(object):
+
+    window = 120 # frames the overlay's percentiles and graph cover
+    overlayInterval = 10 # frames between redrawing the overlay
+    maxFrames = 36000 # frames kept for CSV, about ten minutes
+    maxEvents = 500000 # trace events kept
+
+    def __init__(self):
+        self.clock = time.time
+        self.origin = self.clock()
+        self.totals = dict([(name, 0.0) for name in phaseNames])
+        self.events = [] # (phase, start, end)
+        self.rows = [] # (frame start, frame time, phase times...)
+        self.recent = [] # the last window rows
+        self.wrapped = []
+        self.frameStart = None
+        self.frames = 0
+        self.overlay = False
+        self.overlaySurface = None
+
+    # Wrapping
+
+    def attach(self, level):
+        # (Again after a level makes a new world)
+        self.detach()
+        owners = {'level': level, 'world': level.world,
+            'allsprites': level.world.allsprites}
+        for name, owner, method in phases:
+            self.wrap(owners[owner], name, method)
+
+    def wrap(self, target, name, method):
+        original = getattr(target, method, None)
+        if original == None:
+            return
+        totals, events, clock = self.totals, self.events, self.clock
+        maxEvents = self.maxEvents
+        def timed(*args):
+            start = clock()
+            result = original(*args)
+            end = clock()
+            totals[name] += end - start
+            if len(events) < maxEvents:
+                events.append((name, start, end))
+            return result
+        setattr(target, method, timed)
+        self.wrapped += [(target, method)]
+
+    def detach(self):
+        for target, method in self.wrapped:
+            if method in target.__dict__:
+                delattr(target, method)
+        self.wrapped = []
+
+    # Frames
+
+    def startFrame(self):
+        self.frameStart = self.clock()
+
+    def endFrame(self):
+        if self.frameStart == None:
+            return
+        end = self.clock()
+        totals = self.totals
+        row = tuple([self.frameStart, end - self.frameStart] +
+            [totals[name] for name in phaseNames])
+        if len(self.rows) < self.maxFrames:
+            self.rows.append(row)
+        if len(self.events) < self.maxEvents:
+            self.events.append(('frame', self.frameStart, end))
+        self.recent.append(row)
+        if len(self.recent) > self.window:
+            del self.recent[0]
+        for name in phaseNames:
+            totals[name] = 0.0
+        self.frames += 1
+        self.frameStart = None
+
+    # Statistics
+
+    def percentiles(self, column, points = (50, 95, 99)):
+        # ms at each percentile of one column of the recent rows
+        values = sorted([row[column] for row in self.recent])
+        if values == []:
+            return [0.0 for point in points]
+        return [values[min(len(values) - 1, len(values)*point/100)]*1000
+            for point in points]
+
+    # Overlay
+
+    def toggleOverlay(self):
+        self.overlay = not self.overlay
+        self.overlaySurface = None
+
+    def getOverlay(self, budget = 1/60.0):
+        if self.overlaySurface == None or \
+            self.frames % self.overlayInterval == 0:
+            self.overlaySurface = self.drawOverlay(budget)
+        return self.overlaySurface
+
+    def drawOverlay(self, budget):
+        from Hud import textCache
+        font = textCache.getFont(12)
+        lineHeight = font.get_linesize()
+        names = ['frame'] + [name for name in phaseNames
+            if any([row[2 + phaseNames.index(name)] > 0
+            for row in self.recent])]
+        graphHeight = 40
+        width = 300
+        height = lineHeight*(len(names) + 1) + graphHeight + 12
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 170))
+        color = (230, 230, 230)
+        lines = ['%-19s %6s %6s %6s' % ('ms', 'p50', 'p95', 'p99')]
+        for name in names:
+            if name == 'frame':
+                column = 1
+            else:
+                column = 2 + phaseNames.index(name)
+            lines += ['%-19s %6.2f %6.2f %6.2f' % tuple([name] +
+                self.percentiles(column))]
+        for i, line in enumerate(lines):
+            surface.blit(font.render(line, True, color), (4, 4 + i*lineHeight))
+        # Frame times, with the frame budget as the middle line
+        top = height - graphHeight - 4
+        scale = graphHeight/(2*budget)
+        for i, row in enumerate(self.recent[-(width - 8)/2:]):
+            barHeight = min(graphHeight, int(row[1]*scale) + 1)
+            barColor = (90, 200, 90)
+            if row[1] > budget:
+                barColor = (230, 80, 60)
+            pygame.draw.line(surface, barColor, (4 + i*2, top + graphHeight),
+                (4 + i*2, top + graphHeight - barHeight))
+        pygame.draw.line(surface, (200, 200, 200), (4, top + graphHeight/2),
+            (width - 4, top + graphHeight/2))
+        return surface
+
+    # Export
+
+    def writeCSV(self, path):
+        csvFile = open(path, 'w')
+        csvFile.write(','.join(['frame', 'start', 'total'] + phaseNames) +
+            '\n')
+        for frame, row in enumerate(self.rows):
+            csvFile.write('%d,%.6f,' % (frame, row[0] - self.origin) +
+                ','.join(['%.4f' % (value*1000) for value in row[1:]]) +
+                '\n')
+        csvFile.close()
+
+    def writeTrace(self, path):
+        # Chrome trace event format: complete ('X') events, times in us
+        origin = self.origin
+        events = [{'name': name, 'ph': 'X', 'pid': 1, 'tid': 1,
+            'cat': name == 'frame' and 'frame' or 'phase',
+            'ts': round((start - origin)*1e6, 1),
+            'dur': round((end - start)*1e6, 1)}
+            for name, start, end in self.events]
+        traceFile = open(path, 'w')
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'frames': self.frames,
+            'eventsDropped': len(self.events) >= self.maxEvents}},
+            traceFile)
+        traceFile.close()
+
+    def export(self, folder, name):
+        # -> the two paths written
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        base = os.path.join(folder, '%s-%s' % (name,
+            time.strftime('%Y%m%d-%H%M%S')))
+        self.writeCSV(base + '.csv')
+        self.writeTrace(base + '.json')
+        return base + '.csv', base + '.json'
+
+# Timed headless play
+
+class SteppingClock(object):
+    # Says a world step's worth of time went by since the last frame
+    def __init__(self, stepRate):
+        self.frameTime = 1000/stepRate
+    def tick(self, frameRate = 0):
+        return self.frameTime
+
+def timeFrames(levelType, file, frames, timers = None):
+    # Plays frames frames of a level with scripted controls, as the game
+    # loop does (but without waiting, and one world step a frame);
+    # -> seconds per frame
+    from Benchmark import scriptedInputs
+    level = levelType(file)
+    level.timers = timers
+    level.seed = 0
+    screen = pygame.display.get_surface()
+    level.start(screen.get_size(), screen, SteppingClock(level.stepRate))
+    level.mode = None
+    level.BossInstructions = False
+    start = time.time()
+    for frame in xrange(frames):
+        level.inputs += scriptedInputs(frame, [1])
+        level.timerFired()
+        if level.mode != None:
+            level.start(screen.get_size(), screen, SteppingClock(level.stepRate))
+            level.mode = None
+            level.BossInstructions = False
+    seconds = (time.time() - start)/frames
+    level.timers = None # (so close() doesn't export)
+    level.close()
+    return seconds
+
+if __name__ == '__main__':
+    from GlobalFunctions import initHeadless
+    from Level import GameLevel
+    from ComputerLevel import ComputerLevel
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--level', default = 'level1',
+        help = 'a level file name, or boss')
+    parser.add_argument('--frames', type = int, default = 600)
+    parser.add_argument('--folder', default = '.',
+        help = 'where to write the CSV and trace')
+    args = parser.parse_args()
+    initHeadless()
+    levelType = GameLevel
+    if args.level == 'boss':
+        levelType, args.level = ComputerLevel, 'level2p1'
+    file = 'Levels/' + args.level
+    off = timeFrames(levelType, file, args.frames)
+    timers = FrameTimers()
+    on = timeFrames(levelType, file, args.frames, timers)
+    print '%-19s %8s %8s %8s' % ('ms', 'p50', 'p95', 'p99')
+    timers.window = len(timers.rows)
+    timers.recent = timers.rows
+    print '%-19s %8.3f %8.3f %8.3f' % tuple(['frame'] +
+        timers.percentiles(1))
+    for i, name in enumerate(phaseNames):
+        if any([row[2 + i] > 0 for row in timers.rows]):
+            print '%-19s %8.3f %8.3f %8.3f' % tuple([name] +
+                timers.percentiles(2 + i))
+    print 'timing off: %.3f ms/frame, on: %.3f ms/frame (%+.1f%%)' % (
+        off*1000, on*1000, (on - off)/off*100)
+    for path in timers.export(args.folder, args.level):
+        print 'wrote', path
@@ -0,0 +1,248 @@
+import time
+import json
+import math
+import random
+import argparse
+from multiprocessing import Pool, cpu_count
+from GlobalFunctions import *
+from ComputerLevel import ComputerWorld
+from Replay import startWorker
+
+# Self-play tuning for the boss AI.
+# A parameter set gives values for ComputerWorld.aiParameters. Each set
+# plays a number of headless boss matches against scripted opponents, over
+# a pool of processes. Every set plays the same seeds against the same
+# opponents, so their win rates can be compared fairly. The search is
+# either random (sets drawn from parameterRanges) or evolutionary (the best
+# half of each generation is kept, and mutated copies of it replace the
+# rest). Win rates come with 95% Wilson intervals, and the throughput in
+# matches per second per CPU core is reported with every batch.
+#
+#   python Tuning.py [--search random|evolve] [--sets N]
+#       [--generations G] [--matches M] [--frames F] [--workers W]
+#       [--seed S] [--save best.json]
+
+levelFile = 'Levels/level2p1'
+
+# (low, high) for each parameter; all of them are whole numbers
+parameterRanges = {'marginX': (5, 60), 'marginY': (0, 50),
+    'upperMargin': (0, 250), 'enemyMargin': (0, 60),
+    'evadeMargin': (20, 200), 'framesToProject': (0, 15),
+    'balanceSpeed': (2, 20), 'balanceDistance': (5, 80),
+    'moveInterval': (1, 8)}
+
+def defaultParameters():
+    return dict([(name, getattr(ComputerWorld, name))
+        for name in ComputerWorld.aiParameters])
+
+# Opponents: player 1's commands for one step
+
+def scriptedOpponent(world, rand):
+    # Walk one way for a while, then the other, jumping now and then
+    frame = world.frame
+    if frame % 7 == 1:
+        return [0]
+    elif frame % 3 == 0:
+        return [[1, -1][(frame/40 + 1) % 2]]
+    return []
+
+def randomOpponent(world, rand):
+    if rand.random() < 0.15:
+        return [rand.choice([0, 1, -1])]
+    return []
+
+def chasingOpponent(world, rand):
+    # Heads for the boss, and jumps when it is above
+    if world.frame % 4 != 0:
+        return []
+    x, y = world.player1.rect.center
+    bossX, bossY = world.player2.rect.center
+    if bossY < y - 30 or rand.random() < 0.1:
+        return [0]
+    elif abs(bossX - x) > 20:
+        return [cmp(bossX, x)]
+    return []
+
+opponents = {'scripted': scriptedOpponent, 'random': randomOpponent,
+    'chasing': chasingOpponent}
+
+# Matches
+
+def playMatch(task):
+    # Runs in a worker; returns (set index, boss result, frames)
+    index, parameters, opponent, seed, frames = task
+    world = ComputerWorld(load_level(levelFile), seed = seed)
+    for name, value in parameters.items():
+        setattr(world, name, value)
+    world.placePlayers()
+    rand = random.Random(seed)
+    play = opponents[opponent]
+    while world.mode == None and world.frame < frames:
+        world.step([(1, command) for command in play(world, rand)])
+    # 'Lost' is the player losing, so a boss win
+    result = {'Lost': 'win', 'Over': 'loss'}.get(world.mode, 'draw')
+    return index, result, world.frame
+
+def matchTasks(index, parameters, matches, frames, seed):
+    names = sorted(opponents)
+    return [(index, parameters, names[i % len(names)],
+        seed + i/len(names), frames) for i in xrange(matches)]
+
+class Evaluator(object):
+
+    def __init__(self, matches, frames, seed, workers = None):
+        self.matches = matches
+        self.frames = frames
+        self.seed = seed
+        self.workers = workers or cpu_count()
+        self.pool = None
+        if self.workers > 1:
+            self.pool = Pool(self.workers, startWorker)
+        else:
+            startWorker()
+        self.totalMatches = self.totalFrames = 0
+        self.totalTime = 0.0
+
+    def evaluate(self, parameterSets):
+        # -> a results dict for each set
+        tasks = []
+        for index, parameters in enumerate(parameterSets):
+            tasks += matchTasks(index, parameters, self.matches,
+                self.frames, self.seed)
+        start = time.time()
+        if self.pool != None:
+            outcomes = self.pool.imap_unordered(playMatch, tasks, 4)
+        else:
+            outcomes = map(playMatch, tasks)
+        results = [{'parameters': parameters, 'win': 0, 'loss': 0,
+            'draw': 0, 'frames': 0} for parameters in parameterSets]
+        for index, result, frames in outcomes:
+            results[index][result] += 1
+            results[index]['frames'] += frames
+        seconds = time.time() - start
+        for result in results:
+            result['winRate'], result['low'], result['high'] = \
+                winInterval(result['win'], self.matches)
+        self.totalMatches += len(tasks)
+        self.totalFrames += sum([result['frames'] for result in results])
+        self.totalTime += seconds
+        print '%d matches in %.1f s: %.1f matches/s/core, %.0f frames/s' % (
+            len(tasks), seconds, self.throughput(len(tasks), seconds),
+            sum([result['frames'] for result in results])/max(seconds, 1e-9))
+        return results
+
+    def throughput(self, matches, seconds):
+        # More workers than CPUs just take turns
+        cores = min(self.workers, cpu_count())
+        return matches/max(seconds, 1e-9)/cores
+
+    def close(self):
+        if self.pool != None:
+            self.pool.close()
+            self.pool.join()
+
+# Statistics
+
+def winInterval(wins, matches, z = 1.96):
+    # Win rate, and its 95% Wilson score interval
+    if matches == 0:
+        return 0.0, 0.0, 1.0
+    rate = float(wins)/matches
+    scale = 1 + z*z/matches
+    center = (rate + z*z/(2*matches))/scale
+    spread = z*math.sqrt(rate*(1 - rate)/matches +
+        z*z/(4*matches*matches))/scale
+    return rate, max(0.0, center - spread), min(1.0, center + spread)
+
+def rank(results):
+    # Best first; the lower end of the interval breaks ties
+    return sorted(results, key = lambda result: (result['winRate'],
+        result['low']), reverse = True)
+
+# Searches
+
+def randomParameters(rand):
+    return dict([(name, rand.randint(low, high))
+        for name, (low, high) in parameterRanges.items()])
+
+def mutate(parameters, rand, scale = 0.15):
+    child = dict(parameters)
+    for name, (low, high) in parameterRanges.items():
+        if rand.random() < 0.5:
+            value = child[name] + rand.gauss(0, scale*(high - low))
+            child[name] = min(high, max(low, int(round(value))))
+    return child
+
+def randomSearch(evaluator, sets, rand):
+    parameterSets = [defaultParameters()] + [randomParameters(rand)
+        for i in xrange(sets - 1)]
+    return rank(evaluator.evaluate(parameterSets))
+
+def evolve(evaluator, sets, generations, rand):
+    # The defaults and random sets to start; each generation keeps the
+    # best half and fills the rest with mutated copies of them
+    population = evaluator.evaluate([defaultParameters()] +
+        [randomParameters(rand) for i in xrange(sets - 1)])
+    for generation in xrange(generations):
+        survivors = rank(population)[:max(1, sets/2)]
+        best = survivors[0]
+        print 'generation %d: best %.3f [%.3f, %.3f]' % (generation,
+            best['winRate'], best['low'], best['high'])
+        children = [mutate(rand.choice(survivors)['parameters'], rand)
+            for i in xrange(sets - len(survivors))]
+        population = survivors + evaluator.evaluate(children)
+    return rank(population)
+
+def report(results, evaluator, top = 10):
+    names = ComputerWorld.aiParameters
+    print
+    print '%-22s %5s %5s %5s  %s' % ('win rate [95% CI]', 'win', 'loss',
+        'draw', 'parameters')
+    for result in results[:top]:
+        parameters = result['parameters']
+        flag = ''
+        if parameters == defaultParameters():
+            flag = '  (defaults)'
+        print '%.3f [%.3f, %.3f]   %5d %5d %5d  %s%s' % (result['winRate'],
+            result['low'], result['high'], result['win'], result['loss'],
+            result['draw'], ' '.join(['%s=%s' % (name, parameters[name])
+            for name in names]), flag)
+    print
+    print 'Total: %d matches, %d frames in %.1f s with %d workers' % (
+        evaluator.totalMatches, evaluator.totalFrames, evaluator.totalTime,
+        evaluator.workers)
+    print 'Throughput: %.2f matches/s/core' % evaluator.throughput(
+        evaluator.totalMatches, evaluator.totalTime)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search', choices = ['random', 'evolve'],
+        default = 'random')
+    parser.add_argument('--sets', type = int, default = 8,
+        help = 'parameter sets (per generation, when evolving)')
+    parser.add_argument('--generations', type = int, default = 5)
+    parser.add_argument('--matches', type = int, default = 300,
+        help = 'matches per parameter set')
+    parser.add_argument('--frames', type = int, default = 2400,
+        help = 'longest a match can last, in steps')
+    parser.add_argument('--workers', type = int,
+        help = 'processes to use (default: one per CPU)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--save', help = 'write the ranked results here')
+    args = parser.parse_args()
+    rand = random.Random(args.seed)
+    evaluator = Evaluator(args.matches, args.frames, args.seed, args.workers)
+    try:
+        if args.search == 'random':
+            results = randomSearch(evaluator, args.sets, rand)
+        else:
+            results = evolve(evaluator, args.sets, args.generations, rand)
+    finally:
+        evaluator.close()
+    report(results, evaluator)
+    if args.save:
+        resultsFile = open(args.save, 'w')
+        json.dump({'results': results, 'matches': args.matches,
+            'frames': args.frames, 'seed': args.seed}, resultsFile,
+            indent = 1, sort_keys = True)
+        resultsFile.close()
@@ -0,0 +1,262 @@
+import os
+import time
+import argparse
+import pygame
+from fractions import Fraction
+from Queue import Empty
+from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray
+from GlobalFunctions import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Gameplay video.
+# A FrameRecorder takes frames as they are drawn (level.frameRecorder, or
+# every Nth of them) and a writer process saves them to disk, either as an
+# image sequence in a folder (frame000000.png, ... - or .jpg, .bmp, .tga)
+# or as one YUV4MPEG2 file (.y4m), raw 4:4:4 video that ffmpeg and most
+# players read directly:
+#
+#   ffmpeg -i run.y4m run.mp4
+#
+# The writer is a separate process. Handing it a frame is one blit into a
+# Surface from a fixed pool in shared memory, so the game loop never waits
+# on the encoding. When the writer falls behind and the pool runs out,
+# policy decides: 'drop' skips the frame (the default, so the game keeps
+# its frame rate), 'block' waits for the writer (for offline rendering,
+# where every frame matters). PNG is slow to compress; y4m keeps up best.
+#
+# Offline, a recorded input log (see Recording.py) can be rendered straight
+# to video, headless. Each frame shows the game at its own time in the
+# video, drawn in between steps as the game does, so any frame rate plays
+# at the game's speed:
+#
+#   python Video.py <log.ffi> <out.y4m or folder> [--fps 60] [--every N]
+#       [--format png]
+
+imageFormats = ['png', 'jpg', 'bmp', 'tga']
+
+class FrameRecorder(object):
+
+    def __init__(self, path, format = None, every = 1, queueSize = 8,
+        policy = 'drop', fps = 60):
+        if policy not in ['drop', 'block']:
+            print 'Unknown recording policy:', policy
+            raise SystemExit
+        if format == None:
+            format = os.path.splitext(path)[1][1:].lower() or 'png'
+        if format != 'y4m' and format not in imageFormats:
+            print 'Cannot record frames as', format
+            raise SystemExit
+        if format == 'y4m' and numpy == None:
+            print 'Recording y4m video needs numpy'
+            raise SystemExit
+        self.path = path
+        self.format = format
+        self.every = every
+        self.queueSize = queueSize
+        self.policy = policy
+        self.fps = Fraction(fps)/every # of the frames kept
+        self.pool = None # Surfaces over shared memory, made at the first frame
+        self.writer = None
+        self.seen = self.sent = self.written = self.dropped = 0
+        self.seconds = self.slowest = 0.0 # spent in add()
+        self.error = None
+
+    def start(self, size):
+        # The writer is a process, so encoding never holds up the game
+        # (PNG compression keeps hold of the interpreter lock)
+        width, height = size
+        buffers = [RawArray('B', width*height*4)
+            for i in xrange(self.queueSize)]
+        self.pool = [pygame.image.frombuffer(buffer, size, 'RGBX')
+            for buffer in buffers]
+        self.frames = Queue()
+        self.free = Queue()
+        self.results = Queue()
+        for index in xrange(self.queueSize):
+            self.free.put(index)
+        self.writer = Process(target = runWriter, args = (self.frames,
+            self.free, self.results, buffers, size, self.path, self.format,
+            self.fps))
+        self.writer.daemon = True
+        self.writer.start()
+
+    def add(self, surface):
+        # Called with each frame as it is shown
+        self.seen += 1
+        if (self.seen - 1) % self.every != 0:
+            return
+        start = time.time()
+        if self.pool == None:
+            self.start(surface.get_size())
+        try:
+            index = self.free.get(self.policy == 'block')
+        except Empty:
+            self.dropped += 1
+        else:
+            self.pool[index].blit(surface, (0, 0))
+            self.frames.put(index)
+            self.sent += 1
+        seconds = time.time() - start
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+
+    def close(self):
+        # Waits for the writer to finish what is queued
+        if self.writer == None:
+            return
+        self.frames.put(None)
+        self.written, self.error = self.results.get()
+        self.writer.join()
+        self.writer = None
+        if self.error != None:
+            print 'Frame recording stopped:', self.error
+
+    def stats(self):
+        added = max(self.seen/self.every, 1)
+        return {'seen': self.seen, 'sent': self.sent,
+            'written': self.written, 'dropped': self.dropped,
+            'mean': self.seconds/added*1000, 'slowest': self.slowest*1000}
+
+    def report(self):
+        stats = self.stats()
+        return ('frames: %d seen, %d written, %d dropped; %.3f ms/frame '
+            'in the game loop (slowest %.3f ms)' % (stats['seen'],
+            stats['written'], stats['dropped'], stats['mean'],
+            stats['slowest']))
+
+# Writer process
+
+def runWriter(frames, free, results, buffers, size, path, format, fps):
+    pool = [pygame.image.frombuffer(buffer, size, 'RGBX')
+        for buffer in buffers]
+    video = None
+    if format == 'y4m':
+        video = VideoWriter(path, size, fps)
+    elif not os.path.isdir(path):
+        os.makedirs(path)
+    written = 0
+    error = None
+    while True:
+        index = frames.get()
+        if index == None:
+            break
+        try:
+            if error == None:
+                if video != None:
+                    video.write(buffers[index])
+                else:
+                    name = 'frame%06d.%s' % (written, format)
+                    pygame.image.save(pool[index], os.path.join(path, name))
+                written += 1
+        except (IOError, OSError, pygame.error), e:
+            error = str(e)
+        free.put(index)
+    if video != None:
+        video.close()
+    results.put((written, error))
+
+class VideoWriter(object):
+
+    # YUV4MPEG2, 4:4:4: a text header, then for each frame 'FRAME' and the
+    # Y, U and V planes one after another
+
+    def __init__(self, path, size, fps):
+        # fps can be a Fraction; the header takes it as a ratio
+        width, height = size
+        fps = Fraction(fps)
+        self.videoFile = open(path, 'wb')
+        self.videoFile.write('YUV4MPEG2 W%d H%d F%d:%d Ip A1:1 C444\n' % (
+            width, height, fps.numerator, fps.denominator))
+        # Scratch arrays for the conversion, used for every frame
+        self.rgb = numpy.zeros((height*width, 3), numpy.float32)
+        self.yuv = numpy.zeros((3, height*width), numpy.float32)
+        self.planes = numpy.zeros((3, height*width), numpy.uint8)
+
+    def write(self, buffer):
+        pixels = numpy.frombuffer(buffer, numpy.uint8).reshape(-1, 4)
+        # BT.601, studio range
+        numpy.copyto(self.rgb, pixels[:, :3])
+        numpy.dot(yuvMatrix, self.rgb.T, out = self.yuv)
+        numpy.add(self.yuv, yuvOffsets, out = self.yuv)
+        numpy.clip(self.yuv, 0, 255, out = self.yuv)
+        numpy.copyto(self.planes, self.yuv, casting = 'unsafe')
+        self.videoFile.write('FRAME\n')
+        self.videoFile.write(self.planes.data)
+
+    def close(self):
+        self.videoFile.close()
+
+if numpy != None:
+    yuvMatrix = numpy.array([[0.257, 0.504, 0.098],
+        [-0.148, -0.291, 0.439], [0.439, -0.368, -0.071]], numpy.float32)
+    yuvOffsets = numpy.array([[16.5], [128.5], [128.5]], numpy.float32)
+
+# Offline rendering
+
+def getLevelTypes():
+    from Level import GameLevel, TwoPlayerLevel
+    from ComputerLevel import ComputerLevel
+    return {'GameWorld': GameLevel, 'TwoPlayerWorld': TwoPlayerLevel,
+        'ComputerWorld': ComputerLevel}
+
+def renderLog(log, recorder, fps = 60, holdSeconds = 1):
+    # Draws the run in log frame by frame into recorder; -> frames drawn
+    from Recording import makeWorld
+    from Benchmark import BenchmarkClock
+    level = getLevelTypes()[log.worldType](log.levelFile)
+    screen = pygame.display.get_surface()
+    level.start(log.size, screen, BenchmarkClock())
+    level.world = world = makeWorld(log)
+    level.mode = None
+    level.BossInstructions = False
+    end = log.endFrame or 0
+    frames = 0
+    while world.mode == None:
+        # Frame number frames is frames/fps seconds in: as in
+        # Level.stepWorld, the world has taken every step due by then,
+        # and the rest of a step is drawn by interpolating
+        position = Fraction(frames*world.stepRate)/fps
+        if position > end:
+            break
+        while world.frame < int(position) and world.mode == None:
+            world.step(log.inputs.get(world.frame, ()))
+        level.redrawAll(float(position - int(position)))
+        recorder.add(screen)
+        frames += 1
+    # Then the end of level screen for a moment
+    level.mode = world.mode
+    for i in xrange(int(holdSeconds*fps)):
+        level.redrawAll(1)
+        recorder.add(screen)
+        frames += 1
+    level.close()
+    return frames
+
+if __name__ == '__main__':
+    from Recording import InputLog
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log')
+    parser.add_argument('output', help = 'a .y4m file, or a folder for '
+        'an image sequence')
+    parser.add_argument('--fps', type = int, default = 60)
+    parser.add_argument('--every', type = int, default = 1,
+        help = 'keep every Nth frame')
+    parser.add_argument('--format', choices = ['y4m'] + imageFormats)
+    args = parser.parse_args()
+    log = InputLog(args.log)
+    initHeadless(log.size)
+    recorder = FrameRecorder(args.output, args.format, args.every,
+        policy = 'block', fps = args.fps)
+    start = time.time()
+    frames = renderLog(log, recorder, args.fps)
+    recorder.close()
+    seconds = time.time() - start
+    print recorder.report()
+    print '%d frames (%.1f s of video) in %.1f s: %.1fx real time' % (
+        frames, float(frames)/args.fps, seconds,
+        frames/float(args.fps)/max(seconds, 1e-9))
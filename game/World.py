@@ -0,0 +1,640 @@
+import pygame
+import random
+from pygame.locals import *
+import math
+from Classes import *
+from Particles import *
+from Contacts import *
+from GlobalFunctions import *
+
+# Simulation core for every level type.
+# A world owns the game objects and advances them one frame per step(), but
+# never draws, ticks a clock or reads pygame events - so it can also run
+# headless (see initHeadless) as fast as the CPU allows.
+# The level classes in Level.py and ComputerLevel.py draw a world and turn
+# keypresses into its inputs.
+
+# Inputs to step() are (playerNumber, command) pairs, in the same encoding
+# as the boss's movesList: 0 = jump, 1 or -1 = walk in that direction.
+# Player 0 is the world itself, for the debug keys that change it:
+# powerUpCheat (the g key) makes the next power-up due. Going through the
+# inputs means input logs record them, and replays match.
+
+# Worlds step stepRate times per second of game time. Physics is written
+# per tick of the original 20 fps game (tickRate), and each step advances
+# it by dt ticks.
+
+# Every random choice comes from the world's own generator, and sprite
+# groups keep the order sprites were added in, so a world with the same
+# seed, players and inputs always plays out the same (see Recording.py).
+
+def copySpriteState(state):
+    # Copies of a sprite's attributes; rects and group records are the only
+    # ones changed in place
+    state = dict(state)
+    for name, value in state.items():
+        if isinstance(value, pygame.Rect):
+            state[name] = pygame.Rect(value)
+        elif isinstance(value, (dict, list)):
+            state[name] = type(value)(value)
+    return state
+
+class WorldRandom(random.Random):
+
+    # The world's random number generator: splitmix64, whose whole state is
+    # one 64 bit number, so saving it (which rollback does every step, see
+    # Snapshot.py) costs next to nothing. The Mersenne Twister behind
+    # random.Random keeps 2.5 KB of state.
+
+    mask = (1 << 64) - 1
+
+    def seed(self, a = None):
+        if a == None:
+            a = random.randrange(1 << 64)
+        self.state = hash(a) & self.mask
+        self.gauss_next = None
+
+    def next64(self):
+        self.state = z = (self.state + 0x9E3779B97F4A7C15) & self.mask
+        z = ((z ^ (z >> 30))*0xBF58476D1CE4E5B9) & self.mask
+        z = ((z ^ (z >> 27))*0x94D049BB133111EB) & self.mask
+        return z ^ (z >> 31)
+
+    def random(self):
+        return (self.next64() >> 11)*(1.0/(1 << 53))
+
+    def getrandbits(self, k):
+        bits = 0
+        for shift in xrange(0, k, 64):
+            bits |= self.next64() << shift
+        return bits & ((1 << k) - 1)
+
+    def getstate(self):
+        return self.state
+
+    def setstate(self, state):
+        self.state = state
+
+    def jumpahead(self, n):
+        self.state = (self.state + n*0x9E3779B97F4A7C15) & self.mask
+
+class GameWorld(object):
+
+    blockLimit = 2 # falling blocks (including the player) at once
+    tickRate = 20
+    powerUpCheat = 2 # world (player 0) command
+    # Hits need the sprites' drawn pixels to overlap, not just their rects
+    # (see collide)
+    pixelCollisions = False
+    # Settings input logs need to replay a world
+    recordedOptions = ['pixelCollisions']
+
+    def __init__(self, levelData, size = (600, 600), stepRate = 20,
+        seed = None):
+        if seed == None:
+            seed = random.randrange(1 << 32)
+        self.seed = seed
+        self.random = WorldRandom(seed)
+        self.levelData = data = levelData
+        self.screenSize = size
+        self.stepRate = stepRate
+        self.dt = float(self.tickRate)/stepRate
+        self.maxBlocks = data['maxBlocks']
+        self.platformsList = data['platforms']
+        self.enemiesList = data['enemies']
+        self.player = None
+        self.init()
+
+    # Stepping
+
+    def step(self, inputs = ()):
+        self.applyInputs(inputs)
+        self.update()
+
+    def update(self):
+        self.previous = dict((sprite, sprite.rect.topleft)
+            for sprite in self.allsprites)
+        self.allsprites.update(self.dt)
+        if self.storm != None:
+            self.storm.update(self.dt)
+        self.handleCollisions()
+        self.frame += 1
+
+    # Snapshots
+
+    # A snapshot holds everything a step can change, so a world can be
+    # rolled back to it (e.g. after trying out moves ahead of time). Sprite
+    # images are shared with the live sprites, not copied: nothing draws on
+    # them, they only ever get replaced.
+
+    def snapshot(self):
+        state = {}
+        groups = {}
+        sprites = {}
+        for name, value in self.__dict__.items():
+            if isinstance(value, pygame.sprite.AbstractGroup):
+                groups[name] = value.sprites()
+                for sprite in groups[name]:
+                    if sprite not in sprites:
+                        sprites[sprite] = copySpriteState(sprite.__dict__)
+            elif isinstance(value, list):
+                state[name] = list(value)
+            elif isinstance(value, dict):
+                state[name] = dict(value)
+            else:
+                state[name] = value
+        state['random'] = self.random.getstate()
+        state['contacts'] = self.contacts.snapshot()
+        if self.storm != None:
+            state['storm'] = self.storm.snapshot()
+        return (state, groups, sprites)
+
+    def restore(self, snapshot):
+        state, groups, sprites = snapshot
+        for name, members in groups.items():
+            group = self.__dict__[name]
+            group.empty()
+            group.add(*members)
+        for sprite, spriteState in sprites.items():
+            sprite.__dict__.clear()
+            sprite.__dict__.update(copySpriteState(spriteState))
+        random, contacts, storm = self.random, self.contacts, self.storm
+        for name, value in state.items():
+            if isinstance(value, list):
+                value = list(value)
+            elif isinstance(value, dict):
+                value = dict(value)
+            self.__dict__[name] = value
+        self.random = random
+        self.random.setstate(state['random'])
+        self.contacts = contacts
+        self.contacts.restore(state['contacts'])
+        self.storm = storm
+        if storm != None:
+            storm.restore(state['storm'])
+
+    def interpolate(self, sprite, alpha):
+        # Where to draw a sprite, alpha of the way from the last step
+        # to this one. Sprites that jumped (respawned, wrapped around
+        # the screen) are just drawn where they are.
+        x, y = sprite.rect.topleft
+        if sprite not in self.previous:
+            return x, y
+        oldX, oldY = self.previous[sprite]
+        if abs(x - oldX) + abs(y - oldY) > 100:
+            return x, y
+        return (int(oldX + (x - oldX)*alpha), int(oldY + (y - oldY)*alpha))
+
+    def applyInputs(self, inputs):
+        for number, command in inputs:
+            if number == 0:
+                if command == self.powerUpCheat:
+                    self.powerUpCounter = self.powerUpInt - 1
+                continue
+            player = self.getPlayer(number)
+            if player == None:
+                continue
+            if command == 0:
+                player.jump()
+            elif command == 1 or command == -1:
+                player.walk(command)
+
+    def getPlayer(self, number):
+        # Only one player in 1P levels
+        if number == 1:
+            return self.player
+
+    def resetPlayer(self):
+        # Because 2P mode has a different reset player
+        self.player.reset()
+
+    # Update game elements at each frame:
+
+    def handleCollisions(self):
+        self.handlePlatformCollisions()
+        self.enemyCollisions()
+        self.newBlocks()
+        if self.player != None:
+            self.handlePowerUps()
+            self.setPowerUps()
+        self.adjustBlocks()
+        self.clearOldSprites()
+        if self.player.lives == 0:
+            self.player.kill()
+            self.mode = "Over"
+        elif len(self.enemies) == 0:
+            blocksBonus = self.maxBlocks - self.blockCounter
+            self.player.score += blocksBonus
+            self.mode = 'Won'
+
+    def clearOldSprites(self):
+        # Manages any sprites that go off-screen
+        width, height = self.screenSize
+        if self.storm != None:
+            self.storm.clearOldDrops()
+        for sprite in self.allsprites:
+            if (sprite.rect.top > height):
+                if sprite == self.player:
+                    self.player.loseLife(True)
+                    self.contacts.forget(sprite)
+                else:
+                    sprite.kill()
+            elif (sprite.rect.left < 0 or sprite.rect.right > width):
+                if sprite == self.player:
+                    sprite.rect.left = sprite.rect.left % width
+                else:
+                    sprite.kill()
+
+    def setPowerUps(self):
+        self.powerUpCounter += self.dt
+        # Get rectangular limits of where powerups can be placed
+        (x1, x2) = self.levelData['powerupsX']
+        (y1, y2) = self.levelData['powerupsY']
+        # Due on the step where the counter reaches powerUpInt
+        due = self.powerUpCounter - self.dt < self.powerUpInt
+        due = due and self.powerUpInt <= self.powerUpCounter
+        if len(self.powerUps) == 0 and due:
+            x = self.random.randint(x1, x2)
+            y = self.random.randint(y1, y2)
+            self.newPowerUp(x, y)
+            self.powerUpCounter = 0
+            # Decide how long to wait before next powerup spawns:
+            wait = self.random.randint(self.powerTimeMin, self.powerTimeMax)
+            self.powerUpInt = wait
+
+    # Collisions and more physics
+
+    # Rects overlapping is a hit, unless pixelCollisions is on: then it only
+    # means the sprites' masks (made once per image and angle, see
+    # ImageCache.py) are worth checking for overlapping pixels. Rotated
+    # drops and fireballs have transparent corners in their rects.
+
+    def collide(self, a, b):
+        if not a.rect.colliderect(b.rect):
+            return False
+        return not self.pixelCollisions or collideMasks(a, b)
+
+    def spritesHit(self, sprite, group):
+        hitList = pygame.sprite.spritecollide(sprite, group, False)
+        if self.pixelCollisions and hitList != []:
+            mask = getMask(sprite.image)
+            x, y = sprite.rect.topleft
+            hitList = [other for other in hitList
+                if mask.overlap(getMask(other.image), (other.rect.x - x,
+                other.rect.y - y)) != None]
+        return hitList
+
+    def stormHit(self, sprite, dropType = None):
+        if self.pixelCollisions:
+            return self.storm.collideSprite(sprite, dropType)
+        return self.storm.collideRect(sprite.rect, dropType)
+
+    def handlePowerUps(self):
+        power = None
+        for powerup in self.powerUps:
+            if self.collide(powerup, self.player):
+                self.player.reset()
+                self.player.power = power = powerup.power
+                powerup.kill()
+        if power == 'Heavy':
+            self.player.changeWeight(2) # doubles player weight
+        elif power == "Light":
+            self.player.changeWeight(0.5) # halves player weight
+        elif power == "Fast":
+            self.player.speed *= 2
+            # This has no effect yet
+        elif power == "Slow":
+            self.player.speed /= 2
+            # ALso no effect
+
+    def handlePlatformCollisions(self):
+        # Contacts found here are used for the rest of the step
+        self.contacts.build(self.fallingBlocks, self.platforms)
+        stormWeights = {}
+        if self.storm != None:
+            stormWeights = self.storm.collidePlatforms(self.platforms)
+        for platform in self.platforms:
+            totalweight = stormWeights.get(platform, 0)
+            for block in self.contacts.blocksOn(platform):
+                totalweight += self.getBlockWeight(block, platform)
+                if block.onPlatform == False: # just landed
+                    block.vy = 0
+                    block.jumpStep = 0
+                block.onPlatform = True
+            platform.adjustPlatformAngle(totalweight)
+        for block in self.fallingBlocks:
+            if self.platformsHit(block) == []:
+                block.onPlatform = False
+
+    def enemyCollisions(self):
+        for enemy in self.enemies:
+            if not enemy.block:
+                hitList = self.spritesHit(enemy, self.fallingBlocks)
+                for block in hitList:
+                    if block == self.player and not self.player.block:
+                        self.player.loseLife()
+                        enemy.loseLife()
+                    elif block != self.player:
+                        enemy.loseLife()
+                if self.storm != None and self.stormHit(enemy):
+                    enemy.loseLife()
+                if enemy.lives == 0:
+                    enemy.kill()
+                    self.player.score += 1
+
+    def platformsHit(self, block):
+        return self.contacts.platformsHit(block)
+
+    def isOnPlatform(self, block, platform, y = None):
+        # Compares y-location to calculated point on platform
+        # and checks whether the block will hit the platform at the next frame
+        # y: the result of getY, if it has already been worked out
+        blockCx, blockCy = block.rect.center
+        if blockCx < platform.rect.left or blockCx > platform.rect.right:
+            return False
+        if y == None:
+            y = self.getY(block, platform)
+        return ((block.rect.bottom - y) < block.terminalVelocity and
+            abs(y - block.rect.bottom) < platform.height)
+
+    def getY(self, block, platform):
+        # Returns what the y-value of the block would be (within some error)
+        # if it were on the platform.
+        blockCx, blockCy = block.rect.center
+        dx = blockCx - platform.cx
+        y = platform.cy - (dx*math.tan(platform.angle*math.pi/180))
+        return y - platform.height/2
+
+    def adjustBlocks(self):
+        if self.storm != None:
+            self.storm.settle(self.dt)
+        for block in self.fallingBlocks:
+            platformsHit = self.platformsHit(block)
+            if platformsHit == []:
+                # return to normal!
+                block.targetAngle = -block.angle/14.0
+            else:
+                for platform in platformsHit:
+                    # should only have one
+                    block.targetAngle = platform.angle - block.angle
+                    block.vx -= platform.angle/30.0*self.dt
+                    if block.vy >= 0:
+                        y = self.contacts.surfaceY(block, platform)
+                        block.rect.bottom = y
+
+    def getBlockWeight(self, block, platform):
+        # Calculates how much a block weighs down a platform
+        blockCx, blockCy = block.rect.center
+        distance = platform.cx - blockCx
+        return block.weight * distance
+
+    # Functions that make new game objects and add them to appropriate lists
+
+    def newFireball(self, x, y, enemy = Fireball, lives = 3):
+        fireball = enemy(x, y, lives)
+        self.allsprites.add(fireball)
+        self.enemies.add(fireball)
+
+    def newPlatform(self, x, y, platform = Platform):
+        newPlatform = platform(x, y)
+        self.allsprites.add(newPlatform)
+        self.platforms.add(newPlatform)
+
+    def placePlayer(self, x, y):
+        if self.player == None:
+            # Create new player
+            self.player = Player(x, y)
+        else:
+            self.player.rect.left = x
+            self.player.rect.top = y
+            self.player.fullReset()
+        self.allsprites.add(self.player)
+        self.fallingBlocks.add(self.player)
+
+    def newBlocks(self):
+        # Storm mode can drop more than one block per frame
+        for i in range(self.dropsPerFrame):
+            self.newBlock()
+
+    def newBlock(self):
+        # Creates new block from random drop location
+        width, height = self.screenSize
+        if self.blocksInPlay() < self.blockLimit and self.player != None:
+            if self.blockCounter == self.maxBlocks:
+                self.mode = 'Over'
+            else:
+                self.dropBlock(Raindrop)
+
+    def dropBlock(self, blockType):
+        x = self.getDropLocation()
+        self.blockCounter += 1
+        if self.storm != None:
+            # Storm drops are simulated by the drop system, not as sprites
+            self.storm.add(x, 0, blockType.dropType)
+        else:
+            block = blockType(x,0)
+            self.allsprites.add(block)
+            self.fallingBlocks.add(block)
+            self.currentBlock = block
+
+    def blocksInPlay(self):
+        blocks = len(self.fallingBlocks)
+        if self.storm != None:
+            blocks += self.storm.count
+        return blocks
+
+    def getDropLocation(self):
+        # Requires that level data has a dropSpace key
+        # Each entry in dropSpace is a range of legal drop positions
+        xList = []
+        for (x1, x2) in self.levelData['dropSpace']:
+            sizeConstant = (abs(x1 - x2)/20)
+            # Prevents small ranges from being overrepresented in random choice
+            if sizeConstant < 1:
+                sizeConstant = 1
+            xList += [self.random.randint(x1, x2)]*sizeConstant
+        return self.random.choice(xList)
+
+    def newPowerUp(self, x, y):
+        powerUp = PowerUp(x, y, self.random)
+        self.allsprites.add(powerUp)
+        self.powerUps.add(powerUp)
+
+    # Set up stuff
+
+    def init(self):
+        self.mode = None
+        self.frame = 0
+        self.previous = {} # sprite positions before the last step
+        self.contacts = ContactTable(self)
+        self.storm = None
+        self.dropsPerFrame = 1
+        self.blockCounter = 0
+        self.allsprites = pygame.sprite.OrderedUpdates()
+        self.platforms = pygame.sprite.OrderedUpdates()
+        self.fallingBlocks = pygame.sprite.OrderedUpdates()
+        self.powerUps = pygame.sprite.OrderedUpdates()
+        self.powerTimeMin, self.powerTimeMax = 200, 400
+        self.powerUpInt = self.random.randint(self.powerTimeMin,
+            self.powerTimeMax)
+        self.enemies = pygame.sprite.OrderedUpdates()
+        self.powerUpCounter = 0
+        self.setPlatforms()
+        self.setEnemies()
+        self.setOptions()
+
+    def setPlatforms(self):
+        width, height = self.screenSize
+        cx, cy = width/2, (height) - 100
+        self.mainPlatform = mainPlatform = MainPlatform(cx, cy)
+        self.platforms.add(mainPlatform)
+        self.allsprites.add(mainPlatform)
+        for pCx, pCy in self.platformsList:
+            self.newPlatform(pCx, pCy)
+
+    def setEnemies(self):
+        for x, y in self.enemiesList:
+            self.newFireball(x, y)
+
+    def setOptions(self):
+        if 'lockingPlatforms' in self.levelData:
+            for pCx, pCy in self.levelData['lockingPlatforms']:
+                self.newPlatform(pCx, pCy, LockingPlatform)
+        if 'movingEnemies' in self.levelData:
+            for x, y in self.levelData['movingEnemies']:
+                self.newFireball(x, y, MovingFireball)
+        if 'storm' in self.levelData:
+            self.startStorm(*self.levelData['storm'])
+
+    def startStorm(self, blockLimit = 1000, dropsPerFrame = 10):
+        # Storm mode: hundreds or thousands of drops at once, all simulated
+        # together by a DropSystem (needs numpy)
+        self.storm = DropSystem(self.screenSize)
+        self.blockLimit = blockLimit
+        self.dropsPerFrame = dropsPerFrame
+
+class TwoPlayerWorld(GameWorld):
+
+    # Edited some functions to accomodate a list of players
+
+    blockLimit = 3
+
+    def __init__(self, levelData, size = (600, 600), stepRate = 20,
+        seed = None):
+        self.player1 = self.player2 = None
+        super(TwoPlayerWorld, self).__init__(levelData, size, stepRate,
+            seed)
+
+    def getPlayer(self, number):
+        if number == 1:
+            return self.player1
+        elif number == 2:
+            return self.player2
+
+    # Game mechanics
+
+    def handleCollisions(self):
+        self.handlePlatformCollisions()
+        self.enemyCollisions()
+        self.newBlocks()
+        self.handlePowerUps()
+        self.setPowerUps()
+        self.adjustBlocks()
+        self.clearOldSprites()
+        for player in self.playersList:
+            if player.lives == 0:
+                if player == self.player1:
+                    self.player2.score += 1
+                else: self.player1.score += 1
+                self.resetPlayer()
+                self.mode = "Over"
+
+    def resetPlayer(self):
+        # Simle rest on both players
+        self.player1.reset()
+        self.player2.reset()
+
+    def clearOldSprites(self):
+        # Manages any sprites that go off-screen
+        width, height = self.screenSize
+        if self.storm != None:
+            self.storm.clearOldDrops()
+        for sprite in self.allsprites:
+            if (sprite.rect.top > height):
+                if isinstance(sprite, Player):
+                    sprite.loseLife(True)
+                    self.contacts.forget(sprite)
+                else:
+                    sprite.kill()
+            elif (sprite.rect.left < 0 or sprite.rect.right > width):
+                if isinstance(sprite, Player):
+                    sprite.rect.left = sprite.rect.left % width
+                else:
+                    sprite.kill()
+
+    # Collisions and physics
+
+    def handlePowerUps(self):
+        power = None
+        for powerup in self.powerUps:
+            for player in self.playersList:
+                if self.collide(powerup, player):
+                    player.reset()
+                    player.power = power = powerup.power
+                    updatePlayer = player
+                powerup.kill()
+        if power != None:
+            self.applyPowerUp(updatePlayer, power)
+
+    def applyPowerUp(self, player, power):
+        if power == 'Heavy':
+            player.changeWeight(2) # doubles player weight
+        elif power == "Light":
+            player.changeWeight(0.5) # halves player weight
+        elif power == "Fast":
+            player.speed *= 2
+        elif power == "Slow":
+            player.speed /= 2.0
+
+    def enemyCollisions(self):
+        # Lose lives when hit by raindrops or by each other
+        for player in self.playersList:
+            hitList = self.spritesHit(player, self.fallingBlocks)
+            for block in hitList:
+                if not player.block and not isinstance(block, Player):
+                    player.loseLife()
+            if self.storm != None and not player.block:
+                if self.stormHit(player):
+                    player.loseLife()
+
+    def newBlock(self):
+        width, height = self.screenSize
+        if self.blocksInPlay() < self.blockLimit:
+            if self.blockCounter == self.maxBlocks:
+                self.mode = 'Over'
+            else:
+                self.dropBlock(Raindrop)
+
+    def placePlayers(self):
+        (x1, y1) = self.levelData['Player1Pos']
+        (x2, y2) = self.levelData['Player2Pos']
+        self.player1 = self.placePlayer(x1, y1, 1, self.player1)
+        self.player2 = self.placePlayer(x2, y2, 2, self.player2)
+
+    def placePlayer(self, x, y, number, player):
+        if player == None:
+            player = Player(x, y, number)
+        else:
+            player.rect.left = x
+            player.rect.top = y
+            player.fullReset()
+        self.allsprites.add(player)
+        self.fallingBlocks.add(player)
+        self.playersList.add(player)
+        return player
+
+    # Set up stuff
+
+    def init(self):
+        self.playersList = pygame.sprite.OrderedUpdates()
+        super(TwoPlayerWorld, self).init()
@@ -2,15 +2,36 @@ import pygame
 import random
 from pygame.locals import *
 import math
-import shelve
 import os
+import sys
 from Classes import *
 from GlobalFunctions import *
-from Level import *
-from ComputerLevel import *
+from Assets import assets
+
+# Startup only loads what the start screen needs before drawing it. The
+# level modules are imported after the first frame, while every other image
+# is decoded on a thread pool, then converted as the decodes finish.
 
 class Game(object):
 
+    # Images decoded in the background while the start screen is up
+    laterImages = ['Backgrounds/instructions.png',
+        'Backgrounds/instructions1.png', 'Backgrounds/instructions2.png',
+        'Buttons/back.png', 'Buttons/forward.png', 'Buttons/return.png',
+        'Backgrounds/pausesurface.png', 'Backgrounds/oversurface.png',
+        'Backgrounds/winsurface.png', 'Backgrounds/redwin.png',
+        'Backgrounds/bluewin.png', 'Backgrounds/draw.png',
+        'Buttons/retry.png', 'Buttons/quit.png', 'Buttons/nextlevel.png']
+    laterImages += spriteAssets
+
+    recordFolder = None # log every level's inputs here (see Recording.py)
+    bossPlanning = False # a stronger boss that plans ahead
+    pixelCollisions = False # hits only where sprites' pixels overlap
+    storm = False # play the storm level (see DropSystem) before the boss
+    dirtyRendering = False # redraw only what changed (see Renderer.py)
+    videoPath = None # record what levels show here (see Video.py)
+    profiler = None # a LevelProfiler for levels (see Profiling.py)
+
     def mousePressed(self, event):
         (x, y) = self.mousePos
         if self.mode == None:
@@ -28,6 +49,8 @@ class Game(object):
         elif eventName == '2p':
             self.mode = 2
         elif eventName == 'instruct':
+            if self.instructions == None:
+                self.initInstructions()
             self.mode = 'Instructions'
         # Back and forwards buttons should only be in instrutions
         elif eventName == 'back':
@@ -42,6 +65,7 @@ class Game(object):
 
     def timerFired(self):
         self.redrawAll()
+        self.finishLoading()
         self.mousePos = pygame.mouse.get_pos()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -63,14 +87,26 @@ class Game(object):
 
     def init(self):
         self.mode = None
+        self.frameRecorder = None
         self.player = None
         self.player2 = None
-        self.makeLevels()
+        self.levels = self.instructions = None
+        self.loading = True
         self.initStartScreen()
-        self.initInstructions()
         self.currentLevel = 0
         self.current2p = 0
 
+    def finishLoading(self):
+        # The rest of startup, once the start screen is showing
+        if self.levels == None:
+            assets.decodeInBackground(self.laterImages)
+            self.makeLevels()
+            self.levels[0].prefetch() # while the start screen is up
+        elif self.loading:
+            self.loading = assets.convertDecoded() > 0
+            if not self.loading and self.instructions == None:
+                self.initInstructions()
+
     def initStartScreen(self):
         # Background image from http://www.graphic-cauldron.blogspot.it/
         self.startMenuSprites = pygame.sprite.Group()
@@ -97,21 +133,40 @@ class Game(object):
         self.instructionsButtons.add(back, forwards, goBack)
 
     def makeLevels(self):
-        # All the same level for now.
-        # Just to test ability to switch between them
-        enemies2 = [(400, 400)]
-        level1 = GameLevel('Levels/level1')
-        level2 = GameLevel('Levels/level2')
-        level3 = GameLevel('Levels/level3')
-        BossLevel = ComputerLevel('Levels/level2p1')
-        level2p2 = TwoPlayerLevel('Levels/level2p1')
+        # Handles only; each level is loaded when it is played (see
+        # LevelHandle in Level.py). Imported here, not at the top, so the
+        # start screen doesn't wait for them.
+        from Level import GameLevel, TwoPlayerLevel, LevelHandle
+        from ComputerLevel import ComputerLevel
+        GameLevel.recordFolder = self.recordFolder
+        if self.videoPath != None and self.frameRecorder == None:
+            from Video import FrameRecorder
+            self.frameRecorder = FrameRecorder(self.videoPath,
+                fps = GameLevel.frameRate)
+            GameLevel.frameRecorder = self.frameRecorder
+        GameLevel.profiler = self.profiler
+        ComputerLevel.planning = self.bossPlanning
+        GameLevel.pixelCollisions = self.pixelCollisions
+        GameLevel.dirtyRendering = self.dirtyRendering
+        level1 = LevelHandle(GameLevel, 'Levels/level1')
+        level2 = LevelHandle(GameLevel, 'Levels/level2')
+        level3 = LevelHandle(GameLevel, 'Levels/level3')
+        BossLevel = LevelHandle(ComputerLevel, 'Levels/level2p1')
+        level2p2 = LevelHandle(TwoPlayerLevel, 'Levels/level2p1')
         self.levels = [level1, level2, level3, BossLevel]
+        if self.storm:
+            stormLevel = LevelHandle(GameLevel, 'Levels/storm')
+            self.levels.insert(3, stormLevel)
         self.levels2p = [level2p2]
 
     def playLevel(self):
-        level = self.levels[self.currentLevel]
+        handle = self.levels[self.currentLevel]
+        level = handle.open()
+        if self.currentLevel + 1 < len(self.levels):
+            level.nextLevel = self.levels[self.currentLevel + 1]
         result = level.run(self.screenSize, self.screen, self.clock,
             self.player)
+        handle.close()
         if result == False: # Exited game
             self.mode = False
         elif result == None: # Quit to main menu, reset the round
@@ -123,9 +178,11 @@ class Game(object):
             self.currentLevel += 1
 
     def play2pLevel(self):
-        level = self.levels2p[self.current2p]
+        handle = self.levels2p[self.current2p]
+        level = handle.open()
         result = level.run(self.screenSize, self.screen, self.clock,
             self.player, self.player2)
+        handle.close()
         if result == False: # Exited game
             self.mode = False
         elif result == None: # Quit to main menu, reset the round
@@ -136,6 +193,9 @@ class Game(object):
             self.currentLevel += 1
 
     def resetLevels(self):
+        # Lets go of levels prefetched but never played, too
+        for handle in self.levels + self.levels2p:
+            handle.close()
         self.mode = None
         self.currentLevel = 0
         self.current2p = 0
@@ -161,6 +221,29 @@ class Game(object):
                 else: self.play2pLevel()
             else:
                 self.timerFired()
+        if self.frameRecorder != None:
+            self.frameRecorder.close()
         pygame.quit()
 
-Game().run()
+if __name__ == '__main__':
+    game = Game()
+    if '--record' in sys.argv[1:-1]:
+        game.recordFolder = sys.argv[sys.argv.index('--record') + 1]
+    game.bossPlanning = '--planner' in sys.argv
+    game.pixelCollisions = '--pixel-collisions' in sys.argv
+    game.storm = '--storm' in sys.argv
+    game.dirtyRendering = '--dirty-rendering' in sys.argv
+    if '--video' in sys.argv[1:-1]:
+        game.videoPath = sys.argv[sys.argv.index('--video') + 1]
+    if '--profile' in sys.argv[1:-1]:
+        from Profiling import LevelProfiler, parseFrames
+        levels = frames = None
+        if '--profile-levels' in sys.argv[1:-1]:
+            levels = sys.argv[sys.argv.index('--profile-levels') + 1]
+            levels = levels.split(',')
+        if '--profile-frames' in sys.argv[1:-1]:
+            frames = parseFrames(sys.argv[sys.argv.index(
+                '--profile-frames') + 1])
+        game.profiler = LevelProfiler(sys.argv[sys.argv.index('--profile') +
+            1], levels, frames)
+    game.run()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The game's modules import each other by name and load images and levels
+# by paths relative to the game folder, so the tests run from there.
+# Worlds are simulated headless (see initHeadless).
+
+gameFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, gameFolder)
+os.chdir(gameFolder)
+
+from GlobalFunctions import initHeadless
+initHeadless()
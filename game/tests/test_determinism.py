@@ -0,0 +1,183 @@
+import os
+import pytest
+from GlobalFunctions import load_level
+from World import GameWorld, TwoPlayerWorld
+from ComputerLevel import ComputerWorld
+from Recording import InputRecorder, InputLog, replayLog, worldDigest
+from Snapshot import SnapshotCodec
+from LevelFormat import compiledPath, loadCompiledLevel, validateLevel
+
+# A world is fully decided by its seed, its players and the inputs fed to
+# each step. These check that it is: two runs of the same world, a run and
+# its replay from an input log, and a run and the same run again after
+# rolling back to a snapshot all have to end in the same state.
+#
+#   python -m pytest tests
+
+# (name, world type, level file, players to script)
+levels = [('level1', GameWorld, 'Levels/level1', [1]),
+    ('level2', GameWorld, 'Levels/level2', [1]),
+    ('level3', GameWorld, 'Levels/level3', [1]),
+    ('storm', GameWorld, 'Levels/storm', [1]),
+    ('level2p1', TwoPlayerWorld, 'Levels/level2p1', [1, 2]),
+    ('boss', ComputerWorld, 'Levels/level2p1', [1])]
+levelIds = [name for name, worldType, file, players in levels]
+
+frames = 300
+
+def makeWorld(worldType, file, seed = 7, **options):
+    world = worldType(load_level(file), seed = seed)
+    for name, value in options.items():
+        setattr(world, name, value)
+    if worldType == GameWorld:
+        world.placePlayer(300, 300)
+    else:
+        world.placePlayers()
+    return world
+
+def scriptedInputs(frame, players):
+    # As Benchmark.scriptedInputs: walk one way then the other, jumping
+    # now and then
+    inputs = []
+    for player in players:
+        if frame % 7 == player:
+            inputs += [(player, 0)]
+        elif frame % 3 == 0:
+            inputs += [(player, [1, -1][(frame/40 + player) % 2])]
+    return inputs
+
+def play(world, players, steps, recorder = None):
+    # -> the digest after each step
+    digests = []
+    for i in xrange(steps):
+        if world.mode != None:
+            break
+        inputs = scriptedInputs(world.frame, players)
+        if recorder != None:
+            recorder.record(world.frame, inputs)
+        world.step(inputs)
+        digests += [worldDigest(world)]
+    return digests
+
+@pytest.mark.parametrize('name, worldType, file, players', levels,
+    ids = levelIds)
+def testSameSeedSameRun(name, worldType, file, players):
+    first = play(makeWorld(worldType, file), players, frames)
+    second = play(makeWorld(worldType, file), players, frames)
+    assert first == second
+
+def testSeedsDiffer():
+    first = play(makeWorld(GameWorld, 'Levels/level1', 1), [1], frames)
+    second = play(makeWorld(GameWorld, 'Levels/level1', 2), [1], frames)
+    assert first != second
+
+@pytest.mark.parametrize('pixelCollisions', [False, True])
+@pytest.mark.parametrize('name, worldType, file, players', levels,
+    ids = levelIds)
+def testReplayMatchesRun(tmpdir, name, worldType, file, players,
+    pixelCollisions):
+    world = makeWorld(worldType, file, pixelCollisions = pixelCollisions)
+    path = str(tmpdir.join(name + '.ffi'))
+    recorder = InputRecorder(path, world, file)
+    play(world, players, frames, recorder)
+    recorder.close(world.frame)
+    log = InputLog(path)
+    assert log.options['pixelCollisions'] == pixelCollisions
+    replayed = replayLog(log)
+    assert replayed.frame == world.frame
+    assert worldDigest(replayed) == worldDigest(world)
+
+def testRecorderNeverOverwrites(tmpdir):
+    world = makeWorld(GameWorld, 'Levels/level1')
+    path = str(tmpdir.join('run.ffi'))
+    paths = []
+    for i in xrange(3):
+        recorder = InputRecorder(path, world, 'Levels/level1')
+        recorder.close(0)
+        paths += [recorder.path]
+    assert len(set(paths)) == 3
+    assert sorted(os.listdir(str(tmpdir))) == ['run-2.ffi', 'run-3.ffi',
+        'run.ffi']
+
+@pytest.mark.parametrize('name, worldType, file, players', levels,
+    ids = levelIds)
+def testSnapshotRoundTrip(name, worldType, file, players):
+    world = makeWorld(worldType, file)
+    play(world, players, 100)
+    snapshot = world.snapshot()
+    expected = play(world, players, 100)
+    world.restore(snapshot)
+    assert play(world, players, 100) == expected
+
+@pytest.mark.parametrize('name, worldType, file, players', levels,
+    ids = levelIds)
+def testCodecRoundTrip(name, worldType, file, players):
+    world = makeWorld(worldType, file)
+    codec = SnapshotCodec(world)
+    snapshots = {}
+    expected = {}
+    for i in xrange(150):
+        if world.mode != None:
+            break
+        snapshots[world.frame] = codec.save()
+        world.step(scriptedInputs(world.frame, players))
+        expected[world.frame] = worldDigest(world)
+    # Back to each of a few earlier frames, then forward again
+    end = world.frame
+    for frame in sorted(snapshots)[::-37]:
+        codec.restore(snapshots[frame])
+        assert world.frame == frame
+        while world.frame < end:
+            world.step(scriptedInputs(world.frame, players))
+            assert worldDigest(world) == expected[world.frame]
+
+def testCodecPruneKeepsWindow():
+    # Rolling back within the snapshots kept still works once prune() has
+    # let go of everything older
+    world = makeWorld(TwoPlayerWorld, 'Levels/level2p1')
+    codec = SnapshotCodec(world)
+    codec.pruneInterval = 1
+    snapshots = {}
+    expected = {}
+    for i in xrange(frames):
+        if world.mode != None:
+            break
+        snapshots[world.frame] = codec.save()
+        world.step(scriptedInputs(world.frame, [1, 2]))
+        expected[world.frame] = worldDigest(world)
+        for frame in [frame for frame in snapshots
+            if frame < world.frame - 8]:
+            del snapshots[frame]
+        codec.prune(snapshots.values())
+    end = world.frame
+    codec.restore(snapshots[min(snapshots)])
+    while world.frame < end:
+        world.step(scriptedInputs(world.frame, [1, 2]))
+        assert worldDigest(world) == expected[world.frame]
+    assert None in codec.images # something was let go
+
+def testPowerUpCheatIsAnInput():
+    world = makeWorld(GameWorld, 'Levels/level1')
+    world.step([(0, GameWorld.powerUpCheat)])
+    world.step()
+    assert len(world.powerUps) == 1
+
+# Levels
+
+def shippedLevels():
+    return sorted([os.path.join('Levels', name[:-len('.json')])
+        for name in os.listdir('Levels') if name.endswith('.json')])
+
+@pytest.mark.parametrize('file', shippedLevels())
+def testShippedLevelsValidate(file):
+    level = loadCompiledLevel(compiledPath(file))
+    assert validateLevel(level) == []
+
+def testValidationCatchesProblems():
+    problems = validateLevel({'maxBlocks': -1, 'platforms': [(1, 2, 3)],
+        'dropSpace': [(5, 1)], 'Player1Pos': (1, 2), 'colour': 'red'})
+    assert 'missing enemies' in problems
+    assert 'missing Player2Pos' in problems
+    assert 'unknown key colour' in problems
+    assert len([problem for problem in problems
+        if problem.startswith('bad ')]) == 3